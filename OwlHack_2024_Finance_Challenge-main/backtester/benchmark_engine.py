@@ -0,0 +1,81 @@
+'''
+Script to benchmark the backends of the strategy kernels on a universe
+'''
+
+# import native libraries
+import os
+import sys
+import time
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+
+import numpy as np
+import pandas as pd
+
+# import the internal libraries
+import preference
+import common as cm
+import engine
+from datamatrix import DataMatrixLoader
+from universe import get_universe_registry
+
+def get_prices(pref):
+    '''
+    close prices of the universe, synthetic prices of the same shape when the data directory does not have them all
+    '''
+    registry = get_universe_registry(pref, pref.train_data_dir)
+    universe = registry.get_universe(pref.universe_name)
+    available = registry.filter(universe, pref.start_date, pref.end_date)
+
+    if len(available) == len(universe):
+        loader = DataMatrixLoader(pref, pref.universe_name, universe, pref.start_date, pref.end_date)
+        return loader.get_daily_datamatrix([cm.DataField.close]).get_field_values(cm.DataField.close)
+
+    print(f"Only {len(available)} of the {len(universe)} tickers of {pref.universe_name} have prices, using synthetic prices")
+    nrow = len(pd.bdate_range(pref.start_date, pref.end_date))
+    rng = np.random.default_rng(pref.random_seed)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.015, size = (nrow, len(universe))), axis = 0))
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--universe_name',   dest='universe_name', default = 'S&P 500', help='Name of the Universe')
+    parser.add_argument('--random_seed', dest='random_seed', default = 0, type = int, help='Random Seed')
+    parser.add_argument('--repeat', dest='repeat', default = 5, type = int, help='number of timed runs per backend')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    prices = get_prices(pref)
+    rng = np.random.default_rng(pref.random_seed)
+    signal = rng.random(prices.shape)
+    entry_long, entry_short = signal > 0.95, signal < 0.05
+    print(f"{pref.universe_name}: {prices.shape[0]} periods x {prices.shape[1]} tickers")
+
+    backends = [engine.Engine.NUMPY] + ([engine.Engine.NUMBA] if engine.numba is not None else [])
+    timings = {}
+    results = {}
+    for backend in backends:
+        # the first numba call compiles the kernel or loads it from the cache
+        start = time.time()
+        results[backend] = engine.run_entry_exit(prices, entry_long, entry_short, cm.OneHundredThousand, 1.0, -1.0, engine = backend)
+        first = time.time() - start
+
+        runs = []
+        for _ in range(pref.repeat):
+            start = time.time()
+            engine.run_entry_exit(prices, entry_long, entry_short, cm.OneHundredThousand, 1.0, -1.0, engine = backend)
+            runs.append(time.time() - start)
+        timings[backend] = min(runs)
+        print(f"{backend.value:>6}: {timings[backend]:.4f}s (first call {first:.4f}s)")
+
+    for backend in backends[1:]:
+        for expected, actual in zip(results[backends[0]], results[backend]):
+            np.testing.assert_array_equal(expected, actual)
+        print(f"{backend.value} speedup over numpy: {timings[engine.Engine.NUMPY] / timings[backend]:.1f}x, identical results")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,93 @@
+'''
+Script to benchmark the panel indicators against pandas_ta called ticker by ticker
+'''
+
+# import native libraries
+import os
+import sys
+import time
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+
+import numpy as np
+import pandas as pd
+import pandas_ta as ta
+
+# import the internal libraries
+import preference
+import common as cm
+import indicators
+from datamatrix import DataMatrixLoader
+from universe import get_universe_registry
+
+def get_panel(pref):
+    '''
+    high, low and close DataFrames of the universe, synthetic prices of the same shape when the data directory
+    does not have them all
+    '''
+    registry = get_universe_registry(pref, pref.train_data_dir)
+    universe = registry.get_universe(pref.universe_name)
+    available = registry.filter(universe, pref.start_date, pref.end_date)
+
+    if len(available) == len(universe):
+        loader = DataMatrixLoader(pref, pref.universe_name, universe, pref.start_date, pref.end_date)
+        dm = loader.get_daily_datamatrix([cm.DataField.high, cm.DataField.low, cm.DataField.close])
+        return [dm.get_field(fld) for fld in [cm.DataField.high, cm.DataField.low, cm.DataField.close]]
+
+    print(f"Only {len(available)} of the {len(universe)} tickers of {pref.universe_name} have prices, using synthetic prices")
+    index = pd.bdate_range(pref.start_date, pref.end_date)
+    rng = np.random.default_rng(pref.random_seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, size = (len(index), len(universe))), axis = 0))
+    spread = np.abs(rng.normal(0, 0.01, size = close.shape))
+    return [pd.DataFrame(values, index = index, columns = universe)
+            for values in [close * (1 + spread), close * (1 - spread), close]]
+
+def get_cases(high, low, close):
+    '''
+    name -> (pandas_ta call on the columns of one ticker, panel call, matching output columns)
+    '''
+    return {'sma':    (lambda h, l, c: ta.sma(c, length = 50), lambda: indicators.sma(close, 50), None),
+            'ema':    (lambda h, l, c: ta.ema(c, length = 20), lambda: indicators.ema(close, 20), None),
+            'rsi':    (lambda h, l, c: ta.rsi(c, length = 14), lambda: indicators.rsi(close, 14), None),
+            'macd':   (lambda h, l, c: ta.macd(c), lambda: indicators.macd(close),
+                       ['MACD_12_26_9', 'MACDh_12_26_9', 'MACDs_12_26_9']),
+            'adx':    (lambda h, l, c: ta.adx(h, l, c, length = 14), lambda: indicators.adx(high, low, close, 14),
+                       ['ADX_14', 'DMP_14', 'DMN_14']),
+            'atr':    (lambda h, l, c: ta.atr(h, l, c, length = 14), lambda: indicators.atr(high, low, close, 14), None),
+            'bbands': (lambda h, l, c: ta.bbands(c, length = 20), lambda: indicators.bbands(close, 20),
+                       ['BBL_20_2.0', 'BBM_20_2.0', 'BBU_20_2.0', 'BBB_20_2.0', 'BBP_20_2.0'])}
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--universe_name',   dest='universe_name', default = 'S&P 500', help='Name of the Universe')
+    parser.add_argument('--random_seed', dest='random_seed', default = 0, type = int, help='Random Seed')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    high, low, close = get_panel(pref)
+    print(f"{pref.universe_name}: {close.shape[0]} periods x {close.shape[1]} tickers")
+
+    for name, (per_ticker, panel, columns) in get_cases(high, low, close).items():
+        start = time.time()
+        expected = {ticker: per_ticker(high[ticker], low[ticker], close[ticker]) for ticker in close.columns}
+        per_ticker_time = time.time() - start
+
+        start = time.time()
+        result = panel()
+        panel_time = time.time() - start
+
+        result = [result] if columns is None else result
+        for k, actual in enumerate(result):
+            for ticker in close.columns:
+                values = expected[ticker] if columns is None else expected[ticker][columns[k]]
+                np.testing.assert_array_equal(actual[ticker].to_numpy(), values.to_numpy(), err_msg = f"{name} {ticker}")
+        print(f"{name:>7}: pandas_ta per ticker {per_ticker_time:.4f}s, panel {panel_time:.4f}s, "
+              f"{per_ticker_time / panel_time:.1f}x, identical results")
+
+if __name__ == "__main__":
+    run()
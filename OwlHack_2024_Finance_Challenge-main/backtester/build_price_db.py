@@ -0,0 +1,37 @@
+'''
+Script to bulk load the price csv files into the SQLite price database
+'''
+
+# import native libraries
+import os
+import sys
+import time
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+
+# import the internal libraries
+import preference
+from pricedb import PriceDB
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--datasets', dest='datasets', default=None, help='Data set directories to load with | separator, default to all')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    datasets = None if pref.datasets is None else pref.datasets.split('|')
+
+    start = time.time()
+    db = PriceDB(pref.price_db)
+    count = db.ingest_dir(pref.data_root_dir, datasets, verbose = pref.verbose)
+    db.close()
+
+    print(f"Loaded {count} rows into {pref.price_db} in {time.time() - start:.2f}s")
+
+if __name__ == "__main__":
+    run()
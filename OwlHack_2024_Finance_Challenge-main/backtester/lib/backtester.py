@@ -4,13 +4,34 @@ Main driver class for the backtester
 '''
 import os
 import datetime
+import concurrent.futures
 
 import preference
 import common as cm
 
+from loader import get_data_source
 from datamatrix import DataMatrixLoader
+from exporter import ResultExporter
+from universe import get_universe_registry
 from longindex_strategy import LongIndexStrategy
 
+def _run_strategy(strategy, output_dir):
+    strategy.validate()
+    strategy.run_strategy()
+    strategy.export(output_dir)
+    return strategy.get_results()
+
+# strategies of a Driver.run worker process, set once by _init_worker
+_worker = {}
+
+def _init_worker(strategy_list, output_dir):
+    _worker['strategy_list'] = strategy_list
+    _worker['output_dir'] = output_dir
+
+def _run_worker(k):
+    return _run_strategy(_worker['strategy_list'][k], _worker['output_dir'])
+
+
 class Driver(object):
 
     def __init__(self, pref):
@@ -21,7 +42,17 @@ class Driver(object):
         self.initial_capital = pref.initial_capital
         self.universe = cm.get_index_components(pref.universe_name, pref.meta_data_dir)
         self.benchmark_etf = cm.get_ETF_by_index(pref.universe_name)
-        self.datamatrix_loader = DataMatrixLoader(pref, pref.universe_name, self.universe, pref.start_date, pref.end_date)
+        self.data_src = get_data_source(pref)
+        # fail before the backtest on an unknown artifact or a format that cannot be written
+        ResultExporter(pref.output_dir, pref.export_format, pref.export_artifacts)
+        if getattr(pref, 'filter_universe', False):
+            # drop the tickers whose prices do not cover the backtest period
+            registry = get_universe_registry(pref, pref.train_data_dir, self.data_src)
+            universe = registry.filter(self.universe, pref.start_date, pref.end_date)
+            print(f"Dropped {len(self.universe) - len(universe)} of {len(self.universe)} tickers without prices from {pref.start_date} to {pref.end_date}")
+            self.universe = universe
+        self.datamatrix_loader = DataMatrixLoader(pref, pref.universe_name, self.universe, pref.start_date, pref.end_date,
+                                                  data_src = self.data_src)
         self.strategy_list = []
         self.run_date = None
 
@@ -41,13 +72,28 @@ class Driver(object):
         return(info)
 
     def run(self, strategy_list):
+        '''
+        Run the strategies, each on its own view of its input DataMatrix so the columns a strategy adds stay private.
+        With pref.strategy_workers > 1 they run concurrently in a process pool, the workers send back the results
+        of the strategies (see Strategy.get_results) but not their input.
+        '''
         self.run_date = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
         self.strategy_list = strategy_list
 
         for strategy in strategy_list:
-            strategy.validate()
-            strategy.run_strategy()
-            strategy.save_to_csv(self.pref.output_dir)
+            strategy.input_dm = strategy.input_dm.view()
+
+        num_workers = min(getattr(self.pref, 'strategy_workers', 1), len(strategy_list))
+        if num_workers <= 1:
+            for strategy in strategy_list:
+                _run_strategy(strategy, self.pref.output_dir)
+            return
+
+        # forked workers inherit the strategies, they are only pickled where processes are spawned
+        with concurrent.futures.ProcessPoolExecutor(max_workers = num_workers, initializer = _init_worker,
+                                                    initargs = (strategy_list, self.pref.output_dir)) as executor:
+            for strategy, results in zip(strategy_list, executor.map(_run_worker, range(len(strategy_list)))):
+                strategy.set_results(results)
 
     def run_benchmark(self):
         '''
@@ -55,13 +101,14 @@ class Driver(object):
         For example, long SPY for S&P 500 universe
         '''
         etf_universe = [self.benchmark_etf]
-        loader = DataMatrixLoader(self.pref, self.pref.universe_name, etf_universe, self.pref.start_date, self.pref.end_date)
+        loader = DataMatrixLoader(self.pref, self.pref.universe_name, etf_universe, self.pref.start_date, self.pref.end_date,
+                                  data_src = self.data_src)
         dm = loader.get_daily_datamatrix()
 
         buyETF = LongIndexStrategy(self.pref, dm, cm.OneMillion, index_name = self.benchmark_etf)
         buyETF.validate()
         buyETF.run_strategy()
-        buyETF.save_to_csv(self.pref.output_dir)
+        buyETF.export(self.pref.output_dir)
 
         print(f"""
 +-----------------------------------------------+
@@ -30,6 +30,7 @@ class DataField(str, enum.Enum):
     def __str__(self):
         return(str(self.value))
 
+    date = 'Date'
     open = 'Open'
     high = 'High'
     low = 'Low'
@@ -53,10 +54,23 @@ class DataField(str, enum.Enum):
     # common technical indicators
     RSI = 'RSI'
 
+    # mark to market of the positions of a strategy
+    realized_pnl = 'realized_pnl'
+    unrealized_pnl = 'unrealized_pnl'
+    cost_basis = 'cost_basis'
+
 
 OHLCV_Fields_value = [DataField.open.value, DataField.high.value, DataField.low.value, DataField.close.value, DataField.volume.value]
 SMA_Fields_value = [DataField.SMA_10.value, DataField.SMA_20.value, DataField.SMA_50.value, DataField.SMA_200.value]
 
+# column types of the daily price csv files
+Price_CSV_dtypes = {DataField.date.value: str,
+                    DataField.open.value: 'float64', DataField.high.value: 'float64',
+                    DataField.low.value: 'float64', DataField.close.value: 'float64',
+                    DataField.volume.value: 'int64',
+                    'Dividends': 'float64', 'Stock Splits': 'float64', 'Capital Gains': 'float64',
+                    'Ticker': str}
+
 
 class TradeAction(enum.Enum):
 
@@ -129,10 +143,16 @@ def get_industry():
     # to be determined
     return []
 
+# meta file -> (mtime, components), the file is read again only when it changes
+_index_components = {}
+
 def get_index_components(index, meta_data_dir):
     fname = os.path.join(meta_data_dir, index.replace(' ', '') + '.txt')
-    df = pd.read_csv(fname)
-    return(df['Ticker'].tolist())
+    mtime = os.stat(fname).st_mtime_ns
+    if fname not in _index_components or _index_components[fname][0] != mtime:
+        df = pd.read_csv(fname)
+        _index_components[fname] = (mtime, df['Ticker'].tolist())
+    return(list(_index_components[fname][1]))
 
 def parse_date_str(txt):
     try:
@@ -179,6 +199,29 @@ def calculate_max_drawdown(equity_values):
     max_drawdown = np.min(drawdowns)
     return max_drawdown * 100
 
+def calculate_sharpe_ratio_by_column(returns, risk_free_rate):
+    '''
+    calculate_sharpe_ratio of every column of a (period x path) array, missing returns are skipped
+    '''
+    avg_daily_return = np.nanmean(returns, axis = 0)
+    daily_std_dev = np.nanstd(returns, axis = 0, ddof = 1)
+
+    annualized_return = (1 + avg_daily_return) ** 252 - 1
+    annualized_std_dev = daily_std_dev * np.sqrt(252)
+    daily_risk_free = (1 + risk_free_rate) ** (1/252) - 1
+    annualized_risk_free = (1 + daily_risk_free) ** 252 - 1
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return (annualized_return - annualized_risk_free) / annualized_std_dev
+
+def calculate_max_drawdown_by_column(equity_values):
+    '''
+    calculate_max_drawdown of every column of a (period x path) array
+    '''
+    running_max = np.maximum.accumulate(equity_values, axis = 0)
+    drawdowns = (equity_values - running_max) / running_max
+    return np.min(drawdowns, axis = 0) * 100
+
 # ==============================================
 # Testing
 # ==============================================
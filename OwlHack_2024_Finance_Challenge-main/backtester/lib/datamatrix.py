@@ -5,6 +5,10 @@ Class to manage data set for a list of stocks and for a time period
 import os
 import datetime
 import copy
+import enum
+import threading
+import collections
+import concurrent.futures
 import pandas as pd
 import numpy as np
 
@@ -12,6 +16,7 @@ import common as cm
 
 from loader import DataLoader
 from stock import Stock
+from universe import get_universe_registry
 
 from preference import get_default_parser, Preference
 
@@ -22,16 +27,40 @@ class DataMatrix(pd.DataFrame):
     The columns are index by keys encoded usng {ticker}_{field}
     where field can be open, high, low, close, volume and calculated Technical indicators or fundamental quantities
     such as capitalization
+
+    When built by DataMatrixLoader, the loaded fields are stored in a single contiguous (date x ticker x field)
+    float64 numpy panel and the DataFrame columns are a view into it. get_field and get_ticker return zero copy
+    slices of the panel. Columns added later (e.g. indicators calculated by a strategy) only live in the DataFrame.
     '''
 
+    _metadata = ['_name', '_universe', '_timeframe', '_fields']
+
     def __init__(self, *args, **kwargs):
         _name = kwargs.pop('name', None)
         _temp = kwargs.pop('universe', None)
         _timeframe = kwargs.pop('timeframe', cm.TimeFrame.DAILY)
+        _panel = kwargs.pop('panel', None)
+        _fields = kwargs.pop('fields', None)
         super().__init__(*args, **kwargs)
         self._name = _name
         self._universe = _temp
         self._timeframe = _timeframe
+        object.__setattr__(self, '_panel', _panel)
+        self._fields = _fields
+
+    @classmethod
+    def from_panel(cls, panel, index, universe, fields, name = None, timeframe = cm.TimeFrame.DAILY):
+        '''
+        wrap a (date x ticker x field) array without copying it
+        '''
+        nrow, nticker, nfield = panel.shape
+        if nticker != len(universe) or nfield != len(fields) or nrow != len(index):
+            raise Exception(f"Panel shape {panel.shape} does not match {len(index)} dates, {len(universe)} tickers and {len(fields)} fields")
+
+        fields = [str(fld) for fld in fields]
+        columns = [f"{ticker}_{fld}" for ticker in universe for fld in fields]
+        return cls(panel.reshape(nrow, nticker * nfield), index = index, columns = columns, copy = False,
+                   name = name, universe = universe, timeframe = timeframe, panel = panel, fields = fields)
 
     @property
     def timeframe(self):
@@ -57,20 +86,160 @@ class DataMatrix(pd.DataFrame):
     def universe(self, value):
         self._universe = value
 
+    @property
+    def panel(self):
+        '''
+        the (date x ticker x field) array behind the loaded columns, None if the DataMatrix was built from a DataFrame
+        '''
+        return getattr(self, '_panel', None)
+
+    @property
+    def fields(self):
+        '''
+        the fields of the panel, or the fields of the first ticker when there is no panel
+        '''
+        if self._fields is not None:
+            return self._fields
+        prefix = f"{self.universe[0]}_"
+        return [col[len(prefix):] for col in self.columns if col.startswith(prefix)]
+
     def get_info(self):
         info = f"Name: {self._name}, Universe: {self._universe}, TimeFrame: {self.timeframe}"
         return(info)
 
+    def get_field_values(self, field):
+        '''
+        return the (date x ticker) numpy array of a field, a view into the panel when possible.
+        Fields that are not stored but can be derived (see Stock.derived_fields) are calculated on first access.
+        '''
+        field = str(field)
+        if self.panel is not None and field in self._fields:
+            return self.panel[:, :, self._fields.index(field)]
+
+        columns = [f"{ticker}_{field}" for ticker in self.universe]
+        if all([col in self.columns for col in columns]):
+            return self[columns].to_numpy()
+
+        return self._derive_field(field)
+
+    def _derive_field(self, field):
+        '''
+        calculate a derived field for every ticker from the stored fields, missing values are set to 0 as in the loader
+        '''
+        derived = getattr(self, '_derived', None)
+        if derived is None:
+            derived = {}
+            object.__setattr__(self, '_derived', derived)
+
+        if field not in derived:
+            if field not in Stock.derived_fields:
+                raise Exception(f"{field} is neither stored in {self.name} nor a derived field")
+
+            def calc(fld, inputs):
+                if fld not in Stock.derived_fields:
+                    return inputs[fld]
+                return Stock.derived_fields[fld].func(*[calc(input_fld, inputs) for input_fld in Stock.derived_fields[fld].inputs])
+
+            # the stored fields are 0 where a ticker has no price, e.g. before its first date, so like Stock in a full
+            # load every ticker is calculated on its own dates. The tickers with a price on every date are calculated
+            # in one call, column by column, and the others one by one.
+            sources = Stock.get_source_fields([field])
+            stored = {fld: self.get_field_values(fld) for fld in sources}
+            valid = np.logical_and.reduce([stored[fld] != 0 for fld in sources])
+            complete = valid.all(axis = 0)
+            groups = [(np.arange(len(self.index)), np.flatnonzero(complete))]
+            groups += [(np.flatnonzero(valid[:, j]), [j]) for j in np.flatnonzero(~complete)]
+
+            values = np.zeros((len(self.index), len(self.universe)))
+            for rows, cols in groups:
+                if len(rows) == 0 or len(cols) == 0:
+                    continue
+                inputs = {fld: pd.DataFrame(stored[fld][np.ix_(rows, cols)], index = self.index[rows],
+                                            columns = [self.universe[j] for j in cols]) for fld in sources}
+                values[np.ix_(rows, cols)] = np.array(calc(field, inputs), dtype = float)
+            values[np.isnan(values)] = 0
+            derived[field] = values
+        return derived[field]
+
+    def get_field(self, field):
+        '''
+        return a (date x ticker) DataFrame with the ticker as column label
+        '''
+        return pd.DataFrame(self.get_field_values(field), index = self.index, columns = list(self.universe), copy = False)
+
+    def set_fields(self, values_by_field):
+        '''
+        add fields, or replace fields added earlier, for every ticker from {field: (date x ticker) array}.
+        The columns are added ticker by ticker, in the order of the fields.
+        '''
+        fields = [str(fld) for fld in values_by_field.keys()]
+        stored = [fld for fld in fields if self.panel is not None and fld in self._fields]
+        if len(stored) > 0:
+            raise Exception(f"{stored} are stored in the panel of {self.name} and cannot be replaced")
+
+        values = np.stack([np.asarray(v, dtype = float) for v in values_by_field.values()], axis = 2)
+        columns = [f"{ticker}_{fld}" for ticker in self.universe for fld in fields]
+        self[columns] = values.reshape(values.shape[0], -1)
+
+    def set_field(self, field, values):
+        self.set_fields({field: values})
+
+    def get_ticker(self, ticker):
+        '''
+        return a (date x field) DataFrame of a ticker with the field as column label
+        '''
+        if self.panel is not None:
+            return pd.DataFrame(self.panel[:, list(self.universe).index(ticker), :], index = self.index,
+                                columns = self._fields, copy = False)
+        prefix = f"{ticker}_"
+        result = self[[col for col in self.columns if col.startswith(prefix)]]
+        result.columns = [col[len(prefix):] for col in result.columns]
+        return(result)
 
     def extract_price_matrix(self, price_choice = cm.DataField.close):
         '''
         return a datamatrix that has only the ticker_close columns
         '''
-        result = self[[f"{ticker}_{price_choice}" for ticker in self.universe]]
-        # keep only the ticker as column label
-        result.columns = [f"{col.split('_')[0]}" for col in result.columns]
-        return(result)
+        return self.get_field(price_choice)
 
+    def view(self, name = None):
+        '''
+        return a new DataMatrix over the same panel. Columns added to the view are private to it.
+        Without a panel the data is copied.
+        '''
+        name = self.name if name is None else name
+        if self.panel is None:
+            return DataMatrix(self.copy(), name = name, universe = self.universe, timeframe = self.timeframe,
+                              fields = self._fields)
+        return DataMatrix.from_panel(self.panel, self.index, self.universe, self._fields, name = name, timeframe = self.timeframe)
+
+    def get_periods(self, start, stop, name = None):
+        '''
+        return a DataMatrix of the periods start to stop (positions, stop excluded), a view of the panel when possible
+        '''
+        name = self.name if name is None else name
+        if self.panel is None:
+            return DataMatrix(self.iloc[start:stop], name = name, universe = self.universe, timeframe = self.timeframe,
+                              fields = self._fields)
+        return DataMatrix.from_panel(self.panel[start:stop], self.index[start:stop], self.universe, self._fields,
+                                     name = name, timeframe = self.timeframe)
+
+    def consolidate(self, name = None):
+        '''
+        return a new DataMatrix whose panel holds every numeric field present for all tickers,
+        including the columns added after loading (e.g. indicators calculated by a strategy)
+        '''
+        prefix = f"{self.universe[0]}_"
+        fields = [col[len(prefix):] for col in self.columns if col.startswith(prefix)]
+        fields = [fld for fld in fields if all([f"{ticker}_{fld}" in self.columns for ticker in self.universe])
+                  and pd.api.types.is_numeric_dtype(self[f"{self.universe[0]}_{fld}"].dtype)]
+
+        panel = np.empty((self.shape[0], len(self.universe), len(fields)))
+        for k, fld in enumerate(fields):
+            panel[:, :, k] = self.get_field_values(fld)
+
+        name = self.name if name is None else name
+        return DataMatrix.from_panel(panel, self.index, self.universe, fields, name = name, timeframe = self.timeframe)
 
     def copy_and_zero(self):
         dm = self.copy()
@@ -94,13 +263,108 @@ class DataMatrix(pd.DataFrame):
 
 
 
+class DataMatrixCache(object):
+    '''
+    Process level LRU cache of the panels loaded by DataMatrixLoader, bounded by a memory budget in bytes.
+
+    Cached panels are made read-only and every lookup returns a new DataMatrix view over the panel, so a strategy
+    adding columns to its input (e.g. RSI2) does not affect other users, and writing into the loaded columns raises.
+
+    Only loaders with the same key share a panel. A sub-universe, e.g. the benchmark ETF of the Driver, is loaded
+    on its own because its dates are the ones of its first ticker.
+    '''
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, name = None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            dm = self._entries[key]
+        return dm.view(name)
+
+    def put(self, key, dm):
+        '''
+        cache the panel of dm and return a read-only view of it
+        '''
+        nbytes = dm.panel.nbytes
+        if nbytes > self.memory_budget:
+            return dm
+
+        dm.panel.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.memory_used -= self._entries.pop(key).panel.nbytes
+            self._entries[key] = dm
+            self.memory_used += nbytes
+            # evict the least recently used panels
+            while self.memory_used > self.memory_budget:
+                _, evicted = self._entries.popitem(last = False)
+                self.memory_used -= evicted.panel.nbytes
+        return dm.view()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory_used = 0
+
+    def summary(self):
+        return f"DataMatrix cache: {len(self._entries)} entries, {self.memory_used / cm.OneMillion:,.1f} MB, {self.hits} hits, {self.misses} misses"
+
+_datamatrix_cache = None
+
+def get_datamatrix_cache(pref):
+    '''
+    return the process level DataMatrix cache, None when it is disabled in the preference
+    '''
+    global _datamatrix_cache
+    budget_mb = getattr(pref, 'datamatrix_cache_mb', 0)
+    if budget_mb is None or budget_mb <= 0:
+        return None
+    if _datamatrix_cache is None:
+        _datamatrix_cache = DataMatrixCache(budget_mb * cm.OneMillion)
+    _datamatrix_cache.memory_budget = budget_mb * cm.OneMillion
+    return _datamatrix_cache
+
+
+def _load_stock_fields(pref, data_src, data_dir, ticker, start_date, end_date, fields):
+    '''
+    load and enrich a single ticker, used by the worker processes of DataMatrixLoader
+    '''
+    loader = DataLoader(pref, data_src, data_dir)
+    return Stock(loader, ticker).get_daily_hist_price(start_date, end_date, fields).grab_fields(fields)
+
+def _enrich_stock_fields(ticker, df, fields):
+    '''
+    enrich prices that were already loaded, used by the worker processes of DataMatrixLoader
+    '''
+    return Stock(None, ticker).set_daily_hist_price(df).grab_fields(fields)
+
+
 class DataMatrixLoader(DataLoader):
     '''
     class responsible for loading data from files or database into DataMatrix which is a derived class from pandas DataFrame
+
+    With num_workers > 1 the tickers are loaded and enriched concurrently, either in a thread pool (I/O bound loading)
+    or a process pool (indicator calculation). Results are merged in universe order so the DataMatrix is the same as
+    the one built serially.
     '''
 
+    class WorkerPool(enum.Enum):
+        THREAD = 'thread'
+        PROCESS = 'process'
+
     def __init__(self, pref, name, universe, start_date, end_date, data_src = DataLoader.DataSource.CSV,
-                data_dir = None, db_connection = None):
+                data_dir = None, db_connection = None, num_workers = None, worker_pool = None):
 
         super().__init__(pref, data_src, data_dir, db_connection)
         self.name = name
@@ -108,24 +372,93 @@ class DataMatrixLoader(DataLoader):
         self.start_date = start_date
         self.end_date = end_date
 
+        self.num_workers = num_workers if num_workers is not None else getattr(pref, 'num_workers', 1)
+        self.worker_pool = DataMatrixLoader.WorkerPool(worker_pool if worker_pool is not None
+                                                      else getattr(pref, 'worker_pool', 'thread'))
 
-    def get_daily_datamatrix(self, fields = None):
+    def _get_executor(self):
+        if self.worker_pool == DataMatrixLoader.WorkerPool.PROCESS:
+            return concurrent.futures.ProcessPoolExecutor(max_workers = self.num_workers)
+        return concurrent.futures.ThreadPoolExecutor(max_workers = self.num_workers)
+
+    def _get_ticker_frames(self, fields):
         '''
-        create datamatrix with columns as {ticker_field}
+        return the {ticker}_{field} frame of every ticker in universe order
         '''
-        df = Stock(self, self.universe[0]).get_daily_hist_price(self.start_date,
-                                                                self.end_date).grab_fields(fields)
-
-        for ticker in self.universe[1:]:
-            tdf = Stock(self, ticker).get_daily_hist_price(self.start_date,
-                                                        self.end_date).grab_fields(fields)
+        # fail before loading anything when some tickers have no prices
+        get_universe_registry(self.pref, self.data_dir, self.data_src, self.db_connection).validate(self.universe)
+
+        n = len(self.universe)
+        if self.data_src == DataLoader.DataSource.SQLITE:
+            # single query for the whole universe and date range
+            prices = self.get_daily_hist_prices(self.universe, self.start_date, self.end_date, Stock.get_source_fields(fields))
+            args = ([ticker for ticker in self.universe], [prices[ticker] for ticker in self.universe], [fields] * n)
+            func = _enrich_stock_fields
+        else:
+            args = (self.universe, [self.start_date] * n, [self.end_date] * n, [fields] * n)
+            func = lambda ticker, start_date, end_date, fields: \
+                Stock(self, ticker).get_daily_hist_price(start_date, end_date, fields).grab_fields(fields)
+            if self.worker_pool == DataMatrixLoader.WorkerPool.PROCESS:
+                args = ([self.pref] * n, [self.data_src] * n, [self.data_dir] * n) + args
+                func = _load_stock_fields
+
+        if self.num_workers is None or self.num_workers <= 1 or n <= 1:
+            return list(map(func, *args))
+
+        chunksize = max(1, n // (4 * self.num_workers))
+        with self._get_executor() as executor:
+            # map returns the results in submission order
+            return list(executor.map(func, *args, chunksize = chunksize))
+
+    def _build_panel(self, frames):
+        '''
+        copy the per ticker frames into one (date x ticker x field) array.
+        Like the column by column merge it replaces, the dates are the ones of the first ticker
+        and missing values are set to 0. Only numeric fields are kept.
+        '''
+        index = frames[0].index
+        fields = []
+        for ticker, tdf in zip(self.universe, frames):
+            prefix = f"{ticker}_"
             for col in tdf.columns:
-                df[col] = tdf[col]
+                fld = col[len(prefix):]
+                if fld not in fields and pd.api.types.is_numeric_dtype(tdf[col].dtype):
+                    fields.append(fld)
+
+        panel = np.full((len(index), len(self.universe), len(fields)), np.nan)
+        for j, (ticker, tdf) in enumerate(zip(self.universe, frames)):
+            cols = [(k, f"{ticker}_{fld}") for k, fld in enumerate(fields) if f"{ticker}_{fld}" in tdf.columns]
+            rows = tdf.index.get_indexer(index)
+            found = rows >= 0
+            values = tdf[[col for _, col in cols]].to_numpy(dtype = np.float64)
+            panel[np.ix_(found, [j], [k for k, _ in cols])] = values[rows[found]][:, np.newaxis, :]
+
+        panel[np.isnan(panel)] = 0
+        return DataMatrix.from_panel(panel, index, self.universe, fields, name = self.name, timeframe = cm.TimeFrame.DAILY)
+
+    def get_cache_key(self, fields):
+        '''
+        key of the DataMatrix in the process level cache
+        '''
+        fields = None if fields is None else tuple([str(fld) for fld in fields])
+        db = None if self.price_db is None else str(self.db_connection)
+        return (tuple(self.universe), fields, self.start_date, self.end_date, self.data_src,
+                os.path.abspath(self.data_dir), db)
 
-        df = DataMatrix(df, name = self.name, universe = self.universe, timeframe = cm.TimeFrame.DAILY)
-        df.fillna(0, inplace=True)
+    def get_daily_datamatrix(self, fields = None):
+        '''
+        create datamatrix with columns as {ticker_field}.
+        When the DataMatrix cache is enabled the result is a read-only view shared with other loaders.
+        '''
+        cache = get_datamatrix_cache(self.pref)
+        if cache is None:
+            return self._build_panel(self._get_ticker_frames(fields))
 
-        return df
+        key = self.get_cache_key(fields)
+        dm = cache.get(key, self.name)
+        if dm is None:
+            dm = cache.put(key, self._build_panel(self._get_ticker_frames(fields)))
+        return dm
 
 # ==============================================
 # Testing
@@ -194,9 +527,28 @@ def _test2():
 
     print(dm2.head(), type(dm2))
 
+def _test3():
+
+    print('Running test3')
+    pref = Preference()
+
+    # BNKU and WEBS start years after SPY, the first ticker that gives the dates
+    universe = ['SPY', 'BNKU', 'WEBS', 'QQQ']
+    fields = [fld for fld in Stock.derived_fields.keys() if not fld.startswith('_')]
+    loader = DataMatrixLoader(pref, 'test3', universe, datetime.date(2010, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    full = loader.get_daily_datamatrix([cm.DataField.close] + fields)
+    dm = loader.get_daily_datamatrix([cm.DataField.close])
+
+    # the derived fields are the same as the ones Stock calculates on the dates of each ticker
+    for fld in fields:
+        np.testing.assert_array_equal(dm.get_field_values(fld), full.get_field_values(fld))
+    print(f"{len(fields)} derived fields of {universe} are the same as in a full load")
+
 def _test():
     _test1()
     _test2()
+    _test3()
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,223 @@
+'''
+Execution kernels shared by the strategies
+
+Every kernel has a numpy implementation and, when numba is installed, a compiled one giving the same results.
+The backend is chosen with the engine argument: 'numpy', 'numba', or 'auto' for numba when it is available.
+'''
+
+import enum
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class Engine(enum.Enum):
+    AUTO = 'auto'
+    NUMPY = 'numpy'
+    NUMBA = 'numba'
+
+def get_engine(engine = Engine.AUTO):
+    '''
+    resolve the engine to the backend that will run, numba is required when explicitly requested
+    '''
+    engine = Engine(engine)
+    if engine == Engine.AUTO:
+        return Engine.NUMBA if numba is not None else Engine.NUMPY
+    if engine == Engine.NUMBA and numba is None:
+        raise Exception("The numba engine was requested but numba is not installed, use the numpy engine instead")
+    return engine
+
+
+def _entry_exit_loop(prices, entry_long, entry_short, exit_signal, has_exit_signal, dollar_exposure,
+                     target_gain_percentage, max_loss_percentage, use_return, hold_on_zero_price,
+                     tsignal, shares, position):
+    '''
+    scalar version of _entry_exit_numpy, compiled by numba
+    '''
+    nrow, ncol = prices.shape
+    entry_price = np.full(ncol, np.nan)
+    for i in range(1, nrow):
+        for j in range(ncol):
+            prev = position[i - 1, j]
+            price = prices[i, j]
+
+            if hold_on_zero_price or price != 0:
+                position[i, j] = prev
+            if price == 0 or prev != prev:
+                continue
+
+            if prev != 0:
+                exit_now = False
+                if use_return:
+                    ret = 100 * (price - entry_price[j]) / entry_price[j]
+                    exit_now = ret >= target_gain_percentage or ret < max_loss_percentage
+                if has_exit_signal and exit_signal[i, j]:
+                    exit_now = True
+                if exit_now:
+                    tsignal[i, j] = -1. if prev > 0 else 1.
+                    shares[i, j] = abs(prev)
+                    position[i, j] = 0
+
+            elif entry_long[i, j] or entry_short[i, j]:
+                side = 1. if entry_long[i, j] else -1.
+                qty = np.trunc(dollar_exposure / price)
+                tsignal[i, j] = side
+                shares[i, j] = qty
+                position[i, j] = side * qty
+                entry_price[j] = price
+
+if numba is not None:
+    _entry_exit_loop = numba.njit(cache = True)(_entry_exit_loop)
+
+
+def run_entry_exit(prices, entry_long, entry_short, dollar_exposure, target_gain_percentage = None,
+                   max_loss_percentage = None, exit_signal = None, hold_on_zero_price = True, engine = Engine.AUTO):
+    '''
+    Enter / exit state machine of the threshold strategies, run for all tickers at once.
+
+    prices, entry_long, entry_short and exit_signal are (date x ticker) arrays. From the second period on:
+        - a position is closed when its return since entry reaches target_gain_percentage or falls below
+          max_loss_percentage, or when exit_signal is set
+        - when flat, a long (entry_long takes precedence) or short position of int(dollar_exposure / price)
+          shares is opened
+        - nothing happens on a zero price. With hold_on_zero_price False the position is also not carried
+          over that period, as RandomStrategy always did.
+
+    return the tsignal (1 buy, -1 sell), shares (always positive) and position (signed shares held) arrays.
+    Like the DataFrames the strategies start from, cells with a missing price stay missing.
+    '''
+    prices = np.asarray(prices, dtype = float)
+    entry_long = np.asarray(entry_long, dtype = bool)
+    entry_short = np.asarray(entry_short, dtype = bool)
+    if exit_signal is not None:
+        exit_signal = np.asarray(exit_signal, dtype = bool)
+
+    tsignal = prices * 0
+    shares = prices * 0
+    position = prices * 0
+
+    if get_engine(engine) == Engine.NUMBA:
+        use_return = target_gain_percentage is not None
+        has_exit_signal = exit_signal is not None
+        _entry_exit_loop(prices, entry_long, entry_short,
+                         exit_signal if has_exit_signal else np.zeros((1, 1), dtype = bool), has_exit_signal,
+                         float(dollar_exposure), float(target_gain_percentage) if use_return else 0.,
+                         float(max_loss_percentage) if use_return else 0., use_return, hold_on_zero_price,
+                         tsignal, shares, position)
+    else:
+        _entry_exit_numpy(prices, entry_long, entry_short, exit_signal, dollar_exposure,
+                          target_gain_percentage, max_loss_percentage, hold_on_zero_price, tsignal, shares, position)
+    return tsignal, shares, position
+
+
+def _entry_exit_numpy(prices, entry_long, entry_short, exit_signal, dollar_exposure,
+                      target_gain_percentage, max_loss_percentage, hold_on_zero_price, tsignal, shares, position):
+    '''
+    one pass over the periods, every ticker updated together with whole-row operations
+    '''
+    nrow, ncol = prices.shape
+    entry_price = np.full(ncol, np.nan)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for i in range(1, nrow):
+            prev = position[i - 1]
+            price = prices[i]
+            nonzero = price != 0
+
+            # propagate the previous position to the current period
+            if hold_on_zero_price:
+                position[i] = prev
+            else:
+                position[i, nonzero] = prev[nonzero]
+
+            active = nonzero & ~np.isnan(prev)
+            holding = active & (prev != 0)
+            flat = active & (prev == 0)
+
+            # a position exists already, check if one can exit it
+            exit_now = np.zeros(ncol, dtype = bool)
+            if target_gain_percentage is not None:
+                ret = 100 * (price - entry_price) / entry_price
+                exit_now |= (ret >= target_gain_percentage) | (ret < max_loss_percentage)
+            if exit_signal is not None:
+                exit_now |= exit_signal[i]
+            exit_now &= holding
+
+            tsignal[i, exit_now] = -np.sign(prev[exit_now])
+            shares[i, exit_now] = np.abs(prev[exit_now])
+            position[i, exit_now] = 0
+
+            # when flat, open a long or a short position, positive shares for long, negative for short
+            go_long = flat & entry_long[i]
+            go_short = flat & entry_short[i] & ~go_long
+            enter = go_long | go_short
+            if enter.any():
+                side = np.where(go_long[enter], 1., -1.)
+                qty = np.trunc(dollar_exposure / price[enter])
+                tsignal[i, enter] = side
+                shares[i, enter] = qty
+                position[i, enter] = side * qty
+                entry_price[enter] = price[enter]
+
+
+def accrue_cash(initial_cash, cash_flows, growth = 1.0):
+    '''
+    cash balance at the end of every period for the recurrence
+        cash[i] = (cash[i-1] + cash_flows[i]) * growth,  cash[-1] = initial_cash
+    solved in closed form: cash[i] = growth**(i+1) * (initial_cash + sum_k<=i cash_flows[k] / growth**k)
+    cash_flows can also be a (period x path) array, every column being accrued on its own.
+    '''
+    cash_flows = np.asarray(cash_flows, dtype = float)
+    if growth == 1.0:
+        return initial_cash + np.cumsum(cash_flows, axis = 0)
+
+    compounding = growth ** np.arange(len(cash_flows) + 1, dtype = float)
+    compounding = compounding.reshape((-1,) + (1,) * (cash_flows.ndim - 1))
+    return compounding[1:] * (initial_cash + np.cumsum(cash_flows / compounding[:-1], axis = 0))
+
+
+def draw_uniform_by_ticker(prices, draw):
+    '''
+    return a (date x ticker) matrix of draw() values for every period after the first with a non-zero price,
+    drawn ticker by ticker then date by date, the order a per-ticker loop would draw them in. Other cells are NaN.
+    '''
+    prices = np.asarray(prices, dtype = float)
+    drawn = prices[1:] != 0
+
+    result = np.full(prices.shape, np.nan)
+    # the transposed view is ticker major, boolean assignment fills it in that order
+    values = result[1:].T
+    values[drawn.T] = [draw() for _ in range(int(drawn.sum()))]
+    return result
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import time
+
+    rng = np.random.default_rng(1)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, size = (2500, 500)), axis = 0))
+    prices[rng.random(prices.shape) < 0.01] = 0
+    signal = rng.random(prices.shape)
+
+    engines = [Engine.NUMPY] + ([Engine.NUMBA] if numba is not None else [])
+    results = []
+    for engine in engines:
+        # the first numba call compiles or loads the kernel
+        run_entry_exit(prices[:10], signal[:10] > 0.95, signal[:10] < 0.05, 100000, 1.0, -1.0, engine = engine)
+        start = time.time()
+        results.append(run_entry_exit(prices, signal > 0.95, signal < 0.05, 100000, target_gain_percentage = 1.0,
+                                      max_loss_percentage = -1.0, engine = engine))
+        print(f"{engine.value}: {prices.shape} in {time.time() - start:.3f}s, {int(np.abs(results[-1][0]).sum())} trades")
+
+    for result in results[1:]:
+        for expected, actual in zip(results[0], result):
+            np.testing.assert_array_equal(expected, actual)
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,207 @@
+'''
+Bulk export of the output of a strategy
+'''
+
+import os
+import enum
+import time
+import importlib.util
+import numpy as np
+import pandas as pd
+
+
+class ExportFormat(enum.Enum):
+    CSV = 'csv'
+    PARQUET = 'parquet'
+    FEATHER = 'feather'
+    NPZ = 'npz'
+
+
+class Artifact(enum.Enum):
+    DATA = 'data'
+    PRICES = 'prices'
+    TACTION = 'taction'
+    TSIGNAL = 'tsignal'
+    SHARES = 'shares'
+    HOLDING = 'holding'
+    PNL = 'pnl'
+    PNL_MATRIX = 'pnl_matrix'
+    TRADE_HISTORY = 'trade_history'
+
+
+# strategy attribute of every artifact indexed by date
+_artifact_attributes = {Artifact.DATA: 'input_dm',
+                        Artifact.PRICES: 'pricing_matrix',
+                        Artifact.TACTION: 'taction',
+                        Artifact.TSIGNAL: 'tsignal',
+                        Artifact.SHARES: 'shares',
+                        Artifact.HOLDING: 'current_holding',
+                        Artifact.PNL: 'pnl',
+                        Artifact.PNL_MATRIX: 'pnl_matrix'}
+
+
+def parse_artifacts(artifacts):
+    '''
+    artifacts from a list of names or Artifact, or a str with | separator, all of them when None
+    '''
+    if artifacts is None:
+        return list(Artifact)
+    if isinstance(artifacts, str):
+        artifacts = [txt.strip() for txt in artifacts.split('|') if txt.strip() != '']
+    names = [x.value for x in Artifact]
+    unknown = [x for x in artifacts if not isinstance(x, Artifact) and x not in names]
+    if len(unknown) > 0:
+        raise Exception(f"Unknown artifacts {unknown}, expect some of {names}")
+    return [Artifact(x) for x in artifacts]
+
+def get_artifact(strategy, artifact):
+    '''
+    DataFrame of an artifact of a strategy that has run
+    '''
+    if artifact == Artifact.TRADE_HISTORY:
+        return strategy.port.get_trade_history()
+    return getattr(strategy, _artifact_attributes[artifact])
+
+def _get_column_values(column):
+    '''
+    numpy values of a column that np.load reads without pickle: object columns become dates or str
+    '''
+    if column.dtype != object:
+        return column.to_numpy()
+    if pd.api.types.infer_dtype(column) in ['date', 'datetime', 'datetime64']:
+        return np.array(column.to_numpy(), dtype = 'datetime64[D]')
+    return np.where(column.isnull(), '', column.astype(str)).astype(str)
+
+def _get_arrays(name, df):
+    '''
+    arrays of a DataFrame in the npz file: a 2-D array of the values when the columns have the same dtype,
+    or an array by column, plus the index and the column names
+    '''
+    arrays = {f"{name}.columns": np.array(df.columns, dtype = str)}
+    if not isinstance(df.index, pd.RangeIndex):
+        arrays[f"{name}.index"] = _get_column_values(df.index.to_series())
+    if len(set(df.dtypes)) == 1 and df.dtypes.iloc[0] != object:
+        arrays[name] = df.to_numpy()
+    else:
+        for k in range(df.shape[1]):
+            arrays[f"{name}.{df.columns[k]}"] = _get_column_values(df.iloc[:, k])
+    return arrays
+
+
+class ResultExporter(object):
+
+    '''
+    Write the selected artifacts of a strategy in one format: a file per artifact for csv, parquet and feather,
+    or a single compressed npz file with all of them. Parquet and feather require pyarrow.
+    '''
+
+    def __init__(self, output_dir, export_format = ExportFormat.CSV, artifacts = None):
+        self.output_dir = output_dir
+        self.export_format = ExportFormat(export_format)
+        self.artifacts = parse_artifacts(artifacts)
+        self.run_time = None
+
+        if self.export_format in [ExportFormat.PARQUET, ExportFormat.FEATHER] and importlib.util.find_spec('pyarrow') is None:
+            raise Exception(f"The {self.export_format.value} format was requested but pyarrow is not installed, use the csv or npz format instead")
+
+    def _write(self, df, fname, artifact):
+        # the trade history has no index
+        index = artifact != Artifact.TRADE_HISTORY
+        if self.export_format == ExportFormat.CSV:
+            df.to_csv(fname, index = index)
+        elif self.export_format == ExportFormat.PARQUET:
+            df.to_parquet(fname, index = index)
+        elif self.export_format == ExportFormat.FEATHER:
+            # feather keeps the columns only
+            (df.reset_index() if index else df).to_feather(fname)
+
+    def export(self, strategy):
+        '''
+        write the artifacts of the strategy, return the names of the files
+        '''
+        start = time.time()
+        os.makedirs(self.output_dir, exist_ok = True)
+        fname = strategy.name.replace(' ', '')
+
+        if self.export_format == ExportFormat.NPZ:
+            arrays = {}
+            for artifact in self.artifacts:
+                arrays.update(_get_arrays(artifact.value, get_artifact(strategy, artifact)))
+            result = [os.path.join(self.output_dir, f"{fname}.npz")]
+            np.savez_compressed(result[0], **arrays)
+        else:
+            result = []
+            for artifact in self.artifacts:
+                result.append(os.path.join(self.output_dir, f"{fname}_{artifact.value}.{self.export_format.value}"))
+                if artifact == Artifact.TRADE_HISTORY and self.export_format == ExportFormat.CSV:
+                    strategy.port.save_trade_history(result[-1])
+                else:
+                    self._write(get_artifact(strategy, artifact), result[-1], artifact)
+
+        self.run_time = time.time() - start
+        return(result)
+
+
+def load_npz(fname):
+    '''
+    DataFrames by artifact name of a npz file written by ResultExporter
+    '''
+    result = {}
+    with np.load(fname) as npz:
+        names = [key[:-len('.columns')] for key in npz.files if key.endswith('.columns')]
+        for name in names:
+            columns = npz[f"{name}.columns"]
+            if name in npz.files:
+                df = pd.DataFrame(npz[name], columns = columns)
+            else:
+                df = pd.DataFrame({col: npz[f"{name}.{col}"] for col in columns}, columns = columns)
+            if f"{name}.index" in npz.files:
+                df.index = pd.Index(npz[f"{name}.index"], name = 'Date')
+            result[name] = df
+    return(result)
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import glob
+    import datetime
+    import common as cm
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+    from RSI_strategy import RSIStrategy
+
+    pref = Preference()
+    tickers = sorted([os.path.basename(fname)[:-len('_daily.csv')] for fname in glob.glob(os.path.join(pref.data_root_dir, 'ETF', '*_daily.csv'))])
+    loader = DataMatrixLoader(pref, 'exporter', tickers, datetime.date(2010, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    strategy = RSIStrategy(pref, loader.get_daily_datamatrix(), cm.OneMillion)
+    strategy.validate()
+    strategy.run_strategy()
+
+    output_dir = os.path.join(pref.test_output_dir, 'exporter')
+    formats = [ExportFormat.CSV, ExportFormat.NPZ]
+    if importlib.util.find_spec('pyarrow') is not None:
+        formats += [ExportFormat.PARQUET, ExportFormat.FEATHER]
+    for export_format in formats:
+        exporter = ResultExporter(output_dir, export_format)
+        files = exporter.export(strategy)
+        size = sum([os.path.getsize(x) for x in files])
+        print(f"{export_format.value:>8}: {len(files)} files, {size / 2 ** 20:.1f} MB in {exporter.run_time:.2f}s")
+
+    result = load_npz(os.path.join(output_dir, f"{strategy.name}.npz"))
+    np.testing.assert_array_equal(result['pnl'].to_numpy(), strategy.pnl.to_numpy())
+    trade_history = strategy.port.get_trade_history()
+    np.testing.assert_array_equal(result['trade_history']['PnL'].to_numpy(), trade_history['PnL'].to_numpy())
+    assert (result['trade_history']['Ticker'] == trade_history['Ticker']).all()
+
+    exporter = ResultExporter(output_dir, ExportFormat.CSV, 'pnl|trade_history')
+    exporter.export(strategy)
+    print(f"pnl and trade history only: {exporter.run_time:.3f}s")
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    sys.path.append(os.path.join(os.getcwd(), os.pardir, 'strategy'))
+    _test()
@@ -0,0 +1,231 @@
+'''
+Technical indicators of a whole (date x ticker) price panel at once
+
+Every function takes 1-D or 2-D values and calculates each column on its own with the formulas and the pandas
+operations of pandas_ta, so the result is the same as calling pandas_ta ticker by ticker. A Series or a DataFrame
+keeps its labels in the result, other values are returned as numpy arrays of the same shape.
+'''
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+
+def _as_array(values):
+    '''
+    (date x column) float array of the values
+    '''
+    values = np.asarray(values, dtype = float)
+    return values.reshape(len(values), -1)
+
+def _wrap(result, like):
+    '''
+    give the result the type, shape and labels of like
+    '''
+    result = result.to_numpy() if isinstance(result, pd.DataFrame) else result
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(result, index = like.index, columns = like.columns)
+    if isinstance(like, pd.Series):
+        return pd.Series(result[:, 0], index = like.index)
+    return result[:, 0] if np.ndim(like) == 1 else result
+
+def _column_mean(values):
+    '''
+    mean of every column skipping missing values, summed like Series.mean so the result is the same
+    '''
+    rows = np.ascontiguousarray(values.T)
+    count = (~np.isnan(rows)).sum(axis = 1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.where(count > 0, np.nansum(rows, axis = 1) / count, np.nan)
+
+def _non_zero_range(high, low):
+    '''
+    high - low, columns with a zero range are moved by the float epsilon as a whole
+    '''
+    diff = high - low
+    diff[:, (diff == 0).any(axis = 0)] += sys.float_info.epsilon
+    return diff
+
+def _shift(values, periods = 1):
+    result = np.full(values.shape, np.nan)
+    result[periods:] = values[:len(values) - periods]
+    return result
+
+
+def _sma(values, length):
+    return pd.DataFrame(values).rolling(length, min_periods = length).mean().to_numpy()
+
+def _ema(values, length):
+    # the first value is the simple average of the first length values
+    frame = pd.DataFrame(values.copy())
+    if len(frame) >= length:
+        seed = _column_mean(values[:length])
+        frame.iloc[:length - 1] = np.nan
+        frame.iloc[length - 1] = seed
+    return frame.ewm(span = length, adjust = False).mean().to_numpy()
+
+def _rma(values, length):
+    return pd.DataFrame(values).ewm(alpha = 1.0 / length, min_periods = length).mean().to_numpy()
+
+
+def sma(close, length = 10):
+    '''
+    simple moving average, pandas_ta.sma
+    '''
+    return _wrap(_sma(_as_array(close), length), close)
+
+def ema(close, length = 10):
+    '''
+    exponential moving average seeded with the simple average of the first length values, pandas_ta.ema
+    '''
+    return _wrap(_ema(_as_array(close), length), close)
+
+def rma(close, length = 10):
+    '''
+    Wilder's moving average, pandas_ta.rma
+    '''
+    return _wrap(_rma(_as_array(close), length), close)
+
+def rsi(close, length = 14, scalar = 100):
+    '''
+    relative strength index, pandas_ta.rsi
+    '''
+    values = _as_array(close)
+    change = values - _shift(values)
+    positive = np.where(change < 0, 0, change)
+    negative = np.where(change > 0, 0, change)
+
+    positive_avg = _rma(positive, length)
+    negative_avg = _rma(negative, length)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return _wrap(scalar * positive_avg / (positive_avg + np.abs(negative_avg)), close)
+
+def macd(close, fast = 12, slow = 26, signal = 9):
+    '''
+    moving average convergence divergence, pandas_ta.macd. Return the macd, histogram and signal line.
+    '''
+    if slow < fast:
+        fast, slow = slow, fast
+    values = _as_array(close)
+    macd_values = _ema(values, fast) - _ema(values, slow)
+
+    # the signal line starts at the first macd value of every column
+    signal_values = np.full(macd_values.shape, np.nan)
+    valid = ~np.isnan(macd_values)
+    first = np.where(valid.any(axis = 0), valid.argmax(axis = 0), -1)
+    for start in np.unique(first[first >= 0]):
+        columns = np.nonzero(first == start)[0]
+        signal_values[start:, columns] = _ema(macd_values[start:, columns], signal)
+
+    return (_wrap(macd_values, close), _wrap(macd_values - signal_values, close), _wrap(signal_values, close))
+
+def true_range(high, low, close):
+    '''
+    true range, pandas_ta.true_range
+    '''
+    high, low, values = _as_array(high), _as_array(low), _as_array(close)
+    prev_close = _shift(values)
+    ranges = np.stack([_non_zero_range(high, low), high - prev_close, prev_close - low])
+    with np.errstate(invalid = 'ignore'):
+        result = np.fmax.reduce(np.abs(ranges), axis = 0)
+    result[:1] = np.nan
+    return _wrap(result, close)
+
+def atr(high, low, close, length = 14):
+    '''
+    average true range with Wilder's moving average, pandas_ta.atr
+    '''
+    return _wrap(_rma(_as_array(true_range(high, low, close)), length), close)
+
+def adx(high, low, close, length = 14, lensig = None, scalar = 100):
+    '''
+    average directional index, pandas_ta.adx. Return the ADX, +DI and -DI.
+    '''
+    lensig = length if lensig is None else lensig
+    atr_values = _as_array(atr(high, low, close, length))
+    high, low = _as_array(high), _as_array(low)
+
+    up = high - _shift(high)
+    dn = _shift(low) - low
+    pos = ((up > dn) & (up > 0)) * up
+    neg = ((dn > up) & (dn > 0)) * dn
+    pos = np.where(np.abs(pos) < sys.float_info.epsilon, 0, pos)
+    neg = np.where(np.abs(neg) < sys.float_info.epsilon, 0, neg)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        k = scalar / atr_values
+        dmp = k * _rma(pos, length)
+        dmn = k * _rma(neg, length)
+        dx = scalar * np.abs(dmp - dmn) / (dmp + dmn)
+    return (_wrap(_rma(dx, lensig), close), _wrap(dmp, close), _wrap(dmn, close))
+
+def bbands(close, length = 5, std = 2.0, ddof = 0):
+    '''
+    Bollinger bands, pandas_ta.bbands. Return the lower, middle and upper bands, the bandwidth and the %B.
+    '''
+    values = _as_array(close)
+    deviations = std * pd.DataFrame(values).rolling(length, min_periods = length).std(ddof = ddof).to_numpy()
+    mid = _sma(values, length)
+    lower = mid - deviations
+    upper = mid + deviations
+
+    ulr = _non_zero_range(upper, lower)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        bandwidth = 100 * ulr / mid
+        percent = _non_zero_range(values, lower) / ulr
+    return tuple(_wrap(result, close) for result in [lower, mid, upper, bandwidth, percent])
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import glob
+    import pandas_ta as ta
+    from preference import Preference
+    from loader import DataLoader
+
+    pref = Preference()
+    loader = DataLoader(pref, data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    tickers = sorted([os.path.basename(fname)[:-len('_daily.csv')] for fname in glob.glob(os.path.join(loader.data_dir, '*_daily.csv'))])
+    frames = {ticker: loader.get_daily_hist_price(ticker) for ticker in tickers}
+    panel = {fld: pd.DataFrame({ticker: df[fld] for ticker, df in frames.items()}) for fld in ['High', 'Low', 'Close']}
+    high, low, close = panel['High'], panel['Low'], panel['Close']
+
+    def check(name, actual, expected):
+        np.testing.assert_array_equal(actual, expected, err_msg = name)
+
+    for j, ticker in enumerate(tickers):
+        # per ticker on the dates it has prices, the panel has the same values and missing values before
+        rows = close[ticker].notnull().to_numpy()
+        c, h, l = close[ticker][rows], high[ticker][rows], low[ticker][rows]
+        check('sma', sma(close, 20).to_numpy()[rows, j], ta.sma(c, length = 20))
+        check('rsi', rsi(c, 14), ta.rsi(c, length = 14))
+        check('ema', ema(c, 10), ta.ema(c, length = 10))
+
+        expected = ta.macd(c)
+        for actual, col in zip(macd(c), ['MACD_12_26_9', 'MACDh_12_26_9', 'MACDs_12_26_9']):
+            check(col, actual, expected[col])
+
+        expected = ta.adx(h, l, c, length = 14)
+        for actual, col in zip(adx(h, l, c, 14), ['ADX_14', 'DMP_14', 'DMN_14']):
+            check(col, actual, expected[col])
+        check('atr', atr(h, l, c, 14), ta.atr(h, l, c, length = 14))
+
+        expected = ta.bbands(c, length = 20)
+        for actual, col in zip(bbands(c, 20), ['BBL_20_2.0', 'BBM_20_2.0', 'BBU_20_2.0', 'BBB_20_2.0', 'BBP_20_2.0']):
+            check(col, actual, expected[col])
+
+    # the panel at once gives the per ticker values where the tickers have prices
+    for j, ticker in enumerate(tickers):
+        rows = close[ticker].notnull().to_numpy()
+        if rows.all():
+            check('rsi panel', rsi(close).to_numpy()[:, j], rsi(close[ticker]))
+            check('adx panel', adx(high, low, close)[0].to_numpy()[:, j], adx(high[ticker], low[ticker], close[ticker])[0])
+            check('macd panel', macd(close)[2].to_numpy()[:, j], macd(close[ticker])[2])
+    print(f"indicators of {len(tickers)} tickers are identical to pandas_ta")
+
+if __name__ == '__main__':
+    sys.path.append(os.getcwd())
+    _test()
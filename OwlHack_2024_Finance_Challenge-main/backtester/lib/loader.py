@@ -11,6 +11,8 @@ import numpy as np
 import common as cm
 
 from preference import Preference
+from pricecache import PriceCache
+from pricedb import PriceDB
 
 class DataLoader(object):
 
@@ -32,24 +34,174 @@ class DataLoader(object):
         else:
             self.data_dir = data_dir
 
+        if getattr(self.pref, 'use_price_cache', False) and getattr(self.pref, 'cache_dir', None) is not None:
+            self.price_cache = PriceCache(self.pref.cache_dir)
+        else:
+            self.price_cache = None
+
+        if self.data_src == DataLoader.DataSource.SQLITE:
+            if self.db_connection is None:
+                self.db_connection = self.pref.price_db
+            self.price_db = PriceDB(self.db_connection)
+        else:
+            self.price_db = None
 
-    def get_daily_hist_price(self, ticker, start_date = None, end_date = None):
+    @property
+    def dataset(self):
+        '''
+        name of the data set in the price database, i.e. the name of the data directory (train, test, ETF)
+        '''
+        return os.path.basename(os.path.normpath(self.data_dir))
 
+    def get_price_fname(self, ticker):
         fname = os.path.join(self.data_dir, f"{ticker}_daily.csv")
         if not os.path.exists(fname):
             fname = os.path.join(self.data_dir, f"{ticker}.csv")
-        df = pd.read_csv(fname)
-
-        df['Date'] = df['Date'].apply(lambda x: datetime.datetime.strptime(x[:10], '%Y-%m-%d').date())
-
-        if start_date is not None:
-            df = df[df['Date'] >= start_date]
-        if end_date is not None:
-            df = df[df['Date'] <= end_date]
+        return(fname)
+
+    @staticmethod
+    def read_price_csv(fname, fields = None):
+        '''
+        parse a price csv file into a DataFrame with a Date column of datetime64.
+        Only the Date column and the requested fields are parsed, each with an explicit dtype.
+        '''
+        wanted = None if fields is None else set([cm.DataField.date.value] + [str(fld) for fld in fields])
+        usecols = None if wanted is None else (lambda col: col in wanted)
+        try:
+            df = pd.read_csv(fname, usecols = usecols, dtype = cm.Price_CSV_dtypes)
+        except ValueError:
+            # a column that does not fit the declared dtype (e.g. missing volume), let pandas infer it
+            df = pd.read_csv(fname, usecols = usecols, dtype = {cm.DataField.date.value: str})
+
+        # dates are written as 'YYYY-MM-DD HH:MM:SS-05:00', the first 10 characters is the trading date
+        dates = df[cm.DataField.date.value].str.slice(0, 10).to_numpy(dtype = str)
+        df[cm.DataField.date.value] = dates.astype('datetime64[D]')
+        return(df)
 
-        df = df.set_index('Date')
+    @staticmethod
+    def get_date_slice(dates, start_date = None, end_date = None):
+        '''
+        binary search the sorted datetime64[D] array for the rows between start_date and end_date inclusive
+        '''
+        lo = 0 if start_date is None else np.searchsorted(dates, np.datetime64(start_date, 'D'), side = 'left')
+        hi = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(end_date, 'D'), side = 'right')
+        return slice(int(lo), int(max(lo, hi)))
+
+    @staticmethod
+    def _to_hist_price_frame(df, dates, start_date, end_date):
+        '''
+        slice the frame by date range and index it by datetime.date
+        '''
+        if len(dates) > 1 and not (dates[1:] >= dates[:-1]).all():
+            order = np.argsort(dates, kind = 'stable')
+            df, dates = df.iloc[order], dates[order]
+
+        rows = DataLoader.get_date_slice(dates, start_date, end_date)
+        df = df.iloc[rows]
+        df.index = pd.Index(dates[rows].astype(object), name = cm.DataField.date.value)
         return(df)
 
+    def get_daily_hist_price(self, ticker, start_date = None, end_date = None, fields = None):
+        '''
+        return the daily prices of a ticker indexed by datetime.date, optionally restricted to a subset of fields
+        '''
+        if self.data_src == DataLoader.DataSource.SQLITE:
+            return self.get_daily_hist_prices([ticker], start_date, end_date, fields)[ticker]
+
+        fname = self.get_price_fname(ticker)
+        if self.price_cache is not None:
+            # the cache always holds every column, the requested ones are picked from the memory map
+            records, meta = self.price_cache.get_records(fname, DataLoader.read_price_csv)
+            columns = [col for col in meta['columns'] if col != cm.DataField.date.value]
+            if fields is not None:
+                columns = [str(fld) for fld in fields]
+            dates = records[cm.DataField.date.value]
+            df = PriceCache.records_to_frame(records, meta, columns)
+        else:
+            df = DataLoader.read_price_csv(fname, fields)
+            dates = df.pop(cm.DataField.date.value).to_numpy().astype('datetime64[D]')
+            if fields is not None:
+                df = df[[str(fld) for fld in fields]]
+
+        return DataLoader._to_hist_price_frame(df, dates, start_date, end_date)
+
+    def get_daily_hist_prices(self, tickers, start_date = None, end_date = None, fields = None):
+        '''
+        return a dict from ticker to its daily prices.
+        With the SQLITE data source the whole universe is fetched with a single query.
+        '''
+        if self.data_src != DataLoader.DataSource.SQLITE:
+            return {ticker: self.get_daily_hist_price(ticker, start_date, end_date, fields) for ticker in tickers}
+
+        long_df = self.price_db.get_daily_hist_prices(self.dataset, tickers, start_date, end_date, fields)
+        ticker_col = long_df.pop('Ticker').to_numpy()
+        dates = long_df.pop(cm.DataField.date.value).to_numpy().astype('datetime64[D]')
+
+        # rows are sorted by ticker, find the boundaries of each ticker
+        names, first_row = np.unique(ticker_col, return_index = True)
+        bounds = dict(zip(names, zip(first_row, list(first_row[1:]) + [len(ticker_col)])))
+
+        missing = [ticker for ticker in tickers if ticker not in bounds]
+        if len(missing) > 0:
+            raise Exception(f"Cannot find prices for {missing} in data set {self.dataset} of {self.db_connection}")
+
+        result = {}
+        for ticker in tickers:
+            lo, hi = bounds[ticker]
+            df = long_df.iloc[lo:hi]
+            if fields is None:
+                # mirror the csv layout: drop the columns the source file did not have and add the ticker
+                df = df.loc[:, df.notna().any(axis = 0)]
+                df = df.assign(Ticker = ticker)
+            result[ticker] = DataLoader._to_hist_price_frame(df, dates[lo:hi], None, None)
+        return result
+
+
+    def append_daily_bars(self, ticker, bars):
+        '''
+        append new daily bars, a DataFrame indexed by date with the stored fields, after the last stored date.
+        The price cache picks up the new rows without parsing the history again.
+        '''
+        if len(bars) == 0:
+            return
+        last_date = self.get_daily_hist_price(ticker, fields = [cm.DataField.close]).index[-1]
+        if bars.index[0] <= last_date:
+            raise Exception(f"Cannot append bars of {ticker} from {bars.index[0]}, prices are stored until {last_date}")
+
+        df = bars.copy()
+        df.insert(0, cm.DataField.date.value, np.array([str(dt) for dt in bars.index]))
+        if cm.DataField.volume.value in df.columns:
+            df[cm.DataField.volume.value] = df[cm.DataField.volume.value].astype('int64')
+        if self.data_src == DataLoader.DataSource.SQLITE:
+            with self.price_db.conn:
+                self.price_db.insert_frame(df, self.dataset, ticker)
+            return
+
+        fname = self.get_price_fname(ticker)
+        columns = list(pd.read_csv(fname, nrows = 0).columns)
+        missing = [col for col in df.columns if col not in columns]
+        if len(missing) > 0:
+            raise Exception(f"Cannot append {missing} to {fname}, it has columns {columns}")
+        if 'Ticker' in columns and 'Ticker' not in df.columns:
+            df['Ticker'] = ticker
+
+        with open(fname, 'rb') as fin:
+            fin.seek(-1, os.SEEK_END)
+            newline = fin.read(1) != b'\n'
+        with open(fname, 'a') as fout:
+            if newline:
+                fout.write('\n')
+            df.reindex(columns = columns).to_csv(fout, header = False, index = False)
+        if self.price_cache is not None:
+            self.price_cache.get_records(fname, DataLoader.read_price_csv)
+
+
+def get_data_source(pref):
+    '''
+    data source selected in the preference, csv unless specified
+    '''
+    return DataLoader.DataSource[str(getattr(pref, 'data_source', 'csv')).upper()]
+
 
 def _test1():
 
@@ -64,11 +216,34 @@ def _test1():
     print(df.head())
     print(df.tail())
 
+    df = loader.get_daily_hist_price('AWO', datetime.date(2015, 1, 1), datetime.date(2016, 1, 1),
+                                     fields = [cm.DataField.close, cm.DataField.volume])
+    print(df.head())
+
 # ==============================================
 # Testing
 # ==============================================
+def _test2():
+
+    print('Running test2')
+    pref = Preference()
+
+    db = PriceDB(pref.price_db)
+    db.ingest_dir(pref.data_root_dir)
+
+    csv_loader = DataLoader(pref, data_dir = pref.train_data_dir)
+    sql_loader = DataLoader(pref, data_src = DataLoader.DataSource.SQLITE, data_dir = pref.train_data_dir)
+
+    start_date = datetime.date(2015, 1, 1)
+    end_date = datetime.date(2016, 1, 1)
+    df1 = csv_loader.get_daily_hist_price('SPY', start_date, end_date)
+    df2 = sql_loader.get_daily_hist_price('SPY', start_date, end_date)
+    pd.testing.assert_frame_equal(df1, df2)
+    print(df2.tail())
+
 def _test():
     _test1()
+    _test2()
 
 
 if __name__ == '__main__':
@@ -4,42 +4,197 @@ Class to model an Equity Portfolio
 
 import os
 import enum
+import array
 import datetime
-import copy
 from collections import deque
 from datetime import date
+import numpy as np
+import pandas as pd
 
 import common as cm
 
 from preference import Preference
 
+
+def calculate_fifo_pnl(trades, prices):
+    '''
+    Mark to market of the lots opened and closed FIFO by the (date x ticker) arrays of the signed shares traded
+    at prices. Return the realized pnl to date, the unrealized pnl and the average cost of the open lots.
+
+    The shares of a trade first close the lots on the other side, the rest opens lots. On each side the closed
+    shares match the opened shares in order, so the cost of the first q shares closed is read from the
+    cumulative cost of the opened shares, a piecewise linear function of the cumulative opened shares.
+    '''
+    trades = np.nan_to_num(np.asarray(trades, dtype = float))
+    prices = np.asarray(prices, dtype = float)
+    holding = np.cumsum(trades, axis = 0)
+    before = np.zeros(holding.shape)
+    before[1:] = holding[:-1]
+
+    closing = np.where(np.sign(trades) == -np.sign(before), np.minimum(np.abs(trades), np.abs(before)), 0.)
+    opening = np.abs(trades) - closing
+
+    realized = np.zeros(trades.shape)
+    unrealized = np.zeros(trades.shape)
+    open_cost = np.zeros(trades.shape)
+    # long lots are opened by buys and closed by sells, short lots the other way round
+    for sign in [1, -1]:
+        opened = np.where(sign * trades > 0, opening, 0.)
+        closed = np.where(sign * trades < 0, closing, 0.)
+        opened_qty = np.cumsum(opened, axis = 0)
+        opened_cost = np.cumsum(np.where(opened > 0, opened * prices, 0.), axis = 0)
+        closed_qty = np.cumsum(closed, axis = 0)
+        closed_value = np.cumsum(np.where(closed > 0, closed * prices, 0.), axis = 0)
+
+        matched_cost = np.zeros(trades.shape)
+        for j in np.nonzero(closed_qty[-1] > 0)[0]:
+            matched_cost[:, j] = np.interp(closed_qty[:, j], np.r_[0., opened_qty[:, j]], np.r_[0., opened_cost[:, j]])
+
+        remaining_qty = opened_qty - closed_qty
+        remaining_cost = opened_cost - matched_cost
+        realized += sign * (closed_value - matched_cost)
+        unrealized += sign * (np.where(remaining_qty > 0, remaining_qty * prices, 0.) - remaining_cost)
+        open_cost += remaining_cost
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        cost_basis = np.where(holding != 0, open_cost / np.abs(holding), np.nan)
+    return realized, unrealized, cost_basis
+
+
+class TradeLedger(object):
+    '''
+    Columnar record of the lots of a portfolio, a row per lot in growable typed columns.
+    Tickers and dates are stored once and referred to by id. Closing part of a lot appends the closed
+    part as a new row and reduces the shares of the open row.
+    '''
+    OPEN = 0
+    CLOSED = 1
+
+    # column name -> array typecode
+    columns = {'ticker_id': 'i', 'entry_date_id': 'i', 'exit_date_id': 'i', 'shares_with_sign': 'd',
+               'entry_price': 'd', 'exit_price': 'd', 'status': 'b', 'pnl': 'd'}
+
+    def __init__(self):
+        for name, typecode in TradeLedger.columns.items():
+            setattr(self, name, array.array(typecode))
+        self.tickers = []
+        self.dates = []
+        self._ticker_ids = {}
+        self._date_ids = {}
+
+    @property
+    def size(self):
+        return len(self.status)
+
+    def get_column(self, name):
+        '''
+        numpy copy of a column
+        '''
+        values = getattr(self, name)
+        return np.frombuffer(values, dtype = values.typecode).copy()
+
+    def get_ticker_id(self, ticker):
+        if ticker not in self._ticker_ids:
+            self._ticker_ids[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        return self._ticker_ids[ticker]
+
+    def get_date_id(self, trade_date):
+        if trade_date not in self._date_ids:
+            self._date_ids[trade_date] = len(self.dates)
+            self.dates.append(trade_date)
+        return self._date_ids[trade_date]
+
+    def open(self, ticker_id, entry_date_id, shares_with_sign, entry_price):
+        '''
+        append an open lot, return its row
+        '''
+        row = self.size
+        self.ticker_id.append(ticker_id)
+        self.entry_date_id.append(entry_date_id)
+        self.exit_date_id.append(-1)
+        self.shares_with_sign.append(shares_with_sign)
+        self.entry_price.append(entry_price)
+        self.exit_price.append(np.nan)
+        self.status.append(TradeLedger.OPEN)
+        self.pnl.append(np.nan)
+        return(row)
+
+    def close(self, row, exit_date_id, exit_price):
+        self.exit_date_id[row] = exit_date_id
+        self.exit_price[row] = exit_price
+        self.status[row] = TradeLedger.CLOSED
+        self.pnl[row] = self.shares_with_sign[row] * (self.exit_price[row] - self.entry_price[row])
+
+    def close_partial(self, row, shares_with_sign, exit_date_id, exit_price):
+        '''
+        close shares_with_sign of the lot in a new row, the lot keeps the rest open
+        '''
+        closed = self.open(self.ticker_id[row], self.entry_date_id[row], shares_with_sign, self.entry_price[row])
+        self.shares_with_sign[row] = self.shares_with_sign[row] - shares_with_sign
+        self.close(closed, exit_date_id, exit_price)
+        return(closed)
+
+    def get_rows(self, ticker_id, status):
+        return np.nonzero((self.get_column('ticker_id') == ticker_id) & (self.get_column('status') == status))[0]
+
+    def get_closed_rows_by_ticker(self):
+        '''
+        list by ticker id of the rows of its closed lots
+        '''
+        ticker_id = self.get_column('ticker_id')
+        rows = np.nonzero(self.get_column('status') == TradeLedger.CLOSED)[0]
+        rows = rows[np.argsort(ticker_id[rows], kind = 'stable')]
+        counts = np.bincount(ticker_id[rows], minlength = len(self.tickers))
+        return np.split(rows, np.cumsum(counts)[:-1])
+
+
 class Position(object):
     '''
-    Closed or Open position by ticker
+    Closed or Open position by ticker, a view of a row of the TradeLedger
     '''
     class Type(enum.Enum):
         OPEN = "open"
         CLOSED = "closed"
 
-    def __init__(self, ticker, entry_date, shares_with_sign, entry_price, exit_date = None, exit_price = None, type = Type.OPEN):
-        self.ticker = ticker
+    __slots__ = ['ledger', 'row']
+
+    def __init__(self, ledger, row):
+        self.ledger = ledger
+        self.row = row
 
-        self.entry_date = entry_date
+    @property
+    def ticker(self):
+        return self.ledger.tickers[self.ledger.ticker_id[self.row]]
+
+    @property
+    def type(self):
+        return Position.Type.CLOSED if self.ledger.status[self.row] == TradeLedger.CLOSED else Position.Type.OPEN
+
+    @property
+    def entry_date(self):
+        return self.ledger.dates[self.ledger.entry_date_id[self.row]]
+
+    @property
+    def shares_with_sign(self):
         # negative shares means it is a short position
-        self.shares_with_sign = shares_with_sign
+        return self.ledger.shares_with_sign[self.row]
 
-        self.entry_price = entry_price
-        self.exit_date = exit_date
-        self.exit_price = exit_price
-        self.type = type
+    @property
+    def entry_price(self):
+        return self.ledger.entry_price[self.row]
 
-        self.update()
+    @property
+    def exit_date(self):
+        return self.ledger.dates[self.ledger.exit_date_id[self.row]] if self.type == Position.Type.CLOSED else None
 
-    def update(self):
-        if self.exit_price is not None:
-            self.pnl = self.shares_with_sign * (self.exit_price - self.entry_price)
-        else:
-            self.pnl = None
+    @property
+    def exit_price(self):
+        return self.ledger.exit_price[self.row] if self.type == Position.Type.CLOSED else None
+
+    @property
+    def pnl(self):
+        return self.ledger.pnl[self.row] if self.type == Position.Type.CLOSED else None
 
     def __str__(self):
         txt = f"{self.ticker}: {self.type.value} position: entry_date: {self.entry_date}, entry_price: {self.entry_price} "
@@ -47,120 +202,120 @@ class Position(object):
         return (txt)
 
 
-class Portfolio(object):
+class LotStore(object):
     '''
-    class to model a portfolio. It has a dict from ticker to a list of closed position to that ticker for storing
-    historical trades. It also has a queue to manage current open positions, whose disposal method can be either FIFO or LIFO
+    Open lots of a ticker: the ledger rows of the open long and short lots in deques ordered by entry
+    '''
+    def __init__(self, ledger, ticker):
+        self.ledger = ledger
+        self.ticker_id = ledger.get_ticker_id(ticker)
+        self.open_long = deque()
+        self.open_short = deque()
+
+    def open(self, trade_date, shares_with_sign, trade_price):
+        row = self.ledger.open(self.ticker_id, self.ledger.get_date_id(trade_date), shares_with_sign, trade_price)
+        if shares_with_sign > 0:
+            self.open_long.append(row)
+        else:
+            self.open_short.append(row)
+
+    def get_open_lots(self, long):
+        return self.open_long if long else self.open_short
+
+    def get_open_shares(self, long):
+        return sum([abs(self.ledger.shares_with_sign[row]) for row in self.get_open_lots(long)])
+
+    def close(self, long, trade_date, trade_price, shares, disposal_method):
+        '''
+        close up to shares of the open long or short lots in the disposal order, the last lot touched can be
+        partially closed. Return the shares left once all the lots are closed.
+        '''
+        lots = self.get_open_lots(long)
+        sign = 1 if long else -1
+        fifo = disposal_method == cm.DisposalMethod.FIFO
+        date_id = None
+        while shares > 0 and len(lots) > 0:
+            date_id = self.ledger.get_date_id(trade_date) if date_id is None else date_id
+            row = lots[0] if fifo else lots[-1]
+            lot_shares = abs(self.ledger.shares_with_sign[row])
+            if shares >= lot_shares:
+                lots.popleft() if fifo else lots.pop()
+                self.ledger.close(row, date_id, trade_price)
+                shares -= lot_shares
+            else:
+                self.ledger.close_partial(row, sign * shares, date_id, trade_price)
+                shares = 0
+        return(shares)
+
+    def get_closed_rows(self):
+        return self.ledger.get_rows(self.ticker_id, TradeLedger.CLOSED)
 
-    TODO: implement LIFO
+
+class Portfolio(object):
+    '''
+    class to model a portfolio. Its lots are recorded in a TradeLedger, the open lots of every ticker are kept
+    in a LotStore and disposed either FIFO or LIFO. The positions are views of the ledger rows.
     '''
     def __init__(self, name, disposal_method = cm.DisposalMethod.FIFO):
         self.name = name
         self.disposal_method = disposal_method
-        # dict from ticker to a list of positions
-        self._positions_by_ticker = {}
+        self.ledger = TradeLedger()
+        # dict from ticker to its open lots
+        self._lots_by_ticker = {}
+
+    def _get_lots(self, ticker):
+        if ticker not in self._lots_by_ticker:
+            self._lots_by_ticker[ticker] = LotStore(self.ledger, ticker)
+        return self._lots_by_ticker[ticker]
 
-        if disposal_method == cm.DisposalMethod.LIFO:
-            raise Exception(f"{disposal_method} is not currently supported, only FIFO is supported")
+    def register_tickers(self, tickers):
+        '''
+        add the tickers ahead of their trades, the trade history lists them in this order
+        '''
+        for ticker in tickers:
+            self._get_lots(ticker)
+
+    def _get_positions(self, rows):
+        return [Position(self.ledger, row) for row in rows]
 
     def get_open_long_positions(self, ticker):
-        return [x for x in self._positions_by_ticker[ticker] if x.shares_with_sign > 0 and x.type == Position.Type.OPEN]
+        return self._get_positions(self._lots_by_ticker[ticker].open_long)
 
     def get_open_short_positions(self, ticker):
-        return [x for x in self._positions_by_ticker[ticker] if x.shares_with_sign < 0 and x.type == Position.Type.OPEN]
+        return self._get_positions(self._lots_by_ticker[ticker].open_short)
 
     def get_closed_positions(self, ticker):
-        return [x for x in self._positions_by_ticker[ticker] if x.type == Position.Type.CLOSED]
+        return self._get_positions(self._lots_by_ticker[ticker].get_closed_rows())
 
     def get_positions_by_ticker(self, ticker):
-        return self.get_closed_positions(ticker) + self.get_open_long_positions(ticker) + self.get_open_short_positions(ticker)
+        lots = self._lots_by_ticker[ticker]
+        return self._get_positions(list(lots.get_closed_rows()) + list(lots.open_long) + list(lots.open_short))
 
     def get_all_positions(self):
         result = []
-        for ticker in self._positions_by_ticker.keys():
-            result += self.get_positions_by_ticker(ticker)
+        # the ticker ids follow the order of the tickers in _lots_by_ticker
+        for lots, closed in zip(self._lots_by_ticker.values(), self.ledger.get_closed_rows_by_ticker()):
+            result += self._get_positions(list(closed) + list(lots.open_long) + list(lots.open_short))
         return result
 
 
     def _handle_buy(self, ticker, trade_action, trade_date, trade_price, trade_shares):
         '''
-        Close all short lots, if need to buy more, create open positions
+        Close the short lots, if need to buy more, create open positions
         '''
-        outstanding_shares = trade_shares
-        # try closing with full lots first
-        for pos in self.get_open_short_positions(ticker):
-            if outstanding_shares >= abs(pos.shares_with_sign):
-                pos.type = Position.Type.CLOSED
-                pos.exit_date = trade_date
-                pos.exit_price = trade_price
-                pos.update()
-                outstanding_shares -= abs(pos.shares_with_sign)
-
-        # after closing as much as possible and there is still some outstanding shares
-        # then get the remaining open short positions
+        lots = self._get_lots(ticker)
+        outstanding_shares = lots.close(False, trade_date, trade_price, trade_shares, self.disposal_method)
         if outstanding_shares > 0:
-            for pos in self.get_open_short_positions(ticker):
-                # close partial
-                if outstanding_shares < abs(pos.shares_with_sign):
-                    partial_closed = copy.deepcopy(pos)
-                    partial_closed.type = Position.Type.CLOSED
-                    partial_closed.shares_with_sign = -1 * outstanding_shares
-
-                    # reduce the lot size of the existing open lot
-                    pos.shares_with_sign = pos.shares_with_sign + outstanding_shares
-
-                    # add the partial closed position to the trade record
-                    partial_closed.exit_date = trade_date
-                    partial_closed.exit_price = trade_price
-                    partial_closed.update()
-                    self._positions_by_ticker[ticker].append(partial_closed)
-
-                    outstanding_shares = 0
-                    break
-
-            # if there is still some outstanding_shares, add new long position
-            if outstanding_shares > 0:
-                self._positions_by_ticker[ticker].append(Position(ticker, trade_date, outstanding_shares, trade_price))
+            lots.open(trade_date, outstanding_shares, trade_price)
 
     def _handle_sell(self, ticker, trade_action, trade_date, trade_price, trade_shares):
         '''
-        Close all long lots, if need to sell more, create open positions
+        Close the long lots, if need to sell more, create open positions
         '''
-        outstanding_shares = trade_shares
-        # try closing with full lots first
-        for pos in self.get_open_long_positions(ticker):
-            if outstanding_shares >= abs(pos.shares_with_sign):
-                pos.type = Position.Type.CLOSED
-                pos.exit_date = trade_date
-                pos.exit_price = trade_price
-                pos.update()
-                outstanding_shares -= abs(pos.shares_with_sign)
-
-        # after closing as much as possible and there is still some outstanding shares left to sell
-        # then get the remaining open long positions
+        lots = self._get_lots(ticker)
+        outstanding_shares = lots.close(True, trade_date, trade_price, trade_shares, self.disposal_method)
         if outstanding_shares > 0:
-            for pos in self.get_open_long_positions(ticker):
-                # close partial lot
-                if outstanding_shares < abs(pos.shares_with_sign):
-                    partial_closed = copy.deepcopy(pos)
-                    partial_closed.type = Position.Type.CLOSED
-                    partial_closed.shares_with_sign = outstanding_shares
-
-                    # reduce the lot size of the existing open lot
-                    pos.shares_with_sign = pos.shares_with_sign - outstanding_shares
-
-                    # add the partial closed position to the trade record
-                    partial_closed.exit_date = trade_date
-                    partial_closed.exit_price = trade_price
-                    partial_closed.update()
-                    self._positions_by_ticker[ticker].append(partial_closed)
-
-                    outstanding_shares = 0
-                    break
-
-            # if there is still some outstanding_shares, add new short position
-            if outstanding_shares > 0:
-                self._positions_by_ticker[ticker].append(Position(ticker, trade_date, -1 * outstanding_shares, trade_price))
+            lots.open(trade_date, -1 * outstanding_shares, trade_price)
 
 
     def add_trade(self, ticker, trade_action, trade_date, trade_price, trade_shares):
@@ -175,14 +330,13 @@ class Portfolio(object):
         if trade_action is None or trade_action == cm.TradeAction.NONE:
             return
 
-        if ticker not in self._positions_by_ticker.keys():
-            self._positions_by_ticker[ticker] = []
-
-        total_short_shares = sum([abs(x.shares_with_sign) for x in self.get_open_short_positions(ticker)])
-        total_long_shares = sum([abs(x.shares_with_sign) for x in self.get_open_long_positions(ticker)])
+        lots = self._get_lots(ticker)
 
         # overwrite trade shares if it is a closing trade
         if trade_shares is None:
+            total_short_shares = lots.get_open_shares(False)
+            total_long_shares = lots.get_open_shares(True)
+
             if trade_action == cm.TradeAction.BUY_TO_CLOSE_ALL:
                 trade_shares = total_short_shares
             elif trade_action == cm.TradeAction.SELL_TO_CLOSE_ALL:
@@ -205,30 +359,47 @@ class Portfolio(object):
 
     def close_all_open_positions(self, pricing_matrix):
         '''
-        Get all open positions, close them all with the last row
+        Close all the open positions at the prices of the last row
         '''
         exit_date = pricing_matrix.index[-1]
-        for pos in self.get_open_long_positions() + self.get_open_short_positions():
-            pos.exit_date = exit_date
-            pos.exit_price = pricing_matrix[pos.ticker][-1]
-            pos.type = Position.Type.CLOSED
-            pos.update()
+        for ticker, lots in self._lots_by_ticker.items():
+            exit_price = pricing_matrix[ticker].iloc[-1]
+            for long in [True, False]:
+                lots.close(long, exit_date, exit_price, float('inf'), self.disposal_method)
+
+    def get_trade_history(self, as_text = False):
+        '''
+        DataFrame of the lots in the order of get_all_positions, the exit date, exit price and pnl of
+        the open lots are missing. With as_text the dates are str as in the trade history file.
+        '''
+        ledger = self.ledger
+        rows = [np.zeros(0, dtype = int)]
+        for lots, closed in zip(self._lots_by_ticker.values(), ledger.get_closed_rows_by_ticker()):
+            rows += [closed, np.array(lots.open_long, dtype = int), np.array(lots.open_short, dtype = int)]
+        rows = np.concatenate(rows)
+
+        # the last date is the missing exit date of the open lots, every date is formatted once
+        dates = np.array(ledger.dates + [None], dtype = object)
+        if as_text:
+            dates = np.array([str(x) for x in ledger.dates] + [''], dtype = object)
+        status = np.array([Position.Type.OPEN.value, Position.Type.CLOSED.value], dtype = object)
+        columns = {'Ticker': np.array(ledger.tickers, dtype = object)[ledger.get_column('ticker_id')[rows]],
+                   'Shares With Sign': ledger.get_column('shares_with_sign')[rows],
+                   'Entry Date': dates[ledger.get_column('entry_date_id')[rows]],
+                   'Entry Price': ledger.get_column('entry_price')[rows],
+                   'Exit Date': dates[ledger.get_column('exit_date_id')[rows]],
+                   'Exit Price': ledger.get_column('exit_price')[rows],
+                   'Status': status[ledger.get_column('status')[rows]],
+                   'PnL': ledger.get_column('pnl')[rows]}
+        return pd.DataFrame(columns)
 
     def save_trade_history(self, output_fname):
-        fout = open(output_fname, 'w')
-        header = "Ticker,Shares With Sign,Entry Date,Entry Price,Exit Date,Exit Price,Status,PnL\n"
-        fout.write(header)
-        for pos in self.get_all_positions():
-            txt = f"{pos.ticker},{pos.shares_with_sign},{pos.entry_date},{pos.entry_price},"
-            txt += f"{pos.exit_date},{pos.exit_price},{pos.type.value},{pos.pnl}"
-            fout.write('%s\n' % txt.replace('None',''))
-        fout.close()
+        self.get_trade_history(as_text = True).to_csv(output_fname, index = False)
 
     def summary(self):
         ''' short summary
         '''
-        pos = self.get_all_positions()
-        txt = f"Trade count: {len(pos)}"
+        txt = f"Trade count: {self.ledger.size}"
         return (txt)
 
 
@@ -293,11 +464,73 @@ def _test1():
     print("Saving trade history to ", output_fname)
     port.save_trade_history(output_fname)
 
+def _test2():
+    import pandas as pd
+
+    d1 = datetime.date(2020, 1, 1)
+    d2 = datetime.date(2020, 2, 1)
+    d3 = datetime.date(2020, 3, 1)
+    trades = [('AWO', cm.TradeAction.BUY, d1, 100, 100),
+              ('AWO', cm.TradeAction.BUY, d2, 110, 50),
+              ('AWO', cm.TradeAction.SELL, d3, 120, 60)]
+
+    # FIFO sells from the first lot, LIFO closes the last lot and 10 shares of the first one
+    expected = {cm.DisposalMethod.FIFO: ([(d1, 60, 1200)], [(d1, 40), (d2, 50)]),
+                cm.DisposalMethod.LIFO: ([(d2, 50, 500), (d1, 10, 200)], [(d1, 90)])}
+    for method, (closed, open_lots) in expected.items():
+        port = Portfolio('test', disposal_method = method)
+        for trade in trades:
+            port.add_trade(*trade)
+        assert [(x.entry_date, x.shares_with_sign, x.pnl) for x in port.get_closed_positions('AWO')] == closed, method
+        assert [(x.entry_date, x.shares_with_sign) for x in port.get_open_long_positions('AWO')] == open_lots, method
+
+        pricing_matrix = pd.DataFrame({'AWO': [125., 130.]}, index = [d3, d3 + datetime.timedelta(days = 1)])
+        port.close_all_open_positions(pricing_matrix)
+        assert len(port.get_open_long_positions('AWO')) == 0
+        # the open lots are closed at 130, both methods realize the same total pnl
+        assert sum([x.pnl for x in port.get_all_positions()]) == 3400, method
+    print("FIFO and LIFO disposal are correct")
+
+def _test3():
+    # random buys and sells of 3 tickers, with positions going from long to short and back
+    rng = np.random.default_rng(0)
+    dates = [datetime.date(2020, 1, 1) + datetime.timedelta(days = i) for i in range(500)]
+    tickers = ['AWO', 'CNN', 'MOD']
+    trades = rng.integers(-100, 101, size = (len(dates), len(tickers))) * (rng.random((len(dates), len(tickers))) < 0.3)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, size = trades.shape), axis = 0))
+    realized, unrealized, cost_basis = calculate_fifo_pnl(trades, prices)
+
+    port = Portfolio('test')
+    for i, j in zip(*np.nonzero(trades)):
+        action = cm.TradeAction.BUY if trades[i, j] > 0 else cm.TradeAction.SELL
+        port.add_trade(tickers[j], action, dates[i], prices[i, j], float(abs(trades[i, j])))
+
+    for j, ticker in enumerate(tickers):
+        expected = sum([x.pnl for x in port.get_closed_positions(ticker)])
+        assert abs(realized[-1, j] - expected) < 1e-6, ticker
+
+        # the open lots are all long or all short
+        lots = port.get_open_long_positions(ticker) + port.get_open_short_positions(ticker)
+        shares = sum([x.shares_with_sign for x in lots])
+        assert shares == trades[:, j].sum(), ticker
+        if shares != 0:
+            cost = sum([abs(x.shares_with_sign) * x.entry_price for x in lots])
+            value = sum([x.shares_with_sign * (prices[-1, j] - x.entry_price) for x in lots])
+            assert abs(cost_basis[-1, j] - cost / abs(shares)) < 1e-9, ticker
+            assert abs(unrealized[-1, j] - value) < 1e-6, ticker
+
+    # realized and unrealized pnl add up to the trading pnl
+    trading_pnl = -np.cumsum(trades * prices, axis = 0) + np.cumsum(trades, axis = 0) * prices
+    np.testing.assert_allclose(realized + unrealized, trading_pnl, atol = 1e-6)
+    print("FIFO pnl matrices match the lots of the portfolio")
+
 def _test():
     _test1()
+    _test2()
+    _test3()
 
 if __name__ == "__main__":
     import sys
     sys.path.append(os.getcwd())
-    _test1()
+    _test()
 
@@ -40,6 +40,17 @@ class Preference(object):
                         'train_data_dir': os.path.join(_data_root, 'train'),
                         'test_data_dir': os.path.join(_data_root, 'test'),
                         'meta_data_dir': os.path.join(_data_root, 'meta'),
+                        'cache_dir': os.path.join(_data_root, 'cache'),
+                        'use_price_cache': True,
+                        'data_source': 'csv',
+                        'price_db': os.path.join(_data_root, 'prices.db'),
+                        'num_workers': 1, 'worker_pool': 'thread',
+                        'datamatrix_cache_mb': 2048,
+                        'filter_universe': False,
+                        'engine': 'auto',
+                        'strategy_workers': 1,
+                        'disposal_method': 'FIFO',
+                        'export_format': 'csv', 'export_artifacts': None,
                         'test_input_dir': os.path.join(_test_root, 'output'),
                         # 'test_output_dir': os.path.abspath(os.path.join(os.environ["ROOT_DIR"], os.pardir, 'output')),
                         # 'test_output_dir': os.path.abspath(os.path.join(os.getenv("ROOT_DIR", '/default/path'), os.pardir, 'output')),
@@ -101,6 +112,29 @@ def get_default_parser():
 
     parser.add_argument('--data_dir', dest = 'data_dir', default=None, help='data dir')
     parser.add_argument('--output_dir', dest = 'output_dir', default=None, help='output dir')
+    parser.add_argument('--cache_dir', dest = 'cache_dir', default=Preference._default_option['cache_dir'], help='price cache dir')
+    parser.add_argument('--data_source', dest = 'data_source', default='csv', choices=['csv', 'sqlite'], help='load prices from csv files or the price database')
+    parser.add_argument('--price_db', dest = 'price_db', default=Preference._default_option['price_db'], help='SQLite price database')
+    parser.add_argument('--num_workers', dest = 'num_workers', default=1, type=int, help='number of workers for loading the universe')
+    parser.add_argument('--worker_pool', dest = 'worker_pool', default='thread', choices=['thread', 'process'],
+                        help='use threads (I/O bound) or processes (indicator calculation) for the workers')
+    parser.add_argument('--datamatrix_cache_mb', dest = 'datamatrix_cache_mb', default=2048, type=int,
+                        help='memory budget of the in-process DataMatrix cache in MB, 0 to disable')
+    parser.add_argument('--filter_universe', action='store_true', dest='filter_universe', default=False,
+                        help='drop the tickers whose prices do not cover the backtest period')
+    parser.add_argument('--engine', dest='engine', default='auto', choices=['auto', 'numpy', 'numba'],
+                        help='backend of the strategy kernels, auto uses numba when it is installed')
+    parser.add_argument('--strategy_workers', dest='strategy_workers', default=1, type=int,
+                        help='number of processes running the strategies of a backtest concurrently')
+    parser.add_argument('--disposal_method', dest='disposal_method', default='FIFO', choices=['FIFO', 'LIFO'],
+                        help='order in which the open lots are closed in the trade history')
+    parser.add_argument('--export_format', dest='export_format', default='csv', choices=['csv', 'parquet', 'feather', 'npz'],
+                        help='format of the strategy output, parquet and feather require pyarrow')
+    parser.add_argument('--export_artifacts', dest='export_artifacts', default=None,
+                        help='strategy output to save with | separator, e.g. pnl|trade_history, all by default '
+                             '(data, prices, taction, tsignal, shares, holding, pnl, pnl_matrix, trade_history)')
+    parser.add_argument('--no_price_cache', action='store_false', dest='use_price_cache', default=True,
+                        help='always parse the csv files instead of using the binary price cache')
 
     return(parser)
 
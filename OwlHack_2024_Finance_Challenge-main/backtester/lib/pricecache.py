@@ -0,0 +1,270 @@
+'''
+Persistent binary cache for historical price files
+'''
+
+import os
+import io
+import json
+import hashlib
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+
+
+class PriceCache(object):
+
+    '''
+    On-disk columnar cache of parsed price files.
+
+    Every source file is stored as two files in the cache directory
+        {key}.npy   a numpy structured array, one field per column, dates as datetime64[D]
+        {key}.json  column names and the signature (mtime, size, sha1) of the source file
+
+    Warm loads memory map the .npy file in copy-on-write mode, so nothing is parsed and the
+    columns are views into the page cache. An entry is reused as long as the source file has the
+    same mtime and size, or the same content hash when only the mtime changed (e.g. after a checkout).
+    When rows were only appended to the source file, just the new rows are parsed and added to the entry.
+    '''
+
+    version = 1
+    date_field = 'Date'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok = True)
+
+    def _key(self, source_fname):
+        '''
+        cache key is the file name plus a short hash of the full path, so that train/SPY.csv
+        and test/SPY.csv do not collide
+        '''
+        path = os.path.abspath(source_fname)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.cache_dir, f"{stem}-{digest}")
+
+    @staticmethod
+    def _file_hash(fname):
+        sha1 = hashlib.sha1()
+        with open(fname, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    @staticmethod
+    def _stat(fname):
+        st = os.stat(fname)
+        return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+    def _read_meta(self, key):
+        try:
+            with open(f"{key}.json", 'r') as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        tmp_fname = f"{key}.json.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_fname, 'w') as fout:
+            json.dump(meta, fout)
+        os.replace(tmp_fname, f"{key}.json")
+
+    def is_valid(self, source_fname):
+        '''
+        check if the cached entry for the source file is still current
+        '''
+        key = self._key(source_fname)
+        meta = self._read_meta(key)
+        if meta is None or meta.get('version') != PriceCache.version or not os.path.exists(f"{key}.npy"):
+            return False
+
+        stat = self._stat(source_fname)
+        if stat == meta['source']:
+            return True
+
+        # mtime changed but the content might not have, compare the content hash before rebuilding
+        if stat['size'] == meta['source']['size'] and self._file_hash(source_fname) == meta['sha1']:
+            meta['source'] = stat
+            self._write_meta(key, meta)
+            return True
+
+        return False
+
+    def load_records(self, source_fname):
+        '''
+        return the memory mapped structured array and its meta data, or None when the entry is stale
+        '''
+        if not self.is_valid(source_fname):
+            return None
+        key = self._key(source_fname)
+        return np.load(f"{key}.npy", mmap_mode = 'c'), self._read_meta(key)
+
+    @staticmethod
+    def _to_records(df, dtypes = None):
+        '''
+        convert a DataFrame to a structured array, text columns are sized to their longest value unless dtypes is given
+        '''
+        if dtypes is None:
+            dtypes = []
+            for col in df.columns:
+                if col == PriceCache.date_field:
+                    dtypes.append((col, 'M8[D]'))
+                elif df[col].dtype == object:
+                    width = max(1, int(df[col].astype(str).str.len().max()) if len(df) > 0 else 1)
+                    dtypes.append((col, f"U{width}"))
+                else:
+                    dtypes.append((col, df[col].dtype.str))
+
+        records = np.empty(len(df), dtype = dtypes)
+        for col in df.columns:
+            if col == PriceCache.date_field and df[col].dtype == object:
+                records[col] = np.array(df[col].tolist(), dtype = 'M8[D]')
+            elif col == PriceCache.date_field:
+                records[col] = df[col].to_numpy().astype('M8[D]')
+            else:
+                records[col] = df[col].to_numpy()
+        return records
+
+    def _save_records(self, key, records):
+        tmp_fname = f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        np.save(tmp_fname, records)
+        os.replace(tmp_fname, f"{key}.npy")
+
+    def store(self, source_fname, df):
+        '''
+        store a DataFrame with a Date column and numeric or text columns
+        '''
+        key = self._key(source_fname)
+        stat = self._stat(source_fname)
+        self._save_records(key, PriceCache._to_records(df))
+
+        meta = {'version': PriceCache.version, 'columns': list(df.columns),
+                'text_columns': [col for col in df.columns if df[col].dtype == object and col != PriceCache.date_field],
+                'source': stat, 'sha1': self._file_hash(source_fname)}
+        self._write_meta(key, meta)
+
+    def append(self, source_fname, reader):
+        '''
+        bring a stale entry up to date when rows were only appended to the source file since it was cached,
+        parsing just the new rows. Return False when the file was changed in any other way.
+        '''
+        key = self._key(source_fname)
+        meta = self._read_meta(key)
+        if meta is None or meta.get('version') != PriceCache.version or not os.path.exists(f"{key}.npy"):
+            return False
+
+        old_size = meta['source']['size']
+        stat = self._stat(source_fname)
+        if stat['size'] <= old_size:
+            return False
+
+        sha1 = hashlib.sha1()
+        with open(source_fname, 'rb') as fin:
+            header = fin.readline()
+            fin.seek(0)
+            remaining = old_size
+            last = b''
+            while remaining > 0:
+                chunk = fin.read(min(1 << 20, remaining))
+                if len(chunk) == 0:
+                    return False
+                sha1.update(chunk)
+                remaining -= len(chunk)
+                last = chunk[-1:]
+
+            # the cached part must be unchanged and end on a complete line
+            if sha1.hexdigest() != meta['sha1'] or last != b'\n':
+                return False
+            tail = fin.read(stat['size'] - old_size)
+            sha1.update(tail)
+
+        df = reader(io.StringIO((header + tail).decode('utf-8')))
+        if list(df.columns) != meta['columns']:
+            return False
+
+        records = np.load(f"{key}.npy")
+        for col in meta['text_columns']:
+            if len(df) > 0 and df[col].astype(str).str.len().max() > records.dtype[col].itemsize // 4:
+                return False
+
+        self._save_records(key, np.concatenate([records, PriceCache._to_records(df, records.dtype)]))
+        meta['source'] = stat
+        meta['sha1'] = sha1.hexdigest()
+        self._write_meta(key, meta)
+        return True
+
+    @staticmethod
+    def records_to_frame(records, meta, columns = None):
+        '''
+        convert cached records into a DataFrame with the given columns, Date is returned as datetime.date
+        '''
+        if columns is None:
+            columns = meta['columns']
+        data = {}
+        for col in columns:
+            if col == PriceCache.date_field or col in meta['text_columns']:
+                data[col] = records[col].astype(object)
+            else:
+                data[col] = records[col]
+        return pd.DataFrame(data, columns = columns)
+
+    def get_records(self, source_fname, reader):
+        '''
+        return the cached records and meta data for the source file,
+        parsing it with reader and populating the cache on a miss
+        '''
+        cached = self.load_records(source_fname)
+        if cached is None:
+            if not self.append(source_fname, reader):
+                self.store(source_fname, reader(source_fname))
+            cached = self.load_records(source_fname)
+        return cached
+
+    def get_frame(self, source_fname, reader):
+        '''
+        return the cached DataFrame for the source file
+        '''
+        return PriceCache.records_to_frame(*self.get_records(source_fname, reader))
+
+    def clear(self):
+        '''
+        remove every cached entry
+        '''
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.npy') or fname.endswith('.json'):
+                os.remove(os.path.join(self.cache_dir, fname))
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import time
+    from preference import Preference
+
+    pref = Preference()
+    cache = PriceCache(pref.cache_dir)
+    fname = os.path.join(pref.train_data_dir, 'SPY.csv')
+
+    def reader(fname):
+        df = pd.read_csv(fname)
+        df['Date'] = df['Date'].apply(lambda x: datetime.datetime.strptime(x[:10], '%Y-%m-%d').date())
+        return df
+
+    start = time.time()
+    cold = reader(fname)
+    print(f"csv load: {time.time() - start:.4f}s")
+
+    cache.store(fname, cold)
+    start = time.time()
+    warm = cache.get_frame(fname, reader)
+    print(f"cache load: {time.time() - start:.4f}s")
+
+    pd.testing.assert_frame_equal(cold, warm)
+    print(warm.tail())
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    _test()
@@ -0,0 +1,191 @@
+'''
+SQLite store for daily prices
+'''
+
+import os
+import glob
+import sqlite3
+import numpy as np
+import pandas as pd
+
+import common as cm
+
+
+class PriceDB(object):
+
+    '''
+    Bulk store of daily prices for every data set (ETF, train, test) in a single SQLite table.
+
+    Rows are keyed by (dataset, ticker, date) and the table is created WITHOUT ROWID, so the primary key
+    b-tree is a covering index holding the prices themselves: fetching a universe over a date range is a
+    set of range scans on the key without any lookup into a separate table.
+    '''
+
+    table = 'daily_price'
+
+    # csv column -> sql column
+    columns = {cm.DataField.open.value: 'open',
+               cm.DataField.high.value: 'high',
+               cm.DataField.low.value: 'low',
+               cm.DataField.close.value: 'close',
+               cm.DataField.volume.value: 'volume',
+               'Dividends': 'dividends',
+               'Stock Splits': 'stock_splits',
+               'Capital Gains': 'capital_gains'}
+
+    def __init__(self, db_connection):
+        '''
+        db_connection is either a sqlite3.Connection or the path of the database file
+        '''
+        if isinstance(db_connection, sqlite3.Connection):
+            self.conn = db_connection
+        else:
+            self.conn = sqlite3.connect(db_connection)
+
+    def create_schema(self):
+        sql_columns = ',\n'.join([f"{col} {'INTEGER' if col == 'volume' else 'REAL'}" for col in PriceDB.columns.values()])
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {PriceDB.table} (
+                dataset TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                date TEXT NOT NULL,
+                {sql_columns},
+                PRIMARY KEY (dataset, ticker, date)
+            ) WITHOUT ROWID''')
+        self.conn.commit()
+
+    def ingest_csv(self, fname, dataset, ticker = None):
+        '''
+        load one price csv file, existing rows for the same (dataset, ticker, date) are replaced
+        '''
+        from loader import DataLoader
+
+        if ticker is None:
+            ticker = os.path.splitext(os.path.basename(fname))[0]
+            if ticker.endswith('_daily'):
+                ticker = ticker[:-len('_daily')]
+
+        return self.insert_frame(DataLoader.read_price_csv(fname), dataset, ticker)
+
+    def insert_frame(self, df, dataset, ticker):
+        '''
+        insert the rows of a DataFrame with a Date column, existing rows for the same (dataset, ticker, date) are replaced
+        '''
+        dates = df[cm.DataField.date.value].to_numpy().astype('datetime64[D]').astype(str)
+
+        data = [np.full(len(df), dataset, dtype = object), np.full(len(df), ticker, dtype = object), dates.astype(object)]
+        for col in PriceDB.columns.keys():
+            if col in df.columns:
+                values = df[col].astype(object).where(df[col].notna(), None)
+                data.append(values.to_numpy())
+            else:
+                data.append(np.full(len(df), None, dtype = object))
+
+        placeholders = ', '.join(['?'] * len(data))
+        self.conn.executemany(f"INSERT OR REPLACE INTO {PriceDB.table} VALUES ({placeholders})", zip(*data))
+        return len(df)
+
+    def ingest_dir(self, data_root_dir, datasets = None, verbose = False):
+        '''
+        bulk load every csv file in the data set sub directories (ETF, train, test, ...) of data_root_dir
+        '''
+        self.create_schema()
+        if datasets is None:
+            datasets = [name for name in sorted(os.listdir(data_root_dir))
+                        if os.path.isdir(os.path.join(data_root_dir, name)) and name not in ['meta', 'cache', 'output']]
+
+        self.conn.execute('PRAGMA synchronous = OFF')
+        count = 0
+        with self.conn:
+            for dataset in datasets:
+                for fname in sorted(glob.glob(os.path.join(data_root_dir, dataset, '*.csv'))):
+                    rows = self.ingest_csv(fname, dataset)
+                    count += rows
+                    if verbose:
+                        print(f"{dataset}: {os.path.basename(fname)} {rows} rows")
+        self.conn.execute('PRAGMA synchronous = FULL')
+        self.conn.execute('ANALYZE')
+        return count
+
+    def get_tickers(self, dataset):
+        cursor = self.conn.execute(f"SELECT DISTINCT ticker FROM {PriceDB.table} WHERE dataset = ? ORDER BY ticker", (dataset,))
+        return [row[0] for row in cursor]
+
+    def get_coverage(self, dataset):
+        '''
+        return (ticker, first date, last date, rows) for every ticker of the data set
+        '''
+        cursor = self.conn.execute(f'''SELECT ticker, MIN(date), MAX(date), COUNT(*) FROM {PriceDB.table}
+                                       WHERE dataset = ? GROUP BY ticker ORDER BY ticker''', (dataset,))
+        return cursor.fetchall()
+
+    def get_daily_hist_prices(self, dataset, tickers, start_date = None, end_date = None, fields = None):
+        '''
+        fetch the universe and date range with a single query.
+        return a long DataFrame with Ticker and Date (datetime64) columns, sorted by ticker then date
+        '''
+        if fields is None:
+            fields = list(PriceDB.columns.keys())
+        fields = [str(fld) for fld in fields]
+        select = ', '.join([f'{PriceDB.columns[fld]} AS "{fld}"' for fld in fields])
+
+        sql = f'''SELECT p.ticker AS Ticker, p.date AS Date, {select}
+                  FROM temp.universe u JOIN {PriceDB.table} p ON p.dataset = ? AND p.ticker = u.ticker
+                  WHERE p.date >= ? AND p.date <= ?
+                  ORDER BY p.ticker, p.date'''
+        start = '0000-00-00' if start_date is None else str(start_date)
+        end = '9999-99-99' if end_date is None else str(end_date)
+
+        # filling the temp table opens a transaction, it is committed after the read so the database is not left locked
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS universe (ticker TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM temp.universe')
+            self.conn.executemany('INSERT OR IGNORE INTO temp.universe VALUES (?)', [(ticker,) for ticker in tickers])
+            df = pd.read_sql_query(sql, self.conn, params = (dataset, start, end))
+        df[cm.DataField.date.value] = df[cm.DataField.date.value].to_numpy(dtype = str).astype('datetime64[D]')
+        return df
+
+    def close(self):
+        self.conn.close()
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import time
+    import datetime
+    from preference import Preference
+
+    pref = Preference()
+    db = PriceDB(':memory:')
+    start = time.time()
+    count = db.ingest_dir(pref.data_root_dir)
+    print(f"ingested {count} rows in {time.time() - start:.2f}s")
+
+    start = time.time()
+    df = db.get_daily_hist_prices('ETF', ['SPY', 'QQQ', 'IWM'], datetime.date(2016, 1, 1), datetime.date(2020, 1, 1))
+    print(f"query in {time.time() - start:.4f}s")
+    print(df.head())
+    print(df.groupby('Ticker').size())
+
+    # a reader does not keep the database locked, another connection can write right after the read
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'prices.db')
+        db = PriceDB(fname)
+        db.create_schema()
+        with db.conn:
+            db.ingest_csv(os.path.join(pref.data_root_dir, 'ETF', 'SPY_daily.csv'), 'ETF')
+        db.get_daily_hist_prices('ETF', ['SPY'], datetime.date(2016, 1, 1), datetime.date(2020, 1, 1))
+        assert not db.conn.in_transaction
+        writer = PriceDB(sqlite3.connect(fname, timeout = 0))
+        with writer.conn:
+            writer.conn.execute(f"DELETE FROM {PriceDB.table} WHERE date < '2001-01-01'")
+        writer.close()
+        db.close()
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    _test()
@@ -0,0 +1,423 @@
+'''
+Small rule language for strategy entry and exit conditions
+
+A rule is an expression over the fields of a DataMatrix, evaluated for all dates and tickers at once:
+
+    RSI < 20
+    close > SMA_200 and MACD crosses_above MACD_Signal
+    rolling_max(High, 20) <= lag(Close, 1) * 1.05 or not (ADX > 25)
+
+    fields       any field of the DataMatrix (stored, derived such as SMA_50, or added by the strategy),
+                 matched case insensitively
+    arithmetic   + - * / and unary -
+    comparison   < <= > >= == !=
+    crossover    a crosses_above b, a crosses_below b, a crosses b (either way)
+    logic        and, or, not
+    functions    lag(x, n), change(x, n), pct_change(x, n), abs(x), min(x, y), max(x, y),
+                 rolling_mean(x, n) (or sma), rolling_sum, rolling_min, rolling_max, rolling_std
+
+Missing values compare as False. The DataMatrix stores the warm-up of an indicator, and the dates before the
+first price of a ticker, as 0: plain comparisons see these 0 like RSIStrategy does, while the crossover operators and
+lag, change and pct_change, including the expressions inside them, see the leading 0 of every column as missing,
+so SMA_50 crosses_above SMA_200 does not fire when the warm-up of SMA_50 ends.
+'''
+
+import os
+import re
+import abc
+import numpy as np
+import pandas as pd
+
+from stock import Stock
+
+
+class RuleError(Exception):
+    pass
+
+
+class Node(abc.ABC):
+
+    '''
+    A node of a compiled rule, evaluate returns a (date x ticker) array
+    '''
+
+    @abc.abstractmethod
+    def evaluate(self, context, nan_warm_up = False):
+        '''
+        return the values of the node on the fields of the context
+        '''
+
+    def get_fields(self):
+        return []
+
+
+class Number(Node):
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, context, nan_warm_up = False):
+        return np.float64(self.value)
+
+
+class Field(Node):
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, context, nan_warm_up = False):
+        return context.get_field(self.name, nan_warm_up)
+
+    def get_fields(self):
+        return [self.name]
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    return values.astype(float) if values.dtype == bool else values
+
+def _lag(values, periods):
+    values = _as_float(values)
+    result = np.full(values.shape, np.nan)
+    if periods < len(values):
+        result[periods:] = values[:len(values) - periods]
+    return result
+
+def _rolling(method):
+    def func(values, window):
+        frame = pd.DataFrame(np.atleast_2d(_as_float(values).T).T)
+        return getattr(frame.rolling(int(window), min_periods = int(window)), method)().to_numpy()
+    return func
+
+def _crosses_above(a, b):
+    a, b = _as_float(a), _as_float(b)
+    return (a > b) & (_lag(a, 1) <= _lag(b, 1))
+
+def _crosses_below(a, b):
+    a, b = _as_float(a), _as_float(b)
+    return (a < b) & (_lag(a, 1) >= _lag(b, 1))
+
+
+_binary = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide,
+           '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+           '==': np.equal, '!=': np.not_equal,
+           'and': np.logical_and, 'or': np.logical_or,
+           'crosses_above': _crosses_above, 'crosses_below': _crosses_below,
+           'crosses': lambda a, b: _crosses_above(a, b) | _crosses_below(a, b)}
+
+# operators and functions comparing a value with an earlier one, their fields are read with the warm-up as NaN
+_nan_warm_up_ops = ['crosses_above', 'crosses_below', 'crosses', 'lag', 'change', 'pct_change']
+
+# name -> (function, number of arguments, arguments that must be integer constants)
+_functions = {'lag': (lambda x, n: _lag(x, int(n)), 2, [1]),
+              'change': (lambda x, n: _as_float(x) - _lag(x, int(n)), 2, [1]),
+              'pct_change': (lambda x, n: _as_float(x) / _lag(x, int(n)) - 1, 2, [1]),
+              'abs': (lambda x: np.abs(_as_float(x)), 1, []),
+              'min': (lambda x, y: np.minimum(_as_float(x), _as_float(y)), 2, []),
+              'max': (lambda x, y: np.maximum(_as_float(x), _as_float(y)), 2, []),
+              'rolling_mean': (_rolling('mean'), 2, [1]),
+              'sma': (_rolling('mean'), 2, [1]),
+              'rolling_sum': (_rolling('sum'), 2, [1]),
+              'rolling_min': (_rolling('min'), 2, [1]),
+              'rolling_max': (_rolling('max'), 2, [1]),
+              'rolling_std': (_rolling('std'), 2, [1])}
+
+
+class BinaryOp(Node):
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def evaluate(self, context, nan_warm_up = False):
+        nan_warm_up = nan_warm_up or self.op in _nan_warm_up_ops
+        return _binary[self.op](self.left.evaluate(context, nan_warm_up), self.right.evaluate(context, nan_warm_up))
+
+    def get_fields(self):
+        return self.left.get_fields() + self.right.get_fields()
+
+
+class UnaryOp(Node):
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+    def evaluate(self, context, nan_warm_up = False):
+        values = self.operand.evaluate(context, nan_warm_up)
+        return np.logical_not(values) if self.op == 'not' else -_as_float(values)
+
+    def get_fields(self):
+        return self.operand.get_fields()
+
+
+class Call(Node):
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def evaluate(self, context, nan_warm_up = False):
+        func = _functions[self.name][0]
+        nan_warm_up = nan_warm_up or self.name in _nan_warm_up_ops
+        return func(*[arg.evaluate(context, nan_warm_up) for arg in self.args])
+
+    def get_fields(self):
+        return [fld for arg in self.args for fld in arg.get_fields()]
+
+
+_token_re = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([A-Za-z_][A-Za-z0-9_]*)|(<=|>=|==|!=|[<>()+\-*/,]))")
+_keywords = ['and', 'or', 'not', 'crosses', 'crosses_above', 'crosses_below']
+
+
+class Parser(object):
+
+    '''
+    recursive descent parser, from the lowest to the highest precedence:
+        or, and, not, comparison and crossover, + -, * /, unary -, number / field / function call / ( )
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+
+    def _tokenize(self, text):
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _token_re.match(text, pos)
+            if match is None:
+                raise RuleError(f"Unexpected character '{text[pos:].strip()[0]}' in rule '{text}'")
+            number, name, op = match.groups()
+            if number is not None:
+                tokens.append(('number', float(number), number))
+            elif name is not None:
+                tokens.append(('op', name.lower(), name) if name.lower() in _keywords else ('name', name, name))
+            else:
+                tokens.append(('op', op, op))
+            pos = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None, 'end')
+
+    def _accept(self, *ops):
+        kind, value, text = self._peek()
+        if kind == 'op' and value in ops:
+            self.pos += 1
+            return value
+        return None
+
+    def _expect(self, op):
+        if self._accept(op) is None:
+            raise RuleError(f"Expected '{op}' at token {self.pos + 1} of rule '{self.text}'")
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            raise RuleError("Empty rule")
+        node = self._or()
+        if self.pos != len(self.tokens):
+            raise RuleError(f"Unexpected '{self._peek()[2]}' at token {self.pos + 1} of rule '{self.text}'")
+        return node
+
+    def _or(self):
+        node = self._and()
+        while self._accept('or'):
+            node = BinaryOp('or', node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._accept('and'):
+            node = BinaryOp('and', node, self._not())
+        return node
+
+    def _not(self):
+        if self._accept('not'):
+            return UnaryOp('not', self._not())
+        return self._comparison()
+
+    def _comparison(self):
+        node = self._sum()
+        op = self._accept('<', '<=', '>', '>=', '==', '!=', 'crosses', 'crosses_above', 'crosses_below')
+        if op is not None:
+            node = BinaryOp(op, node, self._sum())
+        return node
+
+    def _sum(self):
+        node = self._term()
+        op = self._accept('+', '-')
+        while op is not None:
+            node = BinaryOp(op, node, self._term())
+            op = self._accept('+', '-')
+        return node
+
+    def _term(self):
+        node = self._unary()
+        op = self._accept('*', '/')
+        while op is not None:
+            node = BinaryOp(op, node, self._unary())
+            op = self._accept('*', '/')
+        return node
+
+    def _unary(self):
+        if self._accept('-'):
+            return UnaryOp('-', self._unary())
+        return self._atom()
+
+    def _atom(self):
+        if self._accept('('):
+            node = self._or()
+            self._expect(')')
+            return node
+
+        kind, value, text = self._peek()
+        if kind == 'number':
+            self.pos += 1
+            return Number(value)
+        if kind != 'name':
+            raise RuleError(f"Unexpected '{text}' at token {self.pos + 1} of rule '{self.text}'")
+
+        self.pos += 1
+        if not self._accept('('):
+            return Field(value)
+
+        name = value.lower()
+        if name not in _functions:
+            raise RuleError(f"Unknown function {value} in rule '{self.text}', expected one of {sorted(_functions.keys())}")
+        args = [self._or()]
+        while self._accept(','):
+            args.append(self._or())
+        self._expect(')')
+
+        func, nargs, constants = _functions[name]
+        if len(args) != nargs:
+            raise RuleError(f"{name} expects {nargs} arguments in rule '{self.text}'")
+        for k in constants:
+            if not isinstance(args[k], Number) or args[k].value != int(args[k].value) or args[k].value < 0:
+                raise RuleError(f"Argument {k + 1} of {name} must be a non negative integer in rule '{self.text}'")
+        return Call(name, args)
+
+
+class Rule(object):
+
+    '''
+    A compiled rule, evaluated on a DataMatrix into a (date x ticker) boolean array
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.node = Parser(text).parse()
+
+    def get_fields(self):
+        return list(dict.fromkeys(self.node.get_fields()))
+
+    def evaluate(self, context):
+        if not isinstance(context, RuleContext):
+            context = RuleContext(context)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            values = np.asarray(self.node.evaluate(context))
+            if values.ndim < 2:
+                values = np.broadcast_to(values, context.shape)
+            return np.nan_to_num(values.astype(float), nan = 0.0) != 0
+
+    def __repr__(self):
+        return f"Rule('{self.text}')"
+
+
+class RuleContext(object):
+
+    '''
+    Resolve the fields of the rules on a DataMatrix, each field is fetched once.
+    indicators maps extra field names to a function of the DataMatrix returning a (date x ticker) array.
+    With nan_warm_up the leading 0 of every column, the warm-up or the dates before the first price, are NaN.
+    '''
+
+    def __init__(self, dm, indicators = None):
+        self.dm = dm
+        self.indicators = {} if indicators is None else indicators
+        self.shape = (dm.shape[0], len(dm.universe))
+        self._values = {}
+        self._nan_warm_up_values = {}
+
+        # fields of the panel, columns added by the strategy, then the fields that can be derived
+        prefix = f"{dm.universe[0]}_"
+        names = list(self.indicators.keys()) + list(dm.fields) \
+                + [col[len(prefix):] for col in dm.columns if col.startswith(prefix)] \
+                + [fld for fld in Stock.derived_fields.keys() if not fld.startswith('_')]
+        self._names = {}
+        for name in names:
+            self._names.setdefault(name.lower(), name)
+
+    def resolve(self, name):
+        '''
+        return the field name as spelled in the DataMatrix, or None when it is unknown
+        '''
+        if name in self._names.values():
+            return name
+        return self._names.get(name.lower())
+
+    def get_field(self, name, nan_warm_up = False):
+        field = self.resolve(name)
+        if field is None:
+            raise RuleError(f"Unknown field {name} in {self.dm.name}, expected one of {sorted(set(self._names.values()))}")
+        if field not in self._values:
+            if field in self.indicators:
+                self._values[field] = np.asarray(self.indicators[field](self.dm), dtype = float)
+            else:
+                self._values[field] = self.dm.get_field_values(field)
+        if not nan_warm_up:
+            return self._values[field]
+
+        if field not in self._nan_warm_up_values:
+            values = np.array(self._values[field], dtype = float)
+            nonzero = values != 0
+            # rows before the first nonzero value of each column, every row when the column is all 0
+            first = np.where(nonzero.any(axis = 0), nonzero.argmax(axis = 0), len(values))
+            values[np.arange(len(values))[:, np.newaxis] < first] = np.nan
+            self._nan_warm_up_values[field] = values
+        return self._nan_warm_up_values[field]
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import datetime
+    import common as cm
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+
+    pref = Preference()
+    loader = DataMatrixLoader(pref, 'rules', ['SPY', 'QQQ', 'IWM'], datetime.date(2013, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    dm = loader.get_daily_datamatrix()
+
+    for text in ['RSI < 30', 'close > SMA_200 and SMA_50 crosses_above SMA_200', 'close < rolling_min(lag(close, 1), 20)',
+                 'not (RSI > 30) or pct_change(Close, 5) < -0.05']:
+        rule = Rule(text)
+        print(f"{text:<60} {rule.get_fields()} {int(rule.evaluate(dm).sum())} signals")
+
+    expected = dm.get_field_values(cm.DataField.RSI) < 30
+    np.testing.assert_array_equal(Rule('RSI < 30').evaluate(dm), expected)
+
+    # no crossover while SMA_200 warms up, even when SMA_50 starts above its 0
+    warm_up = 199
+    signal = Rule('SMA_50 crosses_above SMA_200').evaluate(dm)
+    assert not signal[:warm_up + 1].any(), f"crossover signals during the warm-up at rows {np.flatnonzero(signal[:warm_up + 1].any(axis = 1))}"
+    assert signal[warm_up + 1:].any()
+    assert not Rule('change(SMA_50, 1) > 100').evaluate(dm).any()
+
+    for text in ['RSI <', 'RSI < 20 20', 'lag(RSI, close)', 'foo(RSI)', 'RSI ? 3']:
+        try:
+            Rule(text)
+        except RuleError as e:
+            print(e)
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    _test()
@@ -0,0 +1,164 @@
+'''
+Classes to share a DataMatrix between processes without copying it
+'''
+
+import os
+import enum
+import uuid
+import tempfile
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+import common as cm
+
+from datamatrix import DataMatrix
+
+
+class SharedDataMatrix(object):
+
+    '''
+    Publish the numeric panel of a DataMatrix once, either into multiprocessing shared memory or into a memory
+    mapped file, so worker processes can attach to it instead of unpickling their own copy.
+
+    The creator owns the buffer and must call unlink() (or use it as a context manager) when the workers are done.
+    Workers receive the small picklable handle and call attach_datamatrix(handle).
+    '''
+
+    class Backend(enum.Enum):
+        SHM = 'shm'
+        MMAP = 'mmap'
+
+    def __init__(self, dm: DataMatrix, backend = Backend.SHM, mmap_dir = None):
+        backend = SharedDataMatrix.Backend(backend)
+
+        # columns added after loading are only in the DataFrame, fold them into a panel first
+        if dm.panel is None or len(dm.columns) != dm.panel.shape[1] * dm.panel.shape[2]:
+            dm = dm.consolidate()
+        panel = dm.panel
+
+        self._shm = None
+        self._fname = None
+        if backend == SharedDataMatrix.Backend.SHM:
+            self._shm = shared_memory.SharedMemory(create = True, size = max(1, panel.nbytes))
+            location = self._shm.name
+            buffer = np.ndarray(panel.shape, dtype = panel.dtype, buffer = self._shm.buf)
+        else:
+            mmap_dir = tempfile.gettempdir() if mmap_dir is None else mmap_dir
+            self._fname = os.path.join(mmap_dir, f"datamatrix-{uuid.uuid4().hex}.bin")
+            location = self._fname
+            buffer = np.memmap(self._fname, dtype = panel.dtype, mode = 'w+', shape = panel.shape)
+
+        buffer[:] = panel
+        if self._fname is not None:
+            buffer.flush()
+        del buffer
+
+        self.handle = SharedDataMatrixHandle(backend, location, panel.shape, panel.dtype.str,
+                                             np.array(list(dm.index), dtype = 'datetime64[D]'), dm.index.name,
+                                             list(dm.universe), list(dm.fields), dm.name, dm.timeframe)
+
+    def unlink(self):
+        '''
+        release the shared buffer, workers must not use it afterwards
+        '''
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._fname is not None:
+            if os.path.exists(self._fname):
+                os.remove(self._fname)
+            self._fname = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+
+class SharedDataMatrixHandle(object):
+
+    '''
+    Picklable description of a published DataMatrix: where the buffer is, its shape and the DataMatrix meta data
+    '''
+
+    def __init__(self, backend, location, shape, dtype, dates, index_name, universe, fields, name, timeframe):
+        self.backend = backend
+        self.location = location
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.dates = dates
+        self.index_name = index_name
+        self.universe = universe
+        self.fields = fields
+        self.name = name
+        self.timeframe = timeframe
+
+
+# buffers attached by this process, they must outlive every array that views them
+_attached = {}
+
+def attach_datamatrix(handle: SharedDataMatrixHandle, name = None):
+    '''
+    rebuild a read-only DataMatrix over the published buffer without copying it.
+    The buffer is attached once per process and reused by later calls.
+    '''
+    if handle.location not in _attached:
+        if handle.backend == SharedDataMatrix.Backend.SHM:
+            shm = shared_memory.SharedMemory(name = handle.location)
+            panel = np.ndarray(handle.shape, dtype = np.dtype(handle.dtype), buffer = shm.buf)
+            _attached[handle.location] = (shm, panel)
+        else:
+            panel = np.memmap(handle.location, dtype = np.dtype(handle.dtype), mode = 'r', shape = handle.shape)
+            _attached[handle.location] = (None, panel)
+        panel.flags.writeable = False
+
+    panel = _attached[handle.location][1]
+    index = pd.Index(handle.dates.astype(object), name = handle.index_name)
+    return DataMatrix.from_panel(panel, index, handle.universe, handle.fields,
+                                 name = handle.name if name is None else name, timeframe = handle.timeframe)
+
+def detach_datamatrix(handle: SharedDataMatrixHandle):
+    '''
+    drop this process' reference to the published buffer, DataMatrix built from it must not be used afterwards
+    '''
+    shm, panel = _attached.pop(handle.location, (None, None))
+    del panel
+    if shm is not None:
+        shm.close()
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _worker_sum(handle):
+    dm = attach_datamatrix(handle)
+    return float(np.nansum(dm.get_field_values(cm.DataField.close))), os.getpid()
+
+def _test():
+    import time
+    import datetime
+    import concurrent.futures
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+
+    pref = Preference()
+    universe = ['SPY', 'QQQ', 'IWM']
+    loader = DataMatrixLoader(pref, 'test', universe, datetime.date(2013, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    dm = loader.get_daily_datamatrix()
+    expected = float(np.nansum(dm.get_field_values(cm.DataField.close)))
+
+    for backend in SharedDataMatrix.Backend:
+        with SharedDataMatrix(dm, backend) as shared:
+            start = time.time()
+            with concurrent.futures.ProcessPoolExecutor(max_workers = 2) as executor:
+                result = list(executor.map(_worker_sum, [shared.handle] * 4))
+            print(backend, result, expected, f"{time.time() - start:.3f}s")
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    _test()
@@ -8,46 +8,221 @@ import pandas as pd
 import numpy as np
 import datetime
 
-import pandas_ta as ta
 
 
 import common as cm
+import streaming
+import indicators
 from loader import DataLoader
 from preference import get_default_parser, Preference
 
+class DerivedField(object):
+
+    '''
+    A field calculated from other fields of the same ticker.
+    func receives the series of the input fields in the order they are declared.
+    Fields whose name starts with an underscore are intermediates shared by other fields and are not output.
+
+    To extend the field when new bars are appended, either lookback gives the number of previous rows func needs
+    to calculate the new rows, or stream creates a calculator from the streaming module updated one row at a time.
+    '''
+
+    def __init__(self, name, inputs, func, lookback = None, stream = None):
+        self.name = name
+        self.inputs = inputs
+        self.func = func
+        self.lookback = lookback
+        self.stream = stream
+
+
+def _returns(c, c_lag, c_prev):
+    return (c - c_lag)/c_prev
+
+def _get_derived_fields():
+    close = cm.DataField.close.value
+    result = []
+
+    for period in [1, 5, 20]:
+        result.append(DerivedField(f"_close_shift_{period}", [close], lambda c, period = period: c.shift(period),
+                                   lookback = period))
+
+    for period in [10, 20, 50, 200]:
+        result.append(DerivedField(f"SMA_{period}", [close], lambda c, period = period: indicators.sma(c, length = period),
+                                   stream = lambda period = period: streaming.SMA(period)))
+
+    for fld, period in [(cm.DataField.daily_returns, 1), (cm.DataField.weekly_returns, 5), (cm.DataField.monthly_returns, 20)]:
+        result.append(DerivedField(fld.value, [close, f"_close_shift_{period}", '_close_shift_1'], _returns, lookback = 0))
+
+    std_rsi_period = 14
+    result.append(DerivedField(cm.DataField.RSI.value, [close], lambda c: indicators.rsi(c, length = std_rsi_period),
+                               stream = lambda: streaming.RSI(std_rsi_period)))
+
+    return {fld.name: fld for fld in result}
+
+
 class Stock(object):
 
     '''
     Stock class for getting financial pricing as well as fundamental data.
     It uses pandas DataFrame
 
+    Derived fields (moving averages, returns, RSI) are calculated lazily, only when requested through
+    grab_fields or get_field, and each intermediate is calculated once.
     '''
 
+    derived_fields = _get_derived_fields()
+
     def __init__(self, loader, ticker):
         self.loader = loader
         self.ticker = ticker
         self.ohlcv_df = None
+        self._intermediate = {}
+        self._streams = {}
+
+    @staticmethod
+    def get_source_fields(fields):
+        '''
+        return the stored fields needed to calculate the given fields, None means every field
+        '''
+        if fields is None:
+            return None
 
+        result = []
+        pending = [str(fld) for fld in fields]
+        while len(pending) > 0:
+            fld = pending.pop(0)
+            if fld in Stock.derived_fields:
+                pending += Stock.derived_fields[fld].inputs
+            elif fld not in result:
+                result.append(fld)
+        return(result)
 
-    def get_daily_hist_price(self, start_date = None, end_date = None):
-        self.ohlcv_df = self.loader.get_daily_hist_price(self.ticker, start_date, end_date)
-        self._calc_daily_basic()
+    def get_daily_hist_price(self, start_date = None, end_date = None, fields = None):
+        '''
+        load daily prices, when fields is given only the stored fields they depend on are loaded
+        '''
+        df = self.loader.get_daily_hist_price(self.ticker, start_date, end_date, Stock.get_source_fields(fields))
+        return self.set_daily_hist_price(df)
+
+    def set_daily_hist_price(self, df):
+        '''
+        use daily prices that were already loaded, e.g. from a multi-ticker query
+        '''
+        self.ohlcv_df = df
+        self._intermediate = {}
+        self._streams = {}
         return(self)
 
-    def _calc_daily_basic(self):
+    def get_field(self, field):
         '''
-        Calculate the most common moving averages, technical indicators and returns
+        return the series of a field, calculating it and the fields it depends on if needed
+        '''
+        field = str(field)
+        if field in self.ohlcv_df.columns:
+            return self.ohlcv_df[field]
+        if field in self._intermediate:
+            return self._intermediate[field]
+        if field not in Stock.derived_fields:
+            raise Exception(f"Unknown field {field} for {self.ticker}")
+
+        derived = Stock.derived_fields[field]
+        result = derived.func(*[self.get_field(fld) for fld in derived.inputs])
+        if field.startswith('_'):
+            self._intermediate[field] = result
+        else:
+            self.ohlcv_df[field] = result
+        return result
+
+    def _get_stream(self, field):
+        '''
+        return the calculator of a streamed field, run over the history the first time
+        '''
+        if field not in self._streams:
+            derived = Stock.derived_fields[field]
+            stream = derived.stream()
+            stream.run(*[self.get_field(fld).to_numpy() for fld in derived.inputs])
+            self._streams[field] = stream
+        return self._streams[field]
+
+    def get_state(self):
+        '''
+        picklable state of the streamed fields, so another Stock loaded with the same history can append with set_state
+        '''
+        for field in Stock.derived_fields.keys():
+            if Stock.derived_fields[field].stream is not None and field in self.ohlcv_df.columns:
+                self._get_stream(field)
+        return {'first_date': self.ohlcv_df.index[0], 'last_date': self.ohlcv_df.index[-1], 'rows': len(self.ohlcv_df),
+                'streams': {field: stream.snapshot() for field, stream in self._streams.items()}}
+
+    def set_state(self, state):
+        if (state['first_date'], state['last_date'], state['rows']) != (self.ohlcv_df.index[0], self.ohlcv_df.index[-1], len(self.ohlcv_df)):
+            raise Exception(f"State of {self.ticker} from {state['first_date']} to {state['last_date']} does not match the loaded prices")
+        self._streams = {field: Stock.derived_fields[field].stream().restore(stream_state)
+                         for field, stream_state in state['streams'].items()}
+
+    def append_daily_bars(self, bars, store = False):
         '''
-        for period in [10, 20, 50, 200]:
-            self.ohlcv_df[f"SMA_{period}"] = ta.sma(self.ohlcv_df[cm.DataField.close], timeperiod = period)
+        append new daily bars, a DataFrame indexed by date with the stored fields.
+        Every derived field already calculated is extended from the state of its streaming calculator or from
+        a bounded lookback of its inputs, the values are identical to a recalculation over the whole history.
+        With store the bars are also appended to the price file through the loader.
+        '''
+        if len(bars) == 0:
+            return(self)
+        if bars.index[0] <= self.ohlcv_df.index[-1]:
+            raise Exception(f"Cannot append bars of {self.ticker} from {bars.index[0]}, prices are loaded until {self.ohlcv_df.index[-1]}")
+
+        computed = [field for field in Stock.derived_fields.keys() if field in self.ohlcv_df.columns or field in self._intermediate]
+        # the calculators must have seen the history before the new bars
+        for field in computed:
+            if Stock.derived_fields[field].stream is not None:
+                self._get_stream(field)
+
+        new_df = pd.DataFrame(index = pd.Index(bars.index, name = self.ohlcv_df.index.name))
+        for col in self.ohlcv_df.columns:
+            if col not in Stock.derived_fields:
+                if col in bars.columns:
+                    new_df[col] = bars[col]
+                else:
+                    new_df[col] = self.ticker if col == 'Ticker' else np.nan
+                if new_df[col].notna().all():
+                    new_df[col] = new_df[col].astype(self.ohlcv_df[col].dtype)
+        new_intermediate = {}
+
+        def get_new_field(fld):
+            return new_intermediate[fld] if fld in new_intermediate else new_df[fld]
+
+        for field in computed:
+            derived = Stock.derived_fields[field]
+            if derived.stream is not None:
+                stream = self._streams[field]
+                inputs = [get_new_field(fld).to_numpy() for fld in derived.inputs]
+                result = pd.Series(stream.run(*inputs), index = new_df.index, dtype = float)
+            else:
+                start = max(0, len(self.ohlcv_df) - derived.lookback)
+                inputs = [pd.concat([self.get_field(fld).iloc[start:], get_new_field(fld)]) for fld in derived.inputs]
+                result = derived.func(*inputs).iloc[len(self.ohlcv_df) - start:]
+
+            if field.startswith('_'):
+                new_intermediate[field] = result
+            else:
+                new_df[field] = result
 
-        c = self.ohlcv_df[cm.DataField.close]
-        self.ohlcv_df['daily_returns'] = (c - c.shift(1))/c.shift(1)
-        self.ohlcv_df['weekly_returns'] = (c - c.shift(5))/c.shift(1)
-        self.ohlcv_df['monthly_returns'] = (c - c.shift(20))/c.shift(1)
+        self.ohlcv_df = pd.concat([self.ohlcv_df, new_df[self.ohlcv_df.columns]])
+        for field, result in new_intermediate.items():
+            self._intermediate[field] = pd.concat([self._intermediate[field], result])
 
-        std_rsi_period = 14
-        self.ohlcv_df[cm.DataField.RSI.value] = ta.rsi(self.ohlcv_df[cm.DataField.close], timeperiod = std_rsi_period)
+        if store:
+            self.loader.append_daily_bars(self.ticker, bars)
+        return(self)
+
+    def _calc_daily_basic(self):
+        '''
+        Calculate the most common moving averages, technical indicators and returns
+        '''
+        for field in Stock.derived_fields.keys():
+            if not field.startswith('_'):
+                self.get_field(field)
 
 
     def grab_fields(self, in_fields = None):
@@ -56,13 +231,14 @@ class Stock(object):
         '''
         output_df = pd.DataFrame(index = self.ohlcv_df.index)
         if in_fields is None:
+            self._calc_daily_basic()
             fields = self.ohlcv_df.columns
         else:
             # make sure the list of fields are in string format
             fields = [str(fld) for fld in in_fields]
 
         for fld in fields:
-            output_df[f"{self.ticker}_{fld}"] = self.ohlcv_df[fld]
+            output_df[f"{self.ticker}_{fld}"] = self.get_field(fld)
         return(output_df)
 
 
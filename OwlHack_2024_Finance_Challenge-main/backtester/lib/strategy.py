@@ -2,13 +2,16 @@
 Class to model a strategy
 '''
 import os
+import numpy as np
 import pandas as pd
 
 import common as cm
+import engine
 
 
 from datamatrix import DataMatrix
-from portfolio import Portfolio
+from portfolio import Portfolio, calculate_fifo_pnl
+from exporter import ResultExporter, ExportFormat
 
 class Strategy():
 
@@ -28,8 +31,8 @@ class Strategy():
 
        From the two output matrix, one can generate the following datamatrix
        d. current holding
-       e. realized PandL
-       f. unrealized PandL
+       e. realized PandL, see pnl_matrix
+       f. unrealized PandL, see pnl_matrix
 
     4. On each period, a strategy should maintained the following quantities in a dataframe
        a. current_cash
@@ -38,6 +41,10 @@ class Strategy():
 
     '''
 
+    # attributes set by run_strategy, see get_results
+    result_attributes = ['pricing_matrix', 'tsignal', 'taction', 'shares', 'current_holding', 'cash',
+                         'equity_exposure', 'pnl', 'pnl_matrix', 'performance', 'port']
+
     def __init__(self, pref, name, input_datamatrix: DataMatrix, initial_capital: float, price_choice = cm.DataField.close):
         self.pref = pref
         self.name = name
@@ -71,6 +78,8 @@ class Strategy():
 
         # output of the strategy
         self.pnl = pd.DataFrame(index = input_datamatrix.index)
+        self.pnl_matrix = None
+        self._port = None
         self.performance = {'Cumulative Returns': -999,
                             'Maximum Drawdown': -999,
                             'Sharpe Ratio': -999}
@@ -82,6 +91,22 @@ class Strategy():
         pass
 
 
+    def prepare_indicators(self):
+        '''
+        Add the indicators the strategy calculates itself to input_dm.
+        They do not depend on the parameters of the strategy, so they are only calculated when missing and
+        strategies sharing a DataMatrix (e.g. the runs of a parameter sweep) calculate them once.
+        '''
+        pass
+
+    def has_fields(self, fields):
+        '''
+        True when input_dm has the fields for every ticker of the universe
+        '''
+        columns = self.input_dm.columns
+        return all([f"{ticker}_{fld}" in columns for ticker in self.universe for fld in fields])
+
+
     def run_model(self, model):
         '''
         Run any model underlying the strategy, generate a trading signal, a trading action and the shares datamatrix
@@ -91,12 +116,37 @@ class Strategy():
         raise Exception("Should not be calling the Strategy Base class run_model method")
 
 
+    def run_entry_exit(self, entry_long, entry_short, risk_allocation_percentage, target_gain_percentage = None,
+                       max_loss_percentage = None, exit_signal = None, hold_on_zero_price = True):
+        '''
+        Run the enter / exit state machine shared by the threshold strategies (see engine.run_entry_exit)
+        on the pricing matrix for all tickers at once.
+        entry_long, entry_short and exit_signal are (date x ticker) boolean arrays in the order of the universe.
+        Return the tsignal, taction and shares DataFrames expected from run_model.
+        '''
+        dollar_exposure = self.initial_capital * risk_allocation_percentage / 100
+        tsignal, shares, position = engine.run_entry_exit(self.pricing_matrix.to_numpy(), entry_long, entry_short,
+                                                          dollar_exposure, target_gain_percentage, max_loss_percentage,
+                                                          exit_signal, hold_on_zero_price,
+                                                          engine = getattr(self.pref, 'engine', 'auto'))
+
+        taction = np.full(tsignal.shape, cm.TradeAction.NONE.value, dtype = object)
+        taction[tsignal == 1] = cm.TradeAction.BUY.value
+        taction[tsignal == -1] = cm.TradeAction.SELL.value
+
+        index, columns = self.pricing_matrix.index, self.pricing_matrix.columns
+        return(pd.DataFrame(tsignal, index = index, columns = columns),
+               pd.DataFrame(taction, index = index, columns = columns),
+               pd.DataFrame(shares, index = index, columns = columns))
+
     def run_strategy(self):
         '''
         Call the run_model, then run the strategy.
-        Calculate the state of the strategy period by period.
+        Calculate the state of the strategy for all periods at once from the trades of each period.
         '''
         self.tsignal, self.taction, self.shares = self.run_model()
+        # the portfolio of the previous run is out of date
+        self._port = None
 
         nrow, ncol   = self.pricing_matrix.shape
         nrow1, ncol1 = self.tsignal.shape
@@ -114,20 +164,15 @@ class Strategy():
         self.current_holding = (self.shares * self.tsignal).cumsum()
         self.equity_exposure = (self.current_holding * self.pricing_matrix).sum(axis = 1)
 
-        cash_val = self.initial_capital
         self.shares.fillna(0, inplace=True)
         self.tsignal.fillna(0, inplace=True)
         self.pricing_matrix.fillna(0, inplace=True)
 
-        for i in range(nrow):
-            for j in range(ncol):
-                # executing trades
-                trade_amt = self.shares.iloc[i, j] * self.tsignal.iloc[i, j] * self.pricing_matrix.iloc[i, j]
-                cash_val = cash_val - trade_amt
-
-            # assume cash grow with risk free rate
-            cash_val = cash_val * (1 + self.pref.risk_free_rate * self.days_between_periods/365)
-            self.cash.iloc[i] = cash_val
+        # executing trades: buying costs cash, selling brings it in, then cash grows with the risk free rate
+        trade_amt = (self.shares.to_numpy() * self.tsignal.to_numpy() * self.pricing_matrix.to_numpy()).sum(axis = 1)
+        growth = 1 + self.pref.risk_free_rate * self.days_between_periods/365
+        self.cash = pd.Series(engine.accrue_cash(self.initial_capital, -trade_amt, growth), index = self.input_dm.index)
+        self._calc_pnl_matrix()
 
         self.pnl = pd.DataFrame(data = {'cash': self.cash, 'equity_exposure': self.equity_exposure,
                                         'total_value': self.cash + self.equity_exposure,}
@@ -142,24 +187,53 @@ class Strategy():
             self._calc_daily_stat()
 
 
-    def generate_trade_history(self, output_fname):
+    @property
+    def port(self):
         '''
+        Portfolio of the trades, built by generate_trade_history the first time it is used after run_strategy
         '''
-        self.port = Portfolio(self.name)
-        nrow, ncol = self.pricing_matrix.shape
+        if self._port is None:
+            self.generate_trade_history()
+        return self._port
 
-        for i in range(nrow):
-            trade_date = self.pricing_matrix.index[i]
-            for j in range(ncol):
-                ticker = self.tsignal.columns[j]
-                action = self.taction.iloc[i, j]
-                shares = self.shares.iloc[i, j]
-                price = self.pricing_matrix.iloc[i, j]
+    @port.setter
+    def port(self, value):
+        self._port = value
 
-                self.port.add_trade(ticker, action, trade_date, price, shares)
+    def generate_trade_history(self, output_fname = None):
+        '''
+        Feed the portfolio with the trades, the cells of taction with a buy or a sell, in date order,
+        and save its trade history to output_fname
+        '''
+        self._port = Portfolio(self.name, cm.DisposalMethod(self.pref.disposal_method))
+        # the trade history lists the tickers in the order of the columns
+        self._port.register_tickers(self.tsignal.columns)
 
-        self.port.save_trade_history(output_fname)
+        taction = self.taction.to_numpy()
+        trade_actions = [x for x in pd.unique(taction.ravel()) if cm.is_a_buy(x) or cm.is_a_sell(x)]
+        rows, cols = np.nonzero(self.taction.isin(trade_actions).to_numpy())
 
+        shares = self.shares.to_numpy()
+        prices = self.pricing_matrix.to_numpy()
+        for i, j in zip(rows, cols):
+            self._port.add_trade(self.tsignal.columns[j], taction[i, j], self.pricing_matrix.index[i], prices[i, j], shares[i, j])
+
+        if output_fname is not None:
+            self._port.save_trade_history(output_fname)
+
+
+    def _calc_pnl_matrix(self):
+        '''
+        Mark the positions to market: DataMatrix of the realized pnl to date, the unrealized pnl and the average
+        cost basis of every ticker, the lots being closed FIFO. The pnl of the tickers add up to cumulative_pnl
+        when cash does not earn the risk free rate.
+        '''
+        trades = self.shares.to_numpy() * self.tsignal.to_numpy()
+        realized, unrealized, cost_basis = calculate_fifo_pnl(trades, self.pricing_matrix.to_numpy())
+        fields = [cm.DataField.realized_pnl, cm.DataField.unrealized_pnl, cm.DataField.cost_basis]
+        self.pnl_matrix = DataMatrix.from_panel(np.stack([realized, unrealized, cost_basis], axis = 2), self.input_dm.index,
+                                                list(self.tsignal.columns), fields, name = f"{self.name} pnl",
+                                                timeframe = self.timeframe)
 
     def _calc_daily_stat(self):
         '''
@@ -171,6 +245,17 @@ class Strategy():
         self.performance['Sharpe Ratio'] = cm.calculate_sharpe_ratio(pnl, self.pref.risk_free_rate)
 
 
+    def get_results(self):
+        '''
+        the output of the strategy without its input, e.g. to send it back from a worker process
+        '''
+        return {attr: getattr(self, attr) for attr in self.result_attributes if hasattr(self, attr)}
+
+    def set_results(self, results):
+        for attr, value in results.items():
+            setattr(self, attr, value)
+
+
     def finalize(self):
         '''
         Finalize any remaining calculation
@@ -178,24 +263,19 @@ class Strategy():
         pass
 
 
+    def export(self, output_dir, export_format = None, artifacts = None):
+        '''
+        Save the strategy output, by default in the export_format and export_artifacts of the preference
+        '''
+        export_format = self.pref.export_format if export_format is None else export_format
+        artifacts = self.pref.export_artifacts if artifacts is None else artifacts
+        return ResultExporter(output_dir, export_format, artifacts).export(self)
+
     def save_to_csv(self, output_dir):
         '''
         Save strategy output to csv file
         '''
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-
-        fname = self.name.replace(' ', '')
-        self.input_dm.to_csv(os.path.join(output_dir, f"{fname}_data.csv"))
-        self.pricing_matrix.to_csv(os.path.join(output_dir, f"{fname}_prices.csv"))
-        self.taction.to_csv(os.path.join(output_dir,  f"{fname}_taction.csv"))
-        self.tsignal.to_csv(os.path.join(output_dir, f"{fname}_tsignal.csv"))
-        self.shares.to_csv(os.path.join(output_dir, f"{fname}_shares.csv"))
-        self.current_holding.to_csv(os.path.join(output_dir, f"{fname}_holding.csv"))
-
-        self.pnl.to_csv(os.path.join(output_dir, f"{fname}_pnl.csv"))
-
-        self.generate_trade_history(os.path.join(output_dir, f"{fname}_trade_history.csv"))
+        return self.export(output_dir, ExportFormat.CSV)
 
 
 # ==============================================
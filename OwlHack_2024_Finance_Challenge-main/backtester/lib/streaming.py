@@ -0,0 +1,356 @@
+'''
+Incremental calculators that extend an indicator one bar at a time
+
+Each calculator keeps a constant size state: update(bar) takes the inputs of the next bar and returns the new value
+in constant time, run feeds whole arrays of inputs, snapshot returns a picklable copy of the state and restore puts
+it back. Fed with a whole history, they give the same values as the batch calculations of the indicators module
+and pandas_ta.
+'''
+
+import os
+import sys
+import abc
+import copy
+import math
+import numpy as np
+
+
+def _mean(values):
+    '''
+    mean skipping missing values, summed like Series.mean
+    '''
+    values = np.asarray(values, dtype = float)
+    count = int((~np.isnan(values)).sum())
+    return np.nansum(values) / count if count > 0 else np.nan
+
+def _divide(a, b):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.float64(a) / np.float64(b)
+
+
+class Stream(abc.ABC):
+
+    '''
+    Base class of the calculators
+    '''
+
+    @abc.abstractmethod
+    def update(self, *bar):
+        '''
+        take the inputs of the next bar and return the new value
+        '''
+
+    def run(self, *values):
+        '''
+        update with every bar of the input arrays, return the array of the values
+        '''
+        return np.array([self.update(*bar) for bar in zip(*values)], dtype = float)
+
+    def snapshot(self):
+        return copy.deepcopy(self.__dict__)
+
+    def restore(self, state):
+        self.__dict__.update(copy.deepcopy(state))
+        return(self)
+
+
+class RollingMean(Stream):
+
+    '''
+    Rolling mean over a fixed window kept in a ring buffer, updated one value at a time.
+
+    It follows the running Kahan sum pandas keeps for Series.rolling(window).mean(), including its
+    handling of constant windows and sign, so the values are identical to a full recalculation.
+    '''
+
+    def __init__(self, window, min_periods = None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.buffer = [np.nan] * window
+        self.pos = 0
+        self.count = 0
+        self.nobs = 0
+        self.neg_ct = 0
+        self.sum_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = None
+
+    def _add(self, val):
+        if val == val:
+            self.nobs += 1
+            y = val - self.compensation_add
+            t = self.sum_x + y
+            self.compensation_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct += 1
+            if val == self.prev_value:
+                self.num_consecutive_same_value += 1
+            else:
+                self.num_consecutive_same_value = 1
+            self.prev_value = val
+
+    def _remove(self, val):
+        if val == val:
+            self.nobs -= 1
+            y = - val - self.compensation_remove
+            t = self.sum_x + y
+            self.compensation_remove = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct -= 1
+
+    def update(self, val):
+        val = float(val)
+        if self.count == 0:
+            self.prev_value = val
+        self.count += 1
+
+        # the oldest value leaves the window before the new one is added
+        if self.count > self.window:
+            self._remove(self.buffer[self.pos])
+        self.buffer[self.pos] = val
+        self.pos = (self.pos + 1) % self.window
+        self._add(val)
+
+        if self.nobs >= self.min_periods and self.nobs > 0:
+            result = self.sum_x / self.nobs
+            if self.num_consecutive_same_value >= self.nobs:
+                result = self.prev_value
+            elif self.neg_ct == 0 and result < 0:
+                result = 0.0
+            elif self.neg_ct == self.nobs and result > 0:
+                result = 0.0
+            return result
+        return np.nan
+
+
+class SMA(RollingMean):
+
+    '''
+    Simple moving average of the close, same as indicators.sma(close, length) and pandas_ta.sma
+    '''
+
+    def __init__(self, length = 10):
+        super().__init__(length)
+
+
+class EwmMean(Stream):
+
+    '''
+    Exponentially weighted mean updated one value at a time, the same recurrence as
+    Series.ewm(alpha = alpha, min_periods = min_periods, adjust = adjust).mean(), or with span instead of alpha.
+    '''
+
+    def __init__(self, alpha = None, min_periods = 0, adjust = True, span = None):
+        # pandas converts alpha and span to a center of mass and back
+        com = (span - 1) / 2.0 if span is not None else (1 - alpha) / alpha
+        self.alpha = 1. / (1. + com)
+        self.adjust = adjust
+        self.new_wt = 1. if adjust else self.alpha
+        self.old_wt_factor = 1. - self.alpha
+        self.min_periods = max(min_periods, 1)
+        self.weighted = None
+        self.old_wt = 1.
+        self.nobs = 0
+
+    def update(self, cur):
+        cur = float(cur)
+        is_observation = cur == cur
+        self.nobs += int(is_observation)
+
+        if self.weighted is None:
+            self.weighted = cur
+        elif self.weighted == self.weighted:
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                if self.weighted != cur:
+                    self.weighted = self.old_wt * self.weighted + self.new_wt * cur
+                    self.weighted /= (self.old_wt + self.new_wt)
+                self.old_wt = self.old_wt + self.new_wt if self.adjust else 1.
+        elif is_observation:
+            self.weighted = cur
+
+        return self.weighted if self.nobs >= self.min_periods else np.nan
+
+
+class RMA(EwmMean):
+
+    '''
+    Wilder's moving average, same as indicators.rma(close, length)
+    '''
+
+    def __init__(self, length = 10):
+        super().__init__(1. / length, min_periods = length)
+
+
+class EMA(Stream):
+
+    '''
+    Exponential moving average seeded with the simple average of the first length values,
+    same as indicators.ema(close, length) and pandas_ta.ema
+    '''
+
+    def __init__(self, length = 10):
+        self.length = length
+        self.head = []
+        self.ewm = EwmMean(span = length, adjust = False)
+
+    def update(self, close):
+        close = float(close)
+        if len(self.head) < self.length:
+            self.head.append(close)
+            if len(self.head) < self.length:
+                return self.ewm.update(np.nan)
+            close = _mean(self.head)
+        return self.ewm.update(close)
+
+
+class RSI(Stream):
+
+    '''
+    Relative strength index of the close with Wilder's moving average,
+    same as indicators.rsi(close, length) and pandas_ta.rsi
+    '''
+
+    def __init__(self, length = 14, scalar = 100.):
+        self.length = length
+        self.scalar = scalar
+        self.prev_close = None
+        self.positive_avg = RMA(length)
+        self.negative_avg = RMA(length)
+
+    def update(self, close):
+        close = float(close)
+        change = np.nan if self.prev_close is None else close - self.prev_close
+        self.prev_close = close
+
+        positive = 0. if change < 0 else change
+        negative = 0. if change > 0 else change
+        positive_avg = self.positive_avg.update(positive)
+        negative_avg = self.negative_avg.update(negative)
+        return _divide(self.scalar * positive_avg, positive_avg + abs(negative_avg))
+
+
+class MACD(Stream):
+
+    '''
+    Moving average convergence divergence, same as indicators.macd(close, fast, slow, signal).
+    update returns the macd, histogram and signal line.
+    '''
+
+    def __init__(self, fast = 12, slow = 26, signal = 9):
+        if slow < fast:
+            fast, slow = slow, fast
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self.started = False
+
+    def update(self, close):
+        macd = self.fast.update(close) - self.slow.update(close)
+        # the signal line starts at the first macd value
+        self.started = self.started or macd == macd
+        signal = self.signal.update(macd) if self.started else np.nan
+        return macd, macd - signal, signal
+
+
+class ADX(Stream):
+
+    '''
+    Average directional index, same as indicators.adx(high, low, close, length, lensig).
+    update(high, low, close) returns the ADX, +DI and -DI.
+
+    pandas_ta moves the high - low range of the whole series by the float epsilon when any bar has a zero range.
+    A stream can only do it from the first such bar on, or from the start with zero_range, so on a series with
+    a zero range bar the values can differ from the batch by about the float epsilon.
+    '''
+
+    def __init__(self, length = 14, lensig = None, scalar = 100., zero_range = False):
+        lensig = length if lensig is None else lensig
+        self.scalar = scalar
+        self.zero_range = zero_range
+        self.prev = None
+        self.atr = RMA(length)
+        self.positive_avg = RMA(length)
+        self.negative_avg = RMA(length)
+        self.adx = RMA(lensig)
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        high_low = high - low
+        self.zero_range = self.zero_range or high_low == 0
+        if self.zero_range:
+            high_low += sys.float_info.epsilon
+
+        if self.prev is None:
+            true_range = up = dn = np.nan
+        else:
+            prev_high, prev_low, prev_close = self.prev
+            ranges = [abs(v) for v in [high_low, high - prev_close, prev_close - low] if v == v]
+            true_range = max(ranges) if len(ranges) > 0 else np.nan
+            up = high - prev_high
+            dn = prev_low - low
+        self.prev = (high, low, close)
+
+        pos = (1. if up > dn and up > 0 else 0.) * up
+        neg = (1. if dn > up and dn > 0 else 0.) * dn
+        pos = 0. if abs(pos) < sys.float_info.epsilon else pos
+        neg = 0. if abs(neg) < sys.float_info.epsilon else neg
+
+        k = _divide(self.scalar, self.atr.update(true_range))
+        dmp = k * self.positive_avg.update(pos)
+        dmn = k * self.negative_avg.update(neg)
+        dx = _divide(self.scalar * abs(dmp - dmn), dmp + dmn)
+        return self.adx.update(dx), dmp, dmn
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import glob
+    import pickle
+    import pandas_ta as ta
+    import indicators
+    from preference import Preference
+    from loader import DataLoader
+
+    pref = Preference()
+    loader = DataLoader(pref, data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    close = loader.get_daily_hist_price('SPY', fields = ['Close'])['Close']
+
+    for period in [10, 20, 50, 200]:
+        np.testing.assert_array_equal(SMA(period).run(close.to_numpy()), ta.sma(close, length = period).to_numpy())
+    np.testing.assert_array_equal(RSI(14).run(close.to_numpy()), ta.rsi(close, length = 14).to_numpy())
+
+    tickers = sorted([os.path.basename(fname)[:-len('_daily.csv')] for fname in glob.glob(os.path.join(loader.data_dir, '*_daily.csv'))])
+    for ticker in tickers:
+        df = loader.get_daily_hist_price(ticker)
+        h, l, c = [df[fld].to_numpy() for fld in ['High', 'Low', 'Close']]
+
+        np.testing.assert_array_equal(SMA(50).run(c), indicators.sma(c, 50))
+        np.testing.assert_array_equal(EMA(20).run(c), indicators.ema(c, 20))
+        np.testing.assert_array_equal(RSI(14).run(c), indicators.rsi(c, 14))
+        np.testing.assert_array_equal(MACD().run(c), np.stack(indicators.macd(c), axis = 1))
+        zero_range = bool((h == l).any())
+        np.testing.assert_array_equal(ADX(14, zero_range = zero_range).run(h, l, c), np.stack(indicators.adx(h, l, c, 14), axis = 1))
+
+        # a snapshot taken half way and restored in a new calculator continues with the same values
+        half = len(c) // 2
+        streams = [SMA(50), EMA(20), RSI(14), MACD(), ADX(14, zero_range = zero_range)]
+        inputs = [[c]] * 4 + [[h, l, c]]
+        for stream, values in zip(streams, inputs):
+            stream.run(*[v[:half] for v in values])
+            state = pickle.loads(pickle.dumps(stream.snapshot()))
+            expected = stream.run(*[v[half:] for v in values])
+            restored = type(stream)().restore(state)
+            np.testing.assert_array_equal(restored.run(*[v[half:] for v in values]), expected)
+
+    print(f"streaming values of {len(tickers)} tickers are identical to the batch calculation")
+
+if __name__ == '__main__':
+    sys.path.append(os.getcwd())
+    _test()
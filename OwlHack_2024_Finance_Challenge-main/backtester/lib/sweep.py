@@ -0,0 +1,217 @@
+'''
+Parameter sweep of a strategy over a grid of parameters
+'''
+
+import os
+import math
+import time
+import itertools
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+from datamatrix import DataMatrix
+from sharedmatrix import SharedDataMatrix, attach_datamatrix
+
+
+def get_combinations(param_grid):
+    '''
+    every combination of a {parameter: list of values} grid as a list of {parameter: value},
+    the last parameter changing fastest. A single value is a list of one value.
+    '''
+    names = list(param_grid.keys())
+    values = [list(v) if isinstance(v, (list, tuple, range, np.ndarray)) else [v] for v in param_grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def run_combination(pref, strategy_class, dm: DataMatrix, initial_capital, params):
+    '''
+    run the strategy with one combination of parameters on a view of dm, return its performance.
+    A combination that fails is reported with its error instead of stopping the sweep.
+    '''
+    try:
+        strategy = strategy_class(pref, dm.view(), initial_capital, **params)
+        strategy.validate()
+        strategy.run_strategy()
+        return dict(strategy.performance)
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+
+
+# state of a sweep worker process, set once by _init_worker
+_worker = {}
+
+def _init_worker(pref, strategy_class, handle, initial_capital):
+    _worker['pref'] = pref
+    _worker['strategy_class'] = strategy_class
+    _worker['dm'] = attach_datamatrix(handle)
+    _worker['initial_capital'] = initial_capital
+
+def _run_batch(combinations):
+    return [run_combination(_worker['pref'], _worker['strategy_class'], _worker['dm'], _worker['initial_capital'], params)
+            for params in combinations]
+
+
+class ParameterSweep(object):
+
+    '''
+    Run a Strategy subclass for every combination of a parameter grid, e.g.
+
+        sweep = ParameterSweep(pref, RSIStrategy, dm, cm.OneMillion,
+                               {'lower_bound': [10, 20, 30], 'upper_bound': [70, 80, 90]})
+        results = sweep.run()
+
+    The indicators the strategy calculates itself (see Strategy.prepare_indicators) are added to the DataMatrix
+    once, before any run. With num_workers > 1 the prepared DataMatrix is published in shared memory once and the
+    combinations are run in batches by a process pool whose workers attach to it, so neither the prices nor
+    the indicators are copied or calculated again per combination.
+
+    fixed_params are passed to every run. The result has one row per combination: the parameters, then the
+    performance of the strategy, and an error column when some combinations failed.
+    '''
+
+    def __init__(self, pref, strategy_class, input_datamatrix: DataMatrix, initial_capital: float, param_grid,
+                 fixed_params = None, num_workers = None, batch_size = None):
+        self.pref = pref
+        self.strategy_class = strategy_class
+        self.input_dm = input_datamatrix
+        self.initial_capital = initial_capital
+        self.param_grid = param_grid
+        self.fixed_params = {} if fixed_params is None else fixed_params
+        self.num_workers = num_workers if num_workers is not None else getattr(pref, 'num_workers', 1)
+        self.batch_size = batch_size
+        self.prepared_dm = None
+        self.run_time = None
+
+        overlap = set(self.fixed_params.keys()) & set(param_grid.keys())
+        if len(overlap) > 0:
+            raise Exception(f"Parameters {sorted(overlap)} are both fixed and swept")
+
+    def get_combinations(self):
+        return get_combinations(self.param_grid)
+
+    def prepare(self):
+        '''
+        add the indicators of the strategy to a view of the input DataMatrix and fold them into one panel
+        '''
+        if self.prepared_dm is None:
+            params = dict(self.fixed_params, **self.get_combinations()[0])
+            strategy = self.strategy_class(self.pref, self.input_dm.view(), self.initial_capital, **params)
+            strategy.validate()
+            strategy.prepare_indicators()
+            dm = strategy.input_dm
+            # a DataMatrix whose panel already holds every column is used as is
+            if dm.panel is None or len(dm.columns) != dm.panel.shape[1] * dm.panel.shape[2]:
+                dm = dm.consolidate()
+            self.prepared_dm = dm
+        return(self.prepared_dm)
+
+    def _get_batches(self, combinations):
+        batch_size = self.batch_size
+        if batch_size is None:
+            # a few batches per worker keep them busy until the end without sending every combination on its own
+            batch_size = max(1, math.ceil(len(combinations) / (4 * self.num_workers)))
+        return [combinations[k:k + batch_size] for k in range(0, len(combinations), batch_size)]
+
+    def run(self):
+        '''
+        run every combination, return a DataFrame with a row of parameters and performance per combination
+        '''
+        start = time.time()
+        combinations = self.get_combinations()
+        dm = self.prepare()
+        runs = [dict(self.fixed_params, **params) for params in combinations]
+
+        if self.num_workers <= 1 or len(runs) <= 1:
+            performance = [run_combination(self.pref, self.strategy_class, dm, self.initial_capital, params)
+                           for params in runs]
+        else:
+            with SharedDataMatrix(dm) as shared:
+                with concurrent.futures.ProcessPoolExecutor(max_workers = self.num_workers, initializer = _init_worker,
+                                                            initargs = (self.pref, self.strategy_class, shared.handle,
+                                                                        self.initial_capital)) as executor:
+                    performance = [perf for batch in executor.map(_run_batch, self._get_batches(runs)) for perf in batch]
+
+        result = pd.concat([pd.DataFrame(combinations, columns = list(self.param_grid.keys())),
+                            pd.DataFrame(performance)], axis = 1)
+        self.run_time = time.time() - start
+        return(result)
+
+
+def get_best(result, metric = 'Sharpe Ratio', count = 1):
+    '''
+    the count best rows of a sweep result on a performance metric, higher is better for all of them
+    (the maximum drawdown is negative). Failed combinations are ignored.
+    '''
+    result = result[result[metric].notnull()]
+    return result.sort_values(metric, ascending = False, kind = 'stable').head(count)
+
+
+def parse_value(txt):
+    '''
+    int, float or str, in this order
+    '''
+    for convert in [int, float]:
+        try:
+            return convert(txt)
+        except ValueError:
+            pass
+    return txt
+
+def parse_param(txt):
+    '''
+    name=v1,v2,... or name=start:stop:step with stop included
+    '''
+    if '=' not in txt:
+        raise Exception(f"Cannot parse parameter {txt}, expected name=v1,v2,... or name=start:stop:step")
+    name, values = txt.split('=', 1)
+    if values.count(':') == 2 and '|' not in values:
+        start, stop, step = [parse_value(v) for v in values.split(':')]
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        values = [start + k * step for k in range(count)]
+        if all([isinstance(v, int) for v in [start, step]]):
+            return name.strip(), values
+        return name.strip(), [round(v, 10) for v in values]
+    # rules contain commas, separate them with | instead
+    separator = '|' if '|' in values else ','
+    return name.strip(), [parse_value(v.strip()) for v in values.split(separator)]
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import datetime
+    import common as cm
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+    from RSI_strategy import RSIStrategy
+
+    pref = Preference()
+    universe = ['SPY', 'QQQ', 'IWM', 'XLK', 'XLF']
+    loader = DataMatrixLoader(pref, 'sweep', universe, datetime.date(2013, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    dm = loader.get_daily_datamatrix()
+
+    grid = {'lower_bound': [10, 20, 30], 'upper_bound': [70, 80, 90],
+            'target_gain_percentage': [0.5, 1.0, 2.0], 'max_loss_percentage': [-0.5, -1.0, -2.0]}
+    results = {}
+    for num_workers in [1, 4]:
+        sweep = ParameterSweep(pref, RSIStrategy, dm, cm.OneMillion, grid, num_workers = num_workers)
+        results[num_workers] = sweep.run()
+        print(f"{len(results[num_workers])} combinations with {num_workers} workers in {sweep.run_time:.2f}s")
+    pd.testing.assert_frame_equal(results[1], results[4])
+
+    # a single run gives the same performance
+    rsi = RSIStrategy(pref, loader.get_daily_datamatrix(), cm.OneMillion, lower_bound = 30, upper_bound = 70,
+                      target_gain_percentage = 2.0, max_loss_percentage = -0.5)
+    rsi.run_strategy()
+    row = results[1].query('lower_bound == 30 and upper_bound == 70 and target_gain_percentage == 2.0 and max_loss_percentage == -0.5')
+    print(rsi.performance, row.iloc[0].to_dict())
+    print(get_best(results[1], count = 5))
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    sys.path.append(os.path.join(os.getcwd(), os.pardir, 'strategy'))
+    _test()
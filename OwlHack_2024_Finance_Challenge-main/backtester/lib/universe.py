@@ -0,0 +1,234 @@
+'''
+Registry of the universes and of the data available for their tickers
+'''
+
+import os
+import glob
+import json
+import hashlib
+import datetime
+import threading
+import collections
+
+import common as cm
+
+from loader import DataLoader
+from pricedb import PriceDB
+
+
+# where the prices of a ticker are and which dates they cover
+TickerCoverage = collections.namedtuple('TickerCoverage', ['fname', 'first_date', 'last_date', 'rows'])
+
+
+class UniverseRegistry(object):
+
+    '''
+    Index of ticker -> (file path, first date, last date, row count) for a data directory, and the components
+    of the meta universes.
+
+    The index is built by counting the lines of every price file and reading its first and last date, without
+    parsing the prices, and is saved in the cache directory with the size and mtime of each file, so later runs only rescan the files that changed.
+    Lookups, missing ticker checks and coverage filters are then answered without opening any price file.
+    With the SQLITE data source the index is a single aggregate query on the price database.
+    '''
+
+    version = 1
+
+    def __init__(self, pref, data_dir = None, data_src = DataLoader.DataSource.CSV, db_connection = None):
+        self.pref = pref
+        self.data_dir = pref.train_data_dir if data_dir is None else data_dir
+        self.data_src = data_src
+        self.db_connection = pref.price_db if db_connection is None else db_connection
+        self.coverage = None
+        self.refresh()
+
+    @property
+    def dataset(self):
+        return os.path.basename(os.path.normpath(self.data_dir))
+
+    def _get_index_fname(self):
+        cache_dir = getattr(self.pref, 'cache_dir', None)
+        if not getattr(self.pref, 'use_price_cache', False) or cache_dir is None:
+            return None
+        digest = hashlib.sha1(os.path.abspath(self.data_dir).encode('utf-8')).hexdigest()[:10]
+        return os.path.join(cache_dir, f"universe-{self.dataset}-{digest}.json")
+
+    @staticmethod
+    def _parse_ticker(fname):
+        ticker = os.path.splitext(os.path.basename(fname))[0]
+        return ticker[:-len('_daily')] if ticker.endswith('_daily') else ticker
+
+    @staticmethod
+    def scan_file(fname):
+        '''
+        return the first date, last date and number of rows of a price file without parsing it
+        '''
+        with open(fname, 'rb') as fin:
+            data = fin.read()
+        lines = data.rstrip(b'\n').split(b'\n', 2)
+        rows = data.count(b'\n') + (0 if data.endswith(b'\n') else 1) - 1
+        if len(lines) < 2 or rows <= 0:
+            return None, None, 0
+
+        first_date = lines[1][:10].decode('ascii')
+        last_date = data.rstrip(b'\n').rsplit(b'\n', 1)[-1][:10].decode('ascii')
+        return first_date, last_date, rows
+
+    def _scan_dir(self):
+        index_fname = self._get_index_fname()
+        saved = {}
+        if index_fname is not None and os.path.exists(index_fname):
+            try:
+                with open(index_fname, 'r') as fin:
+                    meta = json.load(fin)
+                if meta.get('version') == UniverseRegistry.version:
+                    saved = meta['files']
+            except (OSError, ValueError):
+                saved = {}
+
+        files = {}
+        for fname in sorted(glob.glob(os.path.join(self.data_dir, '*.csv'))):
+            st = os.stat(fname)
+            stat = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+            name = os.path.basename(fname)
+            if name in saved and saved[name]['stat'] == stat:
+                files[name] = saved[name]
+            else:
+                first_date, last_date, rows = UniverseRegistry.scan_file(fname)
+                files[name] = {'stat': stat, 'first_date': first_date, 'last_date': last_date, 'rows': rows}
+
+        if index_fname is not None and files != saved:
+            os.makedirs(os.path.dirname(index_fname), exist_ok = True)
+            tmp_fname = f"{index_fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_fname, 'w') as fout:
+                json.dump({'version': UniverseRegistry.version, 'data_dir': os.path.abspath(self.data_dir), 'files': files}, fout)
+            os.replace(tmp_fname, index_fname)
+
+        coverage = {}
+        for name, info in files.items():
+            ticker = UniverseRegistry._parse_ticker(name)
+            # SPY_daily.csv wins over SPY.csv, the same as DataLoader.get_price_fname
+            if ticker in coverage and not name.endswith('_daily.csv'):
+                continue
+            coverage[ticker] = TickerCoverage(os.path.join(self.data_dir, name),
+                                              None if info['first_date'] is None else cm.parse_date_str(info['first_date']),
+                                              None if info['last_date'] is None else cm.parse_date_str(info['last_date']),
+                                              info['rows'])
+        return coverage
+
+    def _query_db(self):
+        db = PriceDB(self.db_connection)
+        coverage = {}
+        for ticker, first_date, last_date, rows in db.get_coverage(self.dataset):
+            coverage[ticker] = TickerCoverage(None, cm.parse_date_str(first_date), cm.parse_date_str(last_date), rows)
+        return coverage
+
+    def refresh(self):
+        '''
+        bring the index up to date with the data directory or the price database
+        '''
+        if self.data_src == DataLoader.DataSource.SQLITE:
+            self.coverage = self._query_db()
+        else:
+            self.coverage = self._scan_dir()
+        return(self)
+
+    def get_universe(self, name):
+        '''
+        components of a meta universe, e.g. 'S&P 500'
+        '''
+        return cm.get_index_components(name, self.pref.meta_data_dir)
+
+    def get_coverage(self, ticker):
+        return self.coverage.get(ticker)
+
+    def get_missing(self, tickers):
+        '''
+        tickers without any price in the data directory
+        '''
+        return [ticker for ticker in tickers if ticker not in self.coverage or self.coverage[ticker].rows == 0]
+
+    def validate(self, tickers):
+        '''
+        raise before anything is loaded when some tickers have no prices
+        '''
+        missing = self.get_missing(tickers)
+        if len(missing) > 0:
+            # files might have been added since the index was built
+            missing = self.refresh().get_missing(tickers)
+        if len(missing) > 0:
+            raise Exception(f"Cannot find prices for {len(missing)} tickers in {self.data_dir}: {missing[:20]}"
+                            + (' ...' if len(missing) > 20 else ''))
+
+    def filter(self, tickers, start_date = None, end_date = None, min_rows = 1, tolerance_days = 7):
+        '''
+        keep the tickers, in their order, whose prices cover start_date to end_date and have at least min_rows rows.
+        The first and last prices may be tolerance_days inside the range, as the range ends can be holidays.
+        '''
+        tolerance = datetime.timedelta(days = tolerance_days)
+        result = []
+        for ticker in tickers:
+            info = self.coverage.get(ticker)
+            if info is None or info.rows < min_rows or info.rows == 0:
+                continue
+            if start_date is not None and info.first_date > start_date + tolerance:
+                continue
+            if end_date is not None and info.last_date < end_date - tolerance:
+                continue
+            result.append(ticker)
+        return(result)
+
+    def describe(self, tickers):
+        '''
+        one line per ticker with its coverage
+        '''
+        lines = []
+        for ticker in tickers:
+            info = self.coverage.get(ticker)
+            if info is None:
+                lines.append(f"{ticker:<8} missing")
+            else:
+                lines.append(f"{ticker:<8} {info.first_date} {info.last_date} {info.rows:>6} rows")
+        return '\n'.join(lines)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_universe_registry(pref, data_dir = None, data_src = DataLoader.DataSource.CSV, db_connection = None):
+    '''
+    registry shared by every loader of the process for the same data directory, refreshed when requested again
+    '''
+    data_dir = pref.train_data_dir if data_dir is None else data_dir
+    key = (os.path.abspath(data_dir), data_src, str(db_connection))
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = UniverseRegistry(pref, data_dir, data_src, db_connection)
+        return _registries[key]
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import time
+    from preference import Preference
+
+    pref = Preference()
+    start = time.time()
+    registry = UniverseRegistry(pref, data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    print(f"index of {len(registry.coverage)} tickers in {time.time() - start:.4f}s")
+
+    start = time.time()
+    registry = UniverseRegistry(pref, data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    print(f"reloaded in {time.time() - start:.4f}s")
+
+    tickers = registry.get_universe('ETF') + ['XYZ']
+    print(registry.describe(tickers))
+    print(registry.get_missing(tickers))
+    print(registry.filter(sorted(registry.coverage.keys()), datetime.date(2000, 1, 1), datetime.date(2023, 1, 1)))
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    _test()
@@ -0,0 +1,235 @@
+'''
+Walk-forward optimization of the parameters of a strategy
+'''
+
+import os
+import enum
+import time
+import collections
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+import common as cm
+
+from datamatrix import DataMatrix
+from sweep import ParameterSweep, get_best
+from sharedmatrix import SharedDataMatrix, attach_datamatrix
+
+
+# positions of a window: in-sample periods of the in-sample DataMatrix, out-of-sample periods of the
+# out-of-sample DataMatrix, stop excluded
+Window = collections.namedtuple('Window', ['in_sample_start', 'in_sample_stop', 'out_of_sample_start', 'out_of_sample_stop'])
+
+
+def run_window(pref, strategy_class, in_sample_dm: DataMatrix, out_of_sample_dm: DataMatrix, initial_capital,
+               param_grid, fixed_params, metric, window):
+    '''
+    sweep the parameters on the in-sample periods of the window, then run the best ones on its out-of-sample periods.
+    Return the chosen parameters, their in-sample and out-of-sample performance and the out-of-sample pnl.
+    '''
+    sweep = ParameterSweep(pref, strategy_class, in_sample_dm.get_periods(window.in_sample_start, window.in_sample_stop),
+                           initial_capital, param_grid, fixed_params, num_workers = 1)
+    best = get_best(sweep.run(), metric)
+    if len(best) == 0:
+        raise Exception(f"No combination of {strategy_class.__name__} could run on the in-sample periods of {window}")
+    params = {name: best[name].iloc[0] for name in param_grid.keys()}
+    params = {name: value.item() if isinstance(value, np.generic) else value for name, value in params.items()}
+
+    strategy = strategy_class(pref, out_of_sample_dm.get_periods(window.out_of_sample_start, window.out_of_sample_stop),
+                              initial_capital, **dict(fixed_params, **params))
+    strategy.validate()
+    strategy.run_strategy()
+    return {'params': params, 'in_sample': best[metric].iloc[0], 'performance': dict(strategy.performance),
+            'cumulative_pnl': strategy.pnl['cumulative_pnl'].to_numpy()}
+
+
+# state of a walk-forward worker process, set once by _init_worker
+_worker = {}
+
+def _init_worker(pref, strategy_class, in_sample_handle, out_of_sample_handle, initial_capital, param_grid, fixed_params, metric):
+    _worker['args'] = (pref, strategy_class, attach_datamatrix(in_sample_handle),
+                       attach_datamatrix(out_of_sample_handle), initial_capital, param_grid, fixed_params, metric)
+
+def _run_window(window):
+    return run_window(*_worker['args'], window)
+
+
+class WalkForward(object):
+
+    '''
+    Walk-forward optimization: the out-of-sample periods are split into consecutive windows of out_of_sample_periods.
+    For every window, the parameter grid is swept on the in_sample_periods just before it (ROLLING), or on all the
+    periods before it (EXPANDING, at least in_sample_periods), and the best parameters on metric are run on the window.
+    The out-of-sample pnl of the windows are then chained into a single equity curve.
+
+    The in-sample periods come from input_datamatrix and the out-of-sample periods from out_of_sample_datamatrix,
+    e.g. the train and test data sets, or from input_datamatrix as well when it is None.
+    The indicators are calculated once on each DataMatrix and every window works on views of them. With
+    num_workers > 1 the windows run in parallel on a process pool attached to the DataMatrix in shared memory.
+    '''
+
+    class Mode(enum.Enum):
+        ROLLING = 'rolling'
+        EXPANDING = 'expanding'
+
+    def __init__(self, pref, strategy_class, input_datamatrix: DataMatrix, initial_capital: float, param_grid,
+                 in_sample_periods = 504, out_of_sample_periods = 126, mode = Mode.ROLLING, fixed_params = None,
+                 metric = 'Sharpe Ratio', out_of_sample_datamatrix: DataMatrix = None, num_workers = None):
+        self.pref = pref
+        self.strategy_class = strategy_class
+        self.input_dm = input_datamatrix
+        self.out_of_sample_dm = out_of_sample_datamatrix
+        self.initial_capital = initial_capital
+        self.param_grid = param_grid
+        self.in_sample_periods = in_sample_periods
+        self.out_of_sample_periods = out_of_sample_periods
+        self.mode = WalkForward.Mode(mode)
+        self.fixed_params = {} if fixed_params is None else fixed_params
+        self.metric = metric
+        self.num_workers = num_workers if num_workers is not None else getattr(pref, 'num_workers', 1)
+
+        # output of the walk-forward
+        self.windows = None
+        self.pnl = None
+        self.run_time = None
+        self.performance = {'Cumulative Returns': -999,
+                            'Maximum Drawdown': -999,
+                            'Sharpe Ratio': -999}
+
+        if in_sample_periods < 2 or out_of_sample_periods < 2:
+            raise Exception(f"The in-sample and out-of-sample windows need at least 2 periods")
+
+    def get_windows(self):
+        '''
+        the windows of the walk-forward, the first one starts once in_sample_periods are available before it
+        '''
+        in_sample_index = self.input_dm.index
+        out_of_sample_index = in_sample_index if self.out_of_sample_dm is None else self.out_of_sample_dm.index
+
+        # number of in-sample periods strictly before each out-of-sample period
+        available = in_sample_index.searchsorted(out_of_sample_index, side = 'left')
+        feasible = np.nonzero(available >= self.in_sample_periods)[0]
+        if len(feasible) == 0 or len(out_of_sample_index) - feasible[0] < 2:
+            raise Exception(f"Not enough periods for a walk-forward with {self.in_sample_periods} in-sample and "
+                            f"{self.out_of_sample_periods} out-of-sample periods")
+
+        windows = []
+        for start in range(feasible[0], len(out_of_sample_index), self.out_of_sample_periods):
+            stop = min(start + self.out_of_sample_periods, len(out_of_sample_index))
+            # a last window of a single period has no pnl
+            if stop - start < 2:
+                break
+            in_sample_stop = available[start]
+            in_sample_start = in_sample_stop - self.in_sample_periods if self.mode == WalkForward.Mode.ROLLING else 0
+            windows.append(Window(in_sample_start, in_sample_stop, start, stop))
+        return(windows)
+
+    def _prepare(self, dm):
+        sweep = ParameterSweep(self.pref, self.strategy_class, dm, self.initial_capital, self.param_grid, self.fixed_params)
+        return sweep.prepare()
+
+    def run(self):
+        '''
+        run every window, return a DataFrame with a row per window: its dates, the chosen parameters,
+        their in-sample metric and their out-of-sample performance
+        '''
+        start = time.time()
+        windows = self.get_windows()
+        in_sample_dm = self._prepare(self.input_dm)
+        out_of_sample_dm = in_sample_dm if self.out_of_sample_dm is None else self._prepare(self.out_of_sample_dm)
+
+        if self.num_workers <= 1 or len(windows) <= 1:
+            results = [run_window(self.pref, self.strategy_class, in_sample_dm, out_of_sample_dm, self.initial_capital,
+                                  self.param_grid, self.fixed_params, self.metric, window) for window in windows]
+        else:
+            with SharedDataMatrix(in_sample_dm) as in_sample_shared:
+                out_of_sample_shared = in_sample_shared if self.out_of_sample_dm is None else SharedDataMatrix(out_of_sample_dm)
+                try:
+                    initargs = (self.pref, self.strategy_class, in_sample_shared.handle, out_of_sample_shared.handle,
+                                self.initial_capital, self.param_grid, self.fixed_params, self.metric)
+                    with concurrent.futures.ProcessPoolExecutor(max_workers = self.num_workers, initializer = _init_worker,
+                                                                initargs = initargs) as executor:
+                        results = list(executor.map(_run_window, windows))
+                finally:
+                    if out_of_sample_shared is not in_sample_shared:
+                        out_of_sample_shared.unlink()
+
+        rows = []
+        for window, result in zip(windows, results):
+            row = {'in_sample_start': in_sample_dm.index[window.in_sample_start],
+                   'in_sample_end': in_sample_dm.index[window.in_sample_stop - 1],
+                   'out_of_sample_start': out_of_sample_dm.index[window.out_of_sample_start],
+                   'out_of_sample_end': out_of_sample_dm.index[window.out_of_sample_stop - 1]}
+            row.update(result['params'])
+            row[f"in sample {self.metric}"] = result['in_sample']
+            row.update(result['performance'])
+            rows.append(row)
+        self.windows = pd.DataFrame(rows)
+
+        self._stitch(out_of_sample_dm, windows, results)
+        self.run_time = time.time() - start
+        return(self.windows)
+
+    def _stitch(self, dm, windows, results):
+        '''
+        chain the out-of-sample pnl of the windows: every window starts flat with the initial capital,
+        its pnl of each period is added to the equity at the end of the previous window
+        '''
+        period_pnl = np.concatenate([np.diff(result['cumulative_pnl'], prepend = 0.) for result in results])
+        window_id = np.concatenate([np.full(window.out_of_sample_stop - window.out_of_sample_start, k)
+                                    for k, window in enumerate(windows)])
+        index = dm.index[windows[0].out_of_sample_start:windows[-1].out_of_sample_stop]
+
+        self.pnl = pd.DataFrame({'window': window_id, 'cumulative_pnl': np.cumsum(period_pnl)}, index = index)
+        self.pnl['total_value'] = self.initial_capital + self.pnl['cumulative_pnl']
+        returns = self.pnl['cumulative_pnl'].diff(periods = 1) / self.pnl['total_value']
+        self.pnl[f"{dm.timeframe.value} pnl returns"] = returns
+
+        self.performance['Cumulative Returns'] = 100 * self.pnl['cumulative_pnl'].iloc[-1] / self.initial_capital
+        self.performance['Maximum Drawdown'] = cm.calculate_max_drawdown(self.pnl['total_value'])
+        self.performance['Sharpe Ratio'] = cm.calculate_sharpe_ratio(returns, self.pref.risk_free_rate)
+
+    def save_to_csv(self, output_dir):
+        '''
+        Save the windows and the stitched out-of-sample pnl to csv files
+        '''
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        fname = f"{self.strategy_class.__name__}_walkforward"
+        self.windows.to_csv(os.path.join(output_dir, f"{fname}_windows.csv"), index = False)
+        self.pnl.to_csv(os.path.join(output_dir, f"{fname}_pnl.csv"))
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import datetime
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+    from RSI_strategy import RSIStrategy
+
+    pref = Preference()
+    universe = ['SPY', 'QQQ', 'IWM', 'XLK', 'XLF']
+    loader = DataMatrixLoader(pref, 'walkforward', universe, datetime.date(2010, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    dm = loader.get_daily_datamatrix()
+
+    grid = {'lower_bound': [10, 20, 30], 'upper_bound': [70, 80, 90], 'target_gain_percentage': [0.5, 1.0, 2.0]}
+    results = {}
+    for mode in WalkForward.Mode:
+        for num_workers in [1, 4]:
+            walk = WalkForward(pref, RSIStrategy, dm, cm.OneMillion, grid, in_sample_periods = 504, out_of_sample_periods = 252,
+                               mode = mode, num_workers = num_workers)
+            results[(mode, num_workers)] = walk.run()
+            print(f"{mode.value}: {len(walk.windows)} windows with {num_workers} workers in {walk.run_time:.2f}s {walk.performance}")
+        pd.testing.assert_frame_equal(results[(mode, 1)], results[(mode, 4)])
+    print(results[(WalkForward.Mode.ROLLING, 1)].to_string())
+
+if __name__ == '__main__':
+    import sys
+    sys.path.append(os.getcwd())
+    sys.path.append(os.path.join(os.getcwd(), os.pardir, 'strategy'))
+    _test()
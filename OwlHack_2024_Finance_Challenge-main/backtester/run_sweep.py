@@ -0,0 +1,82 @@
+'''
+Script to sweep the parameters of a strategy, e.g.
+
+    python run_sweep.py --strategy RSIStrategy --param lower_bound=10,20,30 --param upper_bound=70:90:5 \
+        --param target_gain_percentage=0.5,1,2 --num_workers 8 --sweep_output rsi_sweep.csv
+'''
+
+# import native libraries
+import os
+import sys
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "strategy"))
+
+import pandas as pd
+
+# import the internal libraries
+import preference
+import common as cm
+import backtester
+from sweep import ParameterSweep, get_best, parse_param
+
+# import YOUR strategies here
+from RSI_strategy import RSIStrategy
+from MACD_Strategy import MACDStrategy
+from ADX_strategy import ADXStrategy
+from random_strategy import RandomStrategy
+from rule_strategy import RuleStrategy
+
+strategies = {cls.__name__: cls for cls in [RSIStrategy, MACDStrategy, ADXStrategy, RandomStrategy, RuleStrategy]}
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--universe_name',   dest='universe_name', default = 'OwlHack 2024 Universe', help='Name of the Universe')
+    parser.add_argument('--initial_capital', dest='initial_capital', default = cm.OneMillion, type = float, help='Initial Capital')
+    parser.add_argument('--random_seed', dest='random_seed', default = None, type = int, help='Random Seed')
+    parser.add_argument('--strategy', dest='strategy', default = 'RSIStrategy', choices = sorted(strategies.keys()), help='strategy to sweep')
+    parser.add_argument('--param', dest='params', action = 'append', default = [],
+                        help='swept parameter as name=v1,v2,... or name=start:stop:step, repeat for every parameter')
+    parser.add_argument('--fixed', dest='fixed', action = 'append', default = [],
+                        help='parameter passed to every run as name=value')
+    parser.add_argument('--metric', dest='metric', default = 'Sharpe Ratio',
+                        choices = ['Cumulative Returns', 'Maximum Drawdown', 'Sharpe Ratio'], help='metric to rank the combinations')
+    parser.add_argument('--sweep_output', dest='sweep_output', default = None, help='csv file of the sweep result')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    if pref.output_dir is None:
+        pref.output_dir = pref.test_output_dir
+
+    param_grid = dict([parse_param(txt) for txt in pref.params])
+    fixed_params = {name: values[0] for name, values in [parse_param(txt) for txt in pref.fixed]}
+    if len(param_grid) == 0:
+        raise Exception("Nothing to sweep, add at least one --param")
+
+    driver = backtester.Driver(pref)
+    dm = driver.datamatrix_loader.get_daily_datamatrix()
+
+    sweep = ParameterSweep(pref, strategies[pref.strategy], dm, pref.initial_capital, param_grid, fixed_params)
+    result = sweep.run()
+    print(f"{len(result)} combinations of {pref.strategy} in {sweep.run_time:.2f}s with {sweep.num_workers} workers")
+
+    if 'error' in result.columns:
+        print(f"{int(result['error'].notnull().sum())} combinations failed, e.g. {result['error'].dropna().iloc[0]}")
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(get_best(result, pref.metric, count = 10).to_string(index = False))
+
+    fname = pref.sweep_output
+    if fname is None:
+        fname = os.path.join(pref.output_dir, f"{pref.strategy}_sweep.csv")
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok = True)
+    result.to_csv(fname, index = False)
+    print(f"Saved the sweep to {fname}")
+
+if __name__ == "__main__":
+    run()
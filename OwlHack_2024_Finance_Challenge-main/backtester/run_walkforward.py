@@ -0,0 +1,98 @@
+'''
+Script to run a walk-forward optimization of a strategy, e.g. the in-sample windows on the train data and
+the out-of-sample windows on the test data:
+
+    python run_walkforward.py --strategy RSIStrategy --param lower_bound=10:30:5 --param upper_bound=70:90:5 \
+        --in_sample_periods 504 --out_of_sample_periods 63 --out_of_sample_data test --num_workers 8
+'''
+
+# import native libraries
+import os
+import sys
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "strategy"))
+
+import pandas as pd
+
+# import the internal libraries
+import preference
+import common as cm
+import backtester
+from sweep import parse_param
+from walkforward import WalkForward
+from datamatrix import DataMatrixLoader
+
+# import YOUR strategies here
+from RSI_strategy import RSIStrategy
+from MACD_Strategy import MACDStrategy
+from ADX_strategy import ADXStrategy
+from random_strategy import RandomStrategy
+from rule_strategy import RuleStrategy
+
+strategies = {cls.__name__: cls for cls in [RSIStrategy, MACDStrategy, ADXStrategy, RandomStrategy, RuleStrategy]}
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--universe_name',   dest='universe_name', default = 'OwlHack 2024 Universe', help='Name of the Universe')
+    parser.add_argument('--initial_capital', dest='initial_capital', default = cm.OneMillion, type = float, help='Initial Capital')
+    parser.add_argument('--random_seed', dest='random_seed', default = None, type = int, help='Random Seed')
+    parser.add_argument('--strategy', dest='strategy', default = 'RSIStrategy', choices = sorted(strategies.keys()), help='strategy to optimize')
+    parser.add_argument('--param', dest='params', action = 'append', default = [],
+                        help='optimized parameter as name=v1,v2,... or name=start:stop:step, repeat for every parameter')
+    parser.add_argument('--fixed', dest='fixed', action = 'append', default = [],
+                        help='parameter passed to every run as name=value')
+    parser.add_argument('--metric', dest='metric', default = 'Sharpe Ratio',
+                        choices = ['Cumulative Returns', 'Maximum Drawdown', 'Sharpe Ratio'], help='metric to optimize')
+    parser.add_argument('--in_sample_periods', dest='in_sample_periods', default = 504, type = int, help='periods of an in-sample window')
+    parser.add_argument('--out_of_sample_periods', dest='out_of_sample_periods', default = 126, type = int, help='periods of an out-of-sample window')
+    parser.add_argument('--window_mode', dest='window_mode', default = 'rolling', choices = ['rolling', 'expanding'],
+                        help='rolling in-sample windows of in_sample_periods, or expanding from the start date')
+    parser.add_argument('--out_of_sample_data', dest='out_of_sample_data', default = 'train', choices = ['train', 'test'],
+                        help='run the out-of-sample windows on the train data, or on the test data')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    if pref.output_dir is None:
+        pref.output_dir = pref.test_output_dir
+
+    param_grid = dict([parse_param(txt) for txt in pref.params])
+    fixed_params = {name: values[0] for name, values in [parse_param(txt) for txt in pref.fixed]}
+    if len(param_grid) == 0:
+        raise Exception("Nothing to optimize, add at least one --param")
+
+    driver = backtester.Driver(pref)
+    dm = driver.datamatrix_loader.get_daily_datamatrix()
+
+    out_of_sample_dm = None
+    if pref.out_of_sample_data == 'test':
+        loader = DataMatrixLoader(pref, pref.universe_name, driver.universe, pref.start_date, pref.end_date,
+                                  data_src = driver.data_src, data_dir = pref.test_data_dir)
+        out_of_sample_dm = loader.get_daily_datamatrix()
+
+    walk = WalkForward(pref, strategies[pref.strategy], dm, pref.initial_capital, param_grid,
+                       pref.in_sample_periods, pref.out_of_sample_periods, pref.window_mode, fixed_params,
+                       pref.metric, out_of_sample_dm)
+    windows = walk.run()
+    print(f"{len(windows)} windows of {pref.strategy} in {walk.run_time:.2f}s with {walk.num_workers} workers")
+
+    with pd.option_context('display.width', 250, 'display.max_columns', None):
+        print(windows.to_string(index = False))
+
+    print(f"""
+Out-of-sample Performance:
+    Cumulative Return:     {walk.performance['Cumulative Returns']:.3f}%
+    Sharpe Ratio:          {walk.performance['Sharpe Ratio']:.3f}
+    Max Drawdown:          {walk.performance['Maximum Drawdown']:.3f}%
+    """)
+
+    walk.save_to_csv(pref.output_dir)
+    print(f"Saved the walk-forward to {pref.output_dir}")
+
+if __name__ == "__main__":
+    run()
@@ -1,8 +1,8 @@
 import datetime
 import pandas as pd
-import pandas_ta as ta
 
 import common as cm
+import indicators
 from strategy import Strategy
 from datamatrix import DataMatrix, DataMatrixLoader
 
@@ -35,82 +35,34 @@ class ADXStrategy(Strategy):
         '''
         Calculate ADX, +DI, and -DI for each ticker
         '''
-        for ticker in self.universe:
-            high = self.input_dm[f"{ticker}_{cm.DataField.high}"]
-            low = self.input_dm[f"{ticker}_{cm.DataField.low}"]
-            close = self.input_dm[f"{ticker}_{cm.DataField.close}"]
+        high = self.input_dm.get_field_values(cm.DataField.high)
+        low = self.input_dm.get_field_values(cm.DataField.low)
+        close = self.input_dm.get_field_values(cm.DataField.close)
+
+        # Calculate ADX, +DI, and -DI for all tickers at once
+        adx, dip, dim = indicators.adx(high, low, close, length=14)
+        self.input_dm.set_fields({'ADX': adx, 'DIP': dip, 'DIM': dim})
 
-            # Calculate ADX, +DI, and -DI
-            adx_df = ta.adx(high, low, close, length=14)
-            self.input_dm[f"{ticker}_ADX"] = adx_df['ADX_14']
-            self.input_dm[f"{ticker}_DIP"] = adx_df['DMP_14']
-            self.input_dm[f"{ticker}_DIM"] = adx_df['DMN_14']
+    def prepare_indicators(self):
+        if not self.has_fields(['ADX', 'DIP', 'DIM']):
+            self._calc_ADX()
 
     def run_model(self, model=None):
         '''
         Generate trade signals and shares based on ADX strategy
         '''
-        self._calc_ADX()
-
-        nrow, ncol = self.pricing_matrix.shape
-        taction = self.pricing_matrix.copy()
-        tsignal = self.pricing_matrix.copy()
-        shares = self.pricing_matrix.copy()
-        current_shares_with_sign = self.pricing_matrix.copy()
-        dollar_exposure = self.initial_capital * self.risk_allocation_percentage / 100
-
-        taction = taction.map(lambda x: cm.TradeAction.NONE.value)
-        tsignal *= 0
-        shares *= 0
-        current_shares_with_sign *= 0
-
-        entry_day_index = {}
-        entry_price = {}
-
-        for j in range(ncol):
-            ticker = self.pricing_matrix.columns[j]
-            adx = self.input_dm[f"{ticker}_ADX"]
-            dip = self.input_dm[f"{ticker}_DIP"]
-            dim = self.input_dm[f"{ticker}_DIM"]
-
-            for i in range(1, nrow):
-                current_price = self.pricing_matrix.iloc[i, j]
-                current_shares_with_sign.iloc[i, j] = current_shares_with_sign.iloc[i-1, j]
-
-                if pd.isna(current_shares_with_sign.iloc[i-1, j]) or current_price == 0:
-                    continue
-
-                if current_shares_with_sign.iloc[i-1, j] != 0:
-                    ret = 100 * (current_price - entry_price[ticker]) / entry_price[ticker]
-                    if ret >= self.target_gain_percentage or ret < self.max_loss_percentage:
-                        if current_shares_with_sign.iloc[i-1, j] > 0:
-                            tsignal.iloc[i, j] = -1
-                            taction.iloc[i, j] = cm.TradeAction.SELL.value
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-                        elif current_shares_with_sign.iloc[i-1, j] < 0:
-                            tsignal.iloc[i, j] = 1
-                            taction.iloc[i, j] = cm.TradeAction.BUY.value
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                elif adx.iloc[i] > self.adx_threshold:
-                    if dip.iloc[i] > dim.iloc[i]:
-                        tsignal.iloc[i, j] = 1
-                        taction.iloc[i, j] = cm.TradeAction.BUY.value
-                        shares.iloc[i, j] = int(dollar_exposure / current_price)
-                        current_shares_with_sign.iloc[i, j] = shares.iloc[i, j]
-                        entry_day_index[ticker] = i
-                        entry_price[ticker] = self.pricing_matrix.iloc[i, j]
-                    elif dim.iloc[i] > dip.iloc[i] and current_shares_with_sign.iloc[i-1, j] == 0:
-                        tsignal.iloc[i, j] = -1
-                        taction.iloc[i, j] = cm.TradeAction.SELL.value
-                        shares.iloc[i, j] = int(dollar_exposure / current_price)
-                        current_shares_with_sign.iloc[i, j] = -shares.iloc[i, j]
-                        entry_day_index[ticker] = i
-                        entry_price[ticker] = self.pricing_matrix.iloc[i, j]
-
-        return tsignal, taction, shares
+        self.prepare_indicators()
+
+        adx = self.input_dm.get_field_values('ADX')
+        dip = self.input_dm.get_field_values('DIP')
+        dim = self.input_dm.get_field_values('DIM')
+
+        trending = adx > self.adx_threshold
+        entry_long = trending & (dip > dim)
+        entry_short = trending & (dim > dip)
+
+        return self.run_entry_exit(entry_long, entry_short, self.risk_allocation_percentage,
+                                   self.target_gain_percentage, self.max_loss_percentage)
 
 
 def _test_adx():
@@ -6,6 +6,10 @@ from datamatrix import DataMatrix, DataMatrixLoader
 class CustomStrategy(Strategy):
     '''
 		Write your custom trading strategy below
+
+        Entry and exit conditions can also be declared as rules, e.g. 'RSI < 20' or
+        'close > SMA_200 and MACD crosses_above MACD_Signal', without writing run_model:
+        see RuleStrategy in rule_strategy.py and the rule language in lib/rules.py
     '''
     def __init__(self,
 	    pref,
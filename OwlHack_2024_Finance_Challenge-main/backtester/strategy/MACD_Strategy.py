@@ -4,9 +4,10 @@ Classes for MACD Strategy
 
 import datetime
 import pandas as pd
-import pandas_ta as ta
+import numpy as np
 
 import common as cm
+import indicators
 from strategy import Strategy
 from datamatrix import DataMatrix, DataMatrixLoader
 
@@ -39,24 +40,19 @@ class MACDStrategy(Strategy):
         '''
         Calculate MACD and signal line
         '''
-        for ticker in self.universe:
-            price = self.input_dm[f"{ticker}_{cm.DataField.close}"]
+        close = self.input_dm.get_field_values(cm.DataField.close)
 
-            # Check if price data is sufficient
-            if price.isnull().all() or len(price) < 26:
+        # Check if price data is sufficient
+        for j, ticker in enumerate(self.universe):
+            if np.isnan(close[:, j]).all() or len(close) < 26:
                 raise Exception(f"Insufficient price data for {ticker} to calculate MACD.")
 
-            macd = ta.macd(price)
-
-            # Print the output for debugging
-            # print(f"MACD Output for {ticker}:\n", macd)
+        macd, histogram, signal = indicators.macd(close, 12, 26, 9)
+        self.input_dm.set_fields({'MACD': macd, 'MACD_Signal': signal})
 
-            # Check for expected columns
-            if 'MACD_12_26_9' in macd.columns and 'MACDs_12_26_9' in macd.columns:
-                self.input_dm[f"{ticker}_MACD"] = macd['MACD_12_26_9']
-                self.input_dm[f"{ticker}_MACD_Signal"] = macd['MACDs_12_26_9']
-            else:
-                raise Exception(f"MACD calculation for {ticker} does not have expected columns.")
+    def prepare_indicators(self):
+        if not self.has_fields(['MACD', 'MACD_Signal']):
+            self._calc_MACD()
 
     def run_model(self, model=None):
         '''
@@ -64,76 +60,17 @@ class MACDStrategy(Strategy):
         '''
 
         # Calculate MACD and its signal line
-        self._calc_MACD()
-
-        MACD = 'MACD'
-        MACD_SIGNAL = 'MACD_Signal'
-
-        nrow, ncol = self.pricing_matrix.shape
-        taction = self.pricing_matrix.copy()
-        tsignal = self.pricing_matrix.copy()
-        shares = self.pricing_matrix.copy()
-        current_shares_with_sign = self.pricing_matrix.copy()
-        dollar_exposure = self.initial_capital * self.risk_allocation_percentage / 100
-
-        taction = taction.map(lambda x: cm.TradeAction.NONE.value)
-        tsignal *= 0
-        shares *= 0
-        current_shares_with_sign *= 0
-
-        # Remember the price and the date index when a trade was put on by ticker
-        entry_day_index = {}
-        entry_price = {}
-
-        for j in range(ncol):
-            ticker = self.pricing_matrix.columns[j]
-            macd = self.input_dm[f"{ticker}_MACD"]
-            macd_signal = self.input_dm[f"{ticker}_MACD_Signal"]
-
-            for i in range(1, nrow):
-                current_price = self.pricing_matrix.iloc[i, j]
-                current_shares_with_sign.iloc[i, j] = current_shares_with_sign.iloc[i - 1, j]
-
-                if pd.isna(current_shares_with_sign.iloc[i - 1, j]) or current_price == 0:
-                    continue
-
-                # A position exists already, check if one can exit the current position
-                if current_shares_with_sign.iloc[i - 1, j] != 0:
-                    ret = 100 * (current_price - entry_price[ticker]) / entry_price[ticker]
-
-                    # Reach target gain or exceed max loss, close position
-                    if ret >= self.target_gain_percentage or ret < self.max_loss_percentage:
-                        # If it was long, sell
-                        if current_shares_with_sign.iloc[i - 1, j] > 0:
-                            tsignal.iloc[i, j] = -1
-                            taction.iloc[i, j] = cm.TradeAction.SELL.value
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i - 1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-                        # If it were short, buy back
-                        elif current_shares_with_sign.iloc[i - 1, j] < 0:
-                            tsignal.iloc[i, j] = 1
-                            taction.iloc[i, j] = cm.TradeAction.BUY.value
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i - 1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                # Check for entry signals (crossovers)
-                elif macd.iloc[i] > macd_signal.iloc[i] and current_shares_with_sign.iloc[i - 1, j] == 0:
-                    tsignal.iloc[i, j] = 1
-                    taction.iloc[i, j] = cm.TradeAction.BUY.value
-                    shares.iloc[i, j] = int(dollar_exposure / current_price)
-                    current_shares_with_sign.iloc[i, j] = shares.iloc[i, j]
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = current_price
-
-                elif macd.iloc[i] < macd_signal.iloc[i] and current_shares_with_sign.iloc[i - 1, j] == 0:
-                    tsignal.iloc[i, j] = -1
-                    taction.iloc[i, j] = cm.TradeAction.SELL.value
-                    shares.iloc[i, j] = int(dollar_exposure / current_price)
-                    current_shares_with_sign.iloc[i, j] = -1 * shares.iloc[i, j]
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = current_price
-
-        return tsignal, taction, shares
+        self.prepare_indicators()
+
+        macd = self.input_dm.get_field_values('MACD')
+        macd_signal = self.input_dm.get_field_values('MACD_Signal')
+
+        # Entry signals (crossovers)
+        entry_long = macd > macd_signal
+        entry_short = macd < macd_signal
+
+        return self.run_entry_exit(entry_long, entry_short, self.risk_allocation_percentage,
+                                   self.target_gain_percentage, self.max_loss_percentage)
 
 
 def _test1():
@@ -4,9 +4,9 @@ Classes for Buy and Hold
 
 import datetime
 import pandas as pd
-import pandas_ta as ta
 
 import common as cm
+import indicators
 from strategy import Strategy
 from datamatrix import DataMatrix, DataMatrixLoader
 
@@ -45,9 +45,12 @@ class RSIStrategy(Strategy):
         '''
         As an illustration, calculate a second RSI indicator with a different period
         '''
-        for ticker in self.universe:
-            price = self.input_dm[f"{ticker}_{cm.DataField.close}"]
-            self.input_dm[f"{ticker}_RSI2"] = ta.rsi(price, timeperiod = 20)
+        close = self.input_dm.get_field_values(cm.DataField.close)
+        self.input_dm.set_field('RSI2', indicators.rsi(close, length = 20))
+
+    def prepare_indicators(self):
+        if not self.has_fields(['RSI2']):
+            self._calc_RSI()
 
     def run_model(self, model = None):
         '''
@@ -56,103 +59,15 @@ class RSIStrategy(Strategy):
         '''
 
         # as an illustration how one can add an new technical indicator for a particular strategy
-        self._calc_RSI()
-
-        RSI = cm.DataField.RSI.value
+        self.prepare_indicators()
 
         # when RSI is above 80, trade signal is sell, when RSI is below 20, trade signal is buy
-        nrow, ncol   = self.pricing_matrix.shape
-
-        taction = self.pricing_matrix.copy()
-        tsignal = self.pricing_matrix.copy()
-
-        # shares on trade execution
-        shares = self.pricing_matrix.copy()
-
-        # existing shares with sign
-        current_shares_with_sign = self.pricing_matrix.copy()
-        dollar_exposure = self.initial_capital * self.risk_allocation_percentage/100
-
-        taction = taction.map(lambda x: cm.TradeAction.NONE.value)
-        tsignal *= 0
-        shares  *= 0
-        current_shares_with_sign *= 0
-
-        # remember the price and the date index when a trade was put on by ticker
-        entry_day_index = {}
-        entry_price = {}
-
-        for j in range(ncol):
-            ticker = self.pricing_matrix.columns[j]
-            rsi = self.input_dm[f"{ticker}_{RSI}"]
-
-            for i in range(1, nrow):
-
-                current_price = self.pricing_matrix.iloc[i, j]
-                # propagate the previous current_shares to the current period
-                current_shares_with_sign.iloc[i, j] = current_shares_with_sign.iloc[i-1, j]
-
-                if self.pref.verbose:
-                    print(i, j, entry_price, entry_day_index, rsi[i])
-
-                if pd.isna(current_shares_with_sign.iloc[i-1, j]) or current_price == 0:
-                    continue
-
-                # a position exists already, check if one can exit the current position
-                if current_shares_with_sign.iloc[i-1, j] != 0:
-
-                    ret = 100 * (current_price - entry_price[ticker])/entry_price[ticker]
-
-                    # reach target gain or exceed max loss, close position
-                    if ret >= self.target_gain_percentage or ret < self.max_loss_percentage:
-
-                        # if it was long, sell
-                        if current_shares_with_sign.iloc[i-1, j] > 0:
-                            tsignal.iloc[i, j] = -1
-                            taction.iloc[i, j] = cm.TradeAction.SELL.value
-
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                        # if it were short, buy back
-                        elif current_shares_with_sign.iloc[i-1, j] < 0:
-                            tsignal.iloc[i, j] = 1
-                            taction.iloc[i, j] = cm.TradeAction.BUY.value
-
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                # if first time trigger, initialize buy or sell, positive shares for long, negative for short
-                elif rsi.iloc[i] < self.lower_bound:
-
-                    tsignal.iloc[i, j] = 1
-                    taction.iloc[i, j] = cm.TradeAction.BUY.value
-                    shares.iloc[i, j] = int(dollar_exposure/current_price)
-                    current_shares_with_sign.iloc[i, j] = shares.iloc[i, j]
-
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = self.pricing_matrix.iloc[i, j]
-
-                elif rsi.iloc[i] > self.upper_bound and current_shares_with_sign.iloc[i-1, j] == 0:
-
-                    tsignal.iloc[i, j] = -1
-                    taction.iloc[i, j] = cm.TradeAction.SELL.value
-
-                    shares.iloc[i, j] = int(dollar_exposure/current_price)
-                    current_shares_with_sign.iloc[i, j] = -1* shares.iloc[i, j]
-
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = self.pricing_matrix.iloc[i, j]
-
-                else:
-                    # no trade (new or closing trades), do nothing except copying previous current shares
-                    pass
-
-        # print("tsignal", tsignal)
-        # print("taction", taction)
-        # print("shares", shares)
+        rsi = self.input_dm.get_field_values(cm.DataField.RSI)
+        entry_long = rsi < self.lower_bound
+        entry_short = rsi > self.upper_bound
 
-        return(tsignal, taction, shares)
+        return self.run_entry_exit(entry_long, entry_short, self.risk_allocation_percentage,
+                                   self.target_gain_percentage, self.max_loss_percentage)
 
 
 
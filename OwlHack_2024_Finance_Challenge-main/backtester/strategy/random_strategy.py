@@ -4,11 +4,13 @@ Classes for Buy and Hold
 
 import enum
 import datetime
+import numpy as np
 import pandas as pd
 
 import random
 
 import common as cm
+import engine
 from strategy import Strategy
 from datamatrix import DataMatrix, DataMatrixLoader
 
@@ -27,9 +29,9 @@ class RandomStrategy(Strategy):
         self.upper_bound = upper_bound
         self.risk_allocation_percentage = risk_allocation_percentage
 
-        # set random seed
-        if pref.random_seed is not None:
-            random.seed(pref.random_seed)
+        # own random stream, the same draws as seeding the random module but independent of its other users
+        # and of the process running the strategy (forked processes reseed the random module)
+        self.random = random.Random(pref.random_seed)
 
     def validate(self):
         '''
@@ -53,91 +55,103 @@ class RandomStrategy(Strategy):
         return a trade signal and its corresponding shares
         '''
 
-        # when RSI is above 80, trade signal is sell, when RSI is below 20, trade signal is buy
-        nrow, ncol   = self.pricing_matrix.shape
+        # one draw per ticker and period with a price, in the order of the original per-ticker loop
+        rnd = engine.draw_uniform_by_ticker(self.pricing_matrix.to_numpy(), self.random.random)
 
-        taction = self.pricing_matrix.copy()
-        tsignal = self.pricing_matrix.copy()
-        # shares on trade execution
-        shares = self.pricing_matrix.copy()
+        # randomly decide to go long (rnd > upper bound) or go short (rnd < lower bound),
+        # and to close an existing position on either
+        entry_long = rnd > self.upper_bound
+        entry_short = rnd < self.lower_bound
 
-        # existing shares with sign
-        current_shares_with_sign = self.pricing_matrix.copy()
-        dollar_exposure = self.initial_capital * self.risk_allocation_percentage/100
+        # a zero price period drops the position, as it always did
+        return self.run_entry_exit(entry_long, entry_short, self.risk_allocation_percentage,
+                                   exit_signal = entry_long | entry_short, hold_on_zero_price = False)
 
-        taction = taction.map(lambda x: cm.TradeAction.NONE.value)
-        tsignal *= 0
-        shares  *= 0
-        current_shares_with_sign *= 0
-
-        # remember the price and the date index when a trade was put on by ticker
-        entry_day_index = {}
-        entry_price = {}
-
-        for j in range(ncol):
-            ticker = self.pricing_matrix.columns[j]
-            for i in range(1, nrow):
-
-                current_price = self.pricing_matrix.iloc[i, j]
-
-                if current_price == 0:
-                    continue
-
-                # propagate the previous current_shares to the current period
-                current_shares_with_sign.iloc[i, j] = current_shares_with_sign.iloc[i-1, j]
-
-                rnd = random.random()
-
-                if self.pref.verbose:
-                    print(i, j, entry_price, entry_day_index, rnd)
-
-                # a position exists already, randomly decide to exit the position or not
-                if current_shares_with_sign.iloc[i-1, j] != 0:
-                    # randomly decide whether to close it or not
-                    if rnd > self.upper_bound or rnd < self.lower_bound:
-                        # if it was long, sell
-                        if current_shares_with_sign.iloc[i-1, j] > 0:
-                            tsignal.iloc[i, j] = -1
-                            taction.iloc[i, j] = cm.TradeAction.SELL.value
-
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                        # if it were short, buy back
-                        elif current_shares_with_sign.iloc[i-1, j] < 0:
-                            tsignal.iloc[i, j] = 1
-                            taction.iloc[i, j] = cm.TradeAction.BUY.value
-
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-
-                # randomly decide to go long (when rand > 0.8) or go short (rand is < 0.2)
-                elif rnd > self.upper_bound and current_shares_with_sign.iloc[i-1, j] == 0:
-
-                    tsignal.iloc[i, j] = 1
-                    taction.iloc[i, j] = cm.TradeAction.BUY.value
-                    shares.iloc[i, j] = int(dollar_exposure/current_price)
-                    current_shares_with_sign.iloc[i, j] = shares.iloc[i, j]
-
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = self.pricing_matrix.iloc[i, j]
+    def get_ensemble_draws(self, seed_sequence, paths):
+        '''
+        (date x path x ticker) uniform draws of the ensemble paths. Every path draws the periods of each ticker
+        in turn from its own Generator spawned from seed_sequence, so a path has the same draws whatever the batch
+        it runs in. Cells run_model does not draw for (first period, zero price) are NaN.
+        '''
+        prices = self.pricing_matrix.to_numpy()
+        nrow, ncol = prices.shape
+        rnd = np.empty((nrow, len(paths), ncol))
+        for k, path in enumerate(paths):
+            seq = np.random.SeedSequence(seed_sequence.entropy, spawn_key = tuple(seed_sequence.spawn_key) + (path,))
+            rnd[:, k, :] = np.random.Generator(np.random.PCG64(seq)).random((ncol, nrow)).T
+        rnd[0] = np.nan
+        rnd[np.broadcast_to((prices == 0)[:, None, :], rnd.shape)] = np.nan
+        return rnd
+
+    def run_ensemble(self, num_paths = 1000, seed = None, batch_size = None, max_batch_cells = 10 * cm.OneMillion):
+        '''
+        Monte Carlo ensemble of the strategy: num_paths random paths, batch_size of them simulated together by
+        running the entry / exit kernel on the universe repeated once per path.
+        batch_size defaults to as many paths as fit in max_batch_cells (date x ticker) cells, which bounds the
+        size of each of the arrays of a batch, 80 MB for a float array with the default.
+        seed defaults to pref.random_seed, its entropy is kept in ensemble_entropy to reproduce the ensemble.
+        Return a DataFrame with the performance of every path, see get_ensemble_summary.
+        '''
+        seed_sequence = np.random.SeedSequence(self.pref.random_seed if seed is None else seed)
+        self.ensemble_entropy = seed_sequence.entropy
+
+        prices = self.pricing_matrix.to_numpy()
+        nrow, ncol = prices.shape
+        dollar_exposure = self.initial_capital * self.risk_allocation_percentage / 100
+        if batch_size is None:
+            batch_size = max(1, int(max_batch_cells // (nrow * ncol)))
+
+        result = []
+        for start in range(0, num_paths, batch_size):
+            paths = range(start, min(start + batch_size, num_paths))
+            rnd = self.get_ensemble_draws(seed_sequence, paths).reshape(nrow, len(paths) * ncol)
+            batch_prices = np.tile(prices, (1, len(paths)))
+
+            entry_long = rnd > self.upper_bound
+            entry_short = rnd < self.lower_bound
+            tsignal, shares, position = engine.run_entry_exit(batch_prices, entry_long, entry_short, dollar_exposure,
+                                                              exit_signal = entry_long | entry_short,
+                                                              hold_on_zero_price = False,
+                                                              engine = getattr(self.pref, 'engine', 'auto'))
+            result.append(self._get_ensemble_performance(batch_prices, tsignal, shares, paths))
+
+        return pd.concat(result)
+
+    def _get_ensemble_performance(self, prices, tsignal, shares, paths):
+        '''
+        performance of every path of a batch, the same calculation as run_strategy with a path axis
+        '''
+        nrow = prices.shape[0]
+        prices = prices.reshape(nrow, len(paths), -1)
+        trades = (shares * tsignal).reshape(nrow, len(paths), -1)
 
-                elif rnd < self.lower_bound and current_shares_with_sign.iloc[i-1, j] == 0:
+        # missing prices do not count, as in the DataFrame sums of run_strategy
+        holding = np.cumsum(np.nan_to_num(trades), axis = 0)
+        equity_exposure = np.nansum(holding * prices, axis = 2)
+        trade_amt = np.nansum(trades * prices, axis = 2)
 
-                    tsignal.iloc[i, j] = -1
-                    taction.iloc[i, j] = cm.TradeAction.SELL.value
-                    shares.iloc[i, j] = int(dollar_exposure/current_price)
-                    current_shares_with_sign.iloc[i, j] = -1* shares.iloc[i, j]
+        growth = 1 + self.pref.risk_free_rate * self.days_between_periods/365
+        total_value = engine.accrue_cash(self.initial_capital, -trade_amt, growth) + equity_exposure
+        cumulative_pnl = total_value - self.initial_capital
+        returns = np.full(total_value.shape, np.nan)
+        returns[1:] = np.diff(cumulative_pnl, axis = 0) / total_value[1:]
 
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = self.pricing_matrix.iloc[i, j]
+        return pd.DataFrame({'Cumulative Returns': 100 * cumulative_pnl[-1] / self.initial_capital,
+                             'Maximum Drawdown': cm.calculate_max_drawdown_by_column(total_value),
+                             'Sharpe Ratio': cm.calculate_sharpe_ratio_by_column(returns, self.pref.risk_free_rate)},
+                            index = pd.Index(paths, name = 'path'))
 
-                else:
-                    # no trade (new or closing trades), do nothing except copying previous current shares
-                    pass
 
-        return(tsignal, taction, shares)
+def get_ensemble_summary(ensemble, performance = None):
+    '''
+    distribution of the performance of an ensemble. With the performance of another strategy, add the fraction
+    of random paths doing at least as well, i.e. the p-value of its performance against random trading.
+    '''
+    summary = ensemble.describe(percentiles = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99])
+    if performance is not None:
+        summary.loc['strategy'] = [performance[col] for col in summary.columns]
+        summary.loc['p-value'] = [(ensemble[col] >= performance[col]).mean() for col in summary.columns]
+    return summary
 
 
 
@@ -170,8 +184,39 @@ def _test1():
     print(f"Saving output to {pref.test_output_dir}")
     RSI.save_to_csv(pref.test_output_dir)
 
+def _test2():
+    import os
+    import time
+    from preference import Preference
+
+    pref = Preference()
+    universe = ['SPY', 'QQQ', 'IWM', 'XLK', 'XLF']
+    loader = DataMatrixLoader(pref, 'ensemble', universe, datetime.date(2013, 1, 1), datetime.date(2023, 1, 1),
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    dm = loader.get_daily_datamatrix()
+
+    strategy = RandomStrategy(pref, dm, cm.OneMillion, lower_bound = 0.1, upper_bound = 0.9)
+    start = time.time()
+    ensemble = strategy.run_ensemble(1000, seed = 7)
+    print(f"{len(ensemble)} paths in {time.time() - start:.2f}s")
+    print(get_ensemble_summary(ensemble, {'Cumulative Returns': 5.0, 'Maximum Drawdown': -5.0, 'Sharpe Ratio': 0.5}))
+
+    # a path of the ensemble gives the same performance as run_strategy with its draws
+    class EnsemblePath(RandomStrategy):
+        def run_model(self, model = None):
+            rnd = self.get_ensemble_draws(np.random.SeedSequence(7), [42])[:, 0, :]
+            entry_long, entry_short = rnd > self.upper_bound, rnd < self.lower_bound
+            return self.run_entry_exit(entry_long, entry_short, self.risk_allocation_percentage,
+                                       exit_signal = entry_long | entry_short, hold_on_zero_price = False)
+
+    path = EnsemblePath(pref, loader.get_daily_datamatrix(), cm.OneMillion, lower_bound = 0.1, upper_bound = 0.9)
+    path.run_strategy()
+    print(path.performance, ensemble.loc[42].to_dict())
+    np.testing.assert_allclose(list(path.performance.values()), ensemble.loc[42].to_numpy(), rtol = 1e-9)
+
 def _test():
     _test1()
+    _test2()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+'''
+Classes for strategies written as rules
+'''
+
+import datetime
+import numpy as np
+import pandas as pd
+
+import common as cm
+from strategy import Strategy
+from datamatrix import DataMatrix, DataMatrixLoader
+from rules import Rule, RuleContext
+
+class RuleStrategy(Strategy):
+
+    ''' Strategy declared with the rule language of the rules module, e.g.
+        RuleStrategy(pref, dm, cm.OneMillion, entry_long = 'RSI < 20', entry_short = 'RSI > 80',
+                     target_gain_percentage = 1.0, max_loss_percentage = -1.0)
+    1. Entry rule: long when entry_long is true, short when entry_short is true, only when flat
+    2. Exit rule: when the exit rule is true, or on a target gain percentage or a max loss percentage
+    3. Capital Allocation: based on a risk allocation percentage parameter.
+
+    indicators maps extra field names used by the rules to a function of the input DataMatrix
+    returning a (date x ticker) array.
+    '''
+    def __init__(self, pref, input_datamatrix: DataMatrix, initial_capital: float, price_choice = cm.DataField.close,
+                 entry_long = None, entry_short = None, exit = None, target_gain_percentage = None, max_loss_percentage = None,
+                 risk_allocation_percentage = 10, indicators = None, name = 'RuleStrategy'):
+        super().__init__(pref, name, input_datamatrix, initial_capital, price_choice)
+        self.entry_long = None if entry_long is None else Rule(entry_long)
+        self.entry_short = None if entry_short is None else Rule(entry_short)
+        self.exit = None if exit is None else Rule(exit)
+        self.target_gain_percentage = target_gain_percentage
+        self.max_loss_percentage = max_loss_percentage
+        self.risk_allocation_percentage = risk_allocation_percentage
+        self.indicators = indicators
+
+        if self.entry_long is None and self.entry_short is None:
+            raise Exception(f"{name} needs an entry_long or an entry_short rule")
+        if (target_gain_percentage is None) != (max_loss_percentage is None):
+            raise Exception(f"{name} needs both target_gain_percentage and max_loss_percentage or none of them")
+
+    def get_rules(self):
+        return [rule for rule in [self.entry_long, self.entry_short, self.exit] if rule is not None]
+
+    def validate(self):
+        '''
+        validate if the input_dm has the price and every field used by the rules
+        '''
+        columns = self.input_dm.columns
+        for ticker in self.universe:
+            col = f"{ticker}_{self.price_choice}"
+            if col not in columns:
+                raise Exception(f"Cannot find {col} for {ticker}")
+
+        context = RuleContext(self.input_dm, self.indicators)
+        for rule in self.get_rules():
+            for fld in rule.get_fields():
+                if context.resolve(fld) is None:
+                    raise Exception(f"Cannot find {fld} used in rule '{rule.text}'")
+
+    def prepare_indicators(self):
+        '''
+        store the indicators and the derived fields used by the rules as columns of input_dm,
+        so the runs sharing the DataMatrix calculate them once
+        '''
+        context = RuleContext(self.input_dm, self.indicators)
+        for rule in self.get_rules():
+            for fld in rule.get_fields():
+                name = context.resolve(fld)
+                if name is None or self.has_fields([name]):
+                    continue
+                self.input_dm.set_field(name, context.get_field(name))
+
+    def run_model(self, model = None):
+        '''
+        evaluate the rules for all dates and tickers at once, then enter and exit positions
+        '''
+        self.prepare_indicators()
+
+        # the indicators already stored in input_dm are read back instead of calculated again
+        indicators = {name: func for name, func in (self.indicators or {}).items() if not self.has_fields([name])}
+        context = RuleContext(self.input_dm, indicators)
+        no_signal = np.zeros(self.pricing_matrix.shape, dtype = bool)
+
+        entry_long = no_signal if self.entry_long is None else self.entry_long.evaluate(context)
+        entry_short = no_signal if self.entry_short is None else self.entry_short.evaluate(context)
+        exit_signal = None if self.exit is None else self.exit.evaluate(context)
+
+        return self.run_entry_exit(entry_long, entry_short, self.risk_allocation_percentage,
+                                   self.target_gain_percentage, self.max_loss_percentage, exit_signal)
+
+
+def _test1():
+    import os
+    from preference import Preference
+    from RSI_strategy import RSIStrategy
+
+    pref = Preference()
+    universe = ["SPY", "QQQ", "IWM"]
+    start_date = datetime.date(2013, 1, 1)
+    end_date = datetime.date(2023, 1, 1)
+
+    loader = DataMatrixLoader(pref, 'test_rules', universe, start_date, end_date,
+                              data_dir = os.path.join(pref.data_root_dir, 'ETF'))
+    dm = loader.get_daily_datamatrix()
+
+    # the RSI strategy written as rules gives the same trades
+    rules = RuleStrategy(pref, dm, cm.OneMillion, entry_long = 'RSI < 20', entry_short = 'RSI > 80',
+                         target_gain_percentage = 1.0, max_loss_percentage = -1.0)
+    rules.validate()
+    rules.run_strategy()
+
+    rsi = RSIStrategy(pref, loader.get_daily_datamatrix(), cm.OneMillion)
+    rsi.run_strategy()
+    pd.testing.assert_frame_equal(rules.tsignal, rsi.tsignal)
+    print(rules.performance)
+
+    trend = RuleStrategy(pref, dm, cm.OneMillion, entry_long = 'close > SMA_200 and SMA_50 crosses_above SMA_200',
+                         exit = 'SMA_50 crosses_below SMA_200', name = 'GoldenCross')
+    trend.validate()
+    trend.run_strategy()
+    print(trend.performance)
+
+def _test():
+    _test1()
+
+
+if __name__ == "__main__":
+    _test()